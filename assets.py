@@ -14,24 +14,166 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import re
+import io
+import hashlib
 import baseclasses
+import csg
 import helper
+import instancing
+import shaders
+import validate
+
+
+def write_object(f, obj):
+    """
+    \brief Write an object into a file, objects which can write themselves
+    (e.g. modifiers) are streamed instead of converted to a string first
+    """
+    if hasattr(obj, "write"):
+        obj.write(f)
+    else:
+        f.write(str(obj))
 
 
 class ObjectWriter(baseclasses.BaseAsset):
-    def __init__(self, objs, group="Group"):
+    def __init__(self, objs, group="Group", prefetch=True, threads=None,
+                 merge=False, validate=False, instancing=False,
+                 model_dir="models/instances", model_path=None,
+                 model_keyvalues=None):
+        """
+        \brief Write objects into a func_group
+        \param objs list of brushes, primitives and modifiers
+        \param group name of the func_group
+        \param prefetch resolve all texture sizes before writing
+        \param threads number of threads used for reading the textures
+        \param merge merge adjacent brushes whose union is convex before
+        writing, see csg.merge_brushes
+        \param validate check the geometry of all brushes before writing and
+        print a warning if there are invalid brushes, see validate.validate
+        \param instancing write the base object of modifiers with
+        transformations (Array, RandomScatter) once as an OBJ model and every
+        copy as a misc_model entity, see instancing.py
+        \param model_dir directory the models are written to, relative
+        paths are relative to the directory of the file given to save or,
+        when saving into a zip archive, to the root of the archive
+        \param model_path path of model_dir relative to the game directory,
+        used for the 'model' key, defaults to model_dir
+        \param model_keyvalues additional key/values of the misc_model
+        entities, e.g. {"spawnflags": "6"}
+        """
         super().__init__()
         self.objs = objs
         self.group = group
+        self.prefetch = prefetch
+        self.threads = threads
+        self.merge = merge
+        # brush and face counts before and after merging of the last write
+        self.merge_statistics = None
+        self.validate = validate
+        # validate.ValidationReport of the last write
+        self.validation = None
+        self.instancing = instancing
+        self.model_dir = model_dir
+        self.model_path = model_path
+        self.model_keyvalues = model_keyvalues
+        # directory of the file written by save, relative model directories
+        # are resolved against it
+        self._output_dir = None
+        # models to write into the archive given to save, name -> data
+        self._archive_models = None
+
+    def statistics(self):
+        """
+        \brief Number of brushes and faces written by this writer
+        """
+        return baseclasses.statistics(self.objs)
+
+    def prefetch_textures(self):
+        """
+        \brief Resolve the sizes of all textures used in the scene at once
+        """
+        textures = baseclasses.collect_textures(self.objs)
+        missing = shaders.prefetch_texture_sizes(textures, self.threads)
+        baseclasses.report_missing_textures(missing)
+
+    def save(self, path, member=None, compresslevel=6):
+        self._output_dir = os.path.dirname(os.path.abspath(path))
+        if member is not None and not os.path.isabs(self.model_dir):
+            self._archive_models = {}
+        try:
+            super().save(path, member, compresslevel)
+            models = self._archive_models or {}
+        finally:
+            self._output_dir = None
+            self._archive_models = None
+        if models:
+            import zipfile
+            with zipfile.ZipFile(path) as archive:
+                existing = set(archive.namelist())
+            # the names are content hashes, existing models are equal
+            for name, data in models.items():
+                if name not in existing:
+                    with helper.open_output(path, name, compresslevel) as f:
+                        f.write(data)
+
+    def write_models(self, objs):
+        """
+        \brief Write the base objects of modifiers as OBJ models, the files
+        are named by a hash of their content, so equal models share a file
+        \return list of the key/values of the misc_model entities
+        """
+        model_dir = os.path.join(self._output_dir or "", self.model_dir)
+        if self._archive_models is None:
+            os.makedirs(model_dir, exist_ok=True)
+        model_path = (self.model_path or self.model_dir).replace(os.sep, "/")
+        name = re.sub(r"[^\w.-]", "_", self.group)
+        entities = []
+        for obj in objs:
+            origin = instancing.model_origin(obj.obj)
+            f = io.StringIO()
+            instancing.write_obj(f, obj.obj, origin)
+            data = f.getvalue()
+            filename = "{}_{}.obj".format(
+                name, hashlib.sha1(data.encode()).hexdigest()[:12])
+            if self._archive_models is not None:
+                member = self.model_dir.replace(os.sep, "/").strip("/")
+                self._archive_models[member + "/" + filename] = data
+            else:
+                with open(os.path.join(model_dir, filename), "w") as f:
+                    f.write(data)
+            entities += instancing.model_entities(
+                obj.transforms(), origin, model_path + "/" + filename,
+                self.model_keyvalues)
+        return entities
 
     def write(self, f):
-        groupables = [obj for obj in self.objs if obj.isGroupable]
-        nongroupables = [obj for obj in self.objs if not obj.isGroupable]
+        if self.prefetch and not helper.geometry_only():
+            self.prefetch_textures()
+        objs = self.objs
+        entities = []
+        if self.instancing:
+            instanced = [obj for obj in objs if hasattr(obj, "transforms")]
+            objs = [obj for obj in objs if not hasattr(obj, "transforms")]
+            entities = self.write_models(instanced)
+        groupables = [obj for obj in objs if obj.isGroupable]
+        nongroupables = [obj for obj in objs if not obj.isGroupable]
+        if self.merge and groupables:
+            groupables, self.merge_statistics = csg.merge_objects(groupables)
+        if self.validate:
+            self.validation = validate.validate(groupables + nongroupables)
+            if not self.validation.ok:
+                print("WARNING: invalid brushes in group {}\n{}".format(
+                    self.group, self.validation))
         if groupables:
             with helper.group(f, self.group):
                 for obj in groupables:
-                    f.write(str(obj))
+                    write_object(f, obj)
         if nongroupables:
             with helper.worldspawn(f):
                 for obj in nongroupables:
-                    f.write(str(obj))
+                    write_object(f, obj)
+        for keyvalues in entities:
+            with helper.entity(f, keyvalues):
+                pass
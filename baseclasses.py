@@ -15,21 +15,403 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import numpy as np
-import copy
 import helper
+import session
 import shaders
 
 
+def texture_size(texture):
+    """
+    \brief Look up the size of a texture, falling back to (64, 64)
+    \param texture name of the shader
+    """
+    if helper.geometry_only():
+        return np.array([64, 64], dtype=np.float)
+    try:
+        return np.array(shaders.get_texture_size(texture), dtype=np.float)
+    except (KeyError, ValueError, OSError):
+        if texture not in session.current().reported_textures:
+            report_missing_textures([texture])
+        return np.array([64, 64], dtype=np.float)
+
+
+def report_missing_textures(textures):
+    """
+    \brief Print a single warning for all shaders that were not reported yet
+    in the current session
+    """
+    reported = session.current().reported_textures
+    textures = sorted(set(textures) - reported)
+    if len(textures) == 1:
+        print("WARNING: size of shader {} not found, "
+              "using a size of (64, 64)".format(textures[0]))
+    elif textures:
+        print("WARNING: sizes of {} shaders not found, using a size of "
+              "(64, 64):\n    {}".format(len(textures),
+                                         "\n    ".join(textures)))
+    reported.update(textures)
+
+
+def statistics(obj):
+    """
+    \brief Count the brushes and faces of an object
+    \param obj brush, primitive, modifier or an iterable of those
+    \return dictionary with the number of 'brushes' and 'faces'
+    """
+    brushes = 0
+    faces = 0
+    for brush in iter_brushes(obj):
+        brushes += 1
+        faces += len(brush.faces)
+    return {"brushes": brushes, "faces": faces}
+
+
+def collect_textures(obj):
+    """
+    \brief Return the set of all textures used by an object
+    Modifiers are not expanded, only the textures of their base object
+    are collected.
+    \param obj brush, primitive, modifier or an iterable of those
+    """
+    if isinstance(obj, Brush):
+        return {face.texture for face in obj.faces}
+    if hasattr(obj, "textures"):
+        return set(obj.textures)
+    if hasattr(obj, "obj"):
+        return collect_textures(obj.obj)
+    textures = set()
+    for child in obj:
+        textures |= collect_textures(child)
+    return textures
+
+
+def texture_matrices(angles, offsets, scales, texsizes):
+    """
+    \brief Compute the brush primitive texture matrices for many faces
+    \param angles texture rotation in degrees, shape (n,)
+    \param offsets texture offsets, shape (n, 2)
+    \param scales texture scales, shape (n, 2)
+    \param texsizes texture sizes, shape (n, 2)
+    \return rotation/scale part (n, 2, 2) and offset part (n, 2)
+    """
+    angles = np.deg2rad(np.asarray(angles, dtype=np.float64))
+    cos_angle = np.cos(angles)
+    sin_angle = np.sin(angles)
+    rot = np.stack([np.stack([cos_angle, sin_angle], axis=-1),
+                    np.stack([-sin_angle, cos_angle], axis=-1)], axis=-2)
+    texsizes = np.asarray(texsizes, dtype=np.float64)
+    rotscale = rot/(texsizes*np.asarray(scales, dtype=np.float64))[:, None, :]
+    return rotscale, -np.asarray(offsets, dtype=np.float64)/texsizes
+
+
+def texture_axes(normals):
+    """
+    \brief Texture projection axes of the brush primitives format
+    (ComputeAxisBase in Radiant and q3map2)
+    \param normals outward plane normals, shape (n, 3)
+    \return s and t axes, both of shape (n, 3), the texture coordinates of
+    a point p are rotscale @ [p.s, p.t] + off
+    """
+    normals = np.where(np.abs(normals) < 1e-6, 0, normals)
+    roty = -np.arctan2(normals[:, 2], np.hypot(normals[:, 0], normals[:, 1]))
+    rotz = np.arctan2(normals[:, 1], normals[:, 0])
+    saxis = np.stack([-np.sin(rotz), np.cos(rotz), np.zeros(len(rotz))],
+                     axis=-1)
+    taxis = np.stack([-np.sin(roty)*np.cos(rotz), -np.sin(roty)*np.sin(rotz),
+                      -np.cos(roty)], axis=-1)
+    return saxis, taxis
+
+
+def texture_params(rotscale, off, texsizes):
+    """
+    \brief Inverse of texture_matrices
+    \param rotscale rotation/scale part of the texture matrices (n, 2, 2)
+    \param off offset part of the texture matrices (n, 2)
+    \param texsizes texture sizes, shape (n, 2)
+    \return angles (n,), offsets (n, 2) and scales (n, 2)
+    """
+    rotscale = np.asarray(rotscale, dtype=np.float64)
+    texsizes = np.asarray(texsizes, dtype=np.float64)
+    col0 = rotscale[:, :, 0]
+    col1 = rotscale[:, :, 1]
+    angles = np.arctan2(-col0[:, 1], col0[:, 0])
+    # the sign of the second scale is not covered by the angle
+    sign = np.sign(col1[:, 0]*np.sin(angles) + col1[:, 1]*np.cos(angles))
+    sign[sign == 0] = 1
+    with np.errstate(divide="ignore"):
+        scales = 1/(texsizes*np.stack([np.linalg.norm(col0, axis=1),
+                                       sign*np.linalg.norm(col1, axis=1)],
+                                      axis=-1))
+    scales[~np.isfinite(scales)] = 1
+    offsets = -np.asarray(off, dtype=np.float64)*texsizes
+    return np.rad2deg(angles), offsets, scales
+
+
+def texture_sizes(textures):
+    """
+    \brief Look up the sizes of many textures, see texture_size
+    \return array of shape (n, 2)
+    """
+    texnames, texids = np.unique(np.asarray(textures, dtype=str),
+                                 return_inverse=True)
+    sizes = np.array([texture_size(t) for t in texnames]).reshape(-1, 2)
+    return sizes[texids.ravel()]
+
+
+def _plane_coordinates(verts, flipped=False):
+    """
+    \brief Coordinates of the plane points in the texture projection axes
+    of their plane, shape (n, 3, 2)
+    """
+    # Face.normal points into the brush
+    normals = -np.cross(verts[:, 1] - verts[:, 0], verts[:, 2] - verts[:, 0])
+    normals *= np.where(flipped, -1, 1)[..., None]
+    lengths = np.linalg.norm(normals, axis=1)
+    normals /= np.where(lengths > 0, lengths, 1)[:, None]
+    saxis, taxis = texture_axes(normals)
+    return np.stack([np.einsum('nvk,nk->nv', verts, saxis),
+                     np.einsum('nvk,nk->nv', verts, taxis)], axis=-1)
+
+
+def lock_texture_params(verts, newverts, textures, angles, offsets, scales,
+                        mirrored=False):
+    """
+    \brief Recompute the texture parameters of transformed faces so that
+    the textures stay on the same spots of the faces
+    The result is exact for moves and uniform scalings. Rotations within
+    the plane of a face are exact if size*scale of the texture is the same
+    along both axes, otherwise the texture would have to be sheared, which
+    the texture parameters can't express, and it is only approximated.
+    \param verts plane points before the transformation, shape (n, 3, 3)
+    \param newverts the same points after the transformation in the same
+    order, shape (n, 3, 3)
+    \param textures sequence of n texture names
+    \param angles texture rotation in degrees, shape (n,)
+    \param offsets texture offsets, shape (n, 2)
+    \param scales texture scales, shape (n, 2)
+    \param mirrored True for faces whose transformation mirrors them, their
+    plane points have to be reordered afterwards, scalar or shape (n,)
+    \return new angles (n,), offsets (n, 2) and scales (n, 2)
+    """
+    verts = np.asarray(verts, dtype=np.float64)
+    newverts = np.asarray(newverts, dtype=np.float64)
+    if len(verts) == 0:
+        return (np.zeros(0), np.zeros((0, 2)), np.ones((0, 2)))
+    sizes = texture_sizes(textures)
+    rotscale, off = texture_matrices(angles, offsets, scales, sizes)
+    old = _plane_coordinates(verts)
+    new = _plane_coordinates(newverts, mirrored)
+    # affine map from the new plane coordinates to the old ones
+    dold = np.swapaxes(old[:, 1:] - old[:, :1], 1, 2)
+    dnew = np.swapaxes(new[:, 1:] - new[:, :1], 1, 2)
+    det = dnew[:, 0, 0]*dnew[:, 1, 1] - dnew[:, 0, 1]*dnew[:, 1, 0]
+    valid = np.abs(det) > 1e-12
+    det[~valid] = 1
+    inverse = np.stack([np.stack([dnew[:, 1, 1], -dnew[:, 0, 1]], axis=-1),
+                        np.stack([-dnew[:, 1, 0], dnew[:, 0, 0]], axis=-1)],
+                       axis=-2)/det[:, None, None]
+    linear = dold @ inverse
+    shift = old[:, 0] - np.einsum('nij,nj->ni', linear, new[:, 0])
+    # degenerate faces keep their parameters
+    linear[~valid] = np.eye(2)
+    shift[~valid] = 0
+    newoff = np.einsum('nij,nj->ni', rotscale, shift) + off
+    return texture_params(rotscale @ linear, newoff, sizes)
+
+
+def lock_textures(faces, verts):
+    """
+    \brief Update the texture parameters of faces whose plane points were
+    changed, see lock_texture_params
+    \param faces list of Face objects
+    \param verts plane points of the faces before the change, shape (n, 3, 3)
+    """
+    if not faces:
+        return
+    data = np.array([face.data for face in faces], dtype=np.float64)
+    angles, offsets, scales = lock_texture_params(
+        verts, data[:, :9].reshape(-1, 3, 3), [face.texture for face in faces],
+        [face.angle for face in faces], data[:, 9:11], data[:, 11:13])
+    params = np.concatenate([offsets, scales], axis=1)
+    for face, angle, param in zip(faces, angles.tolist(), params):
+        face.angle = angle
+        face.data[9:13] = param
+
+
+def transform_brushes(brushes, matrix, texture_lock=False):
+    """
+    \brief Transform the faces of many brushes with one vectorized operation
+    \param brushes iterable of Brush objects, primitives generate their faces
+    on every access and have to be transformed by their own methods
+    \param matrix transformation for row vectors ([x y z 1] @ M), shape (4, 4)
+    \param texture_lock keep the textures fixed on the faces
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    faces = [face for brush in brushes for face in brush.faces]
+    if not faces:
+        return
+    data = np.array([face.data for face in faces], dtype=np.float64)
+    verts = data[:, :9].reshape(-1, 3, 3)
+    newverts = verts @ matrix[:3, :3] + matrix[3, :3]
+    mirrored = np.linalg.det(matrix[:3, :3]) < 0
+    if texture_lock:
+        angles, offsets, scales = lock_texture_params(
+            verts, newverts, [face.texture for face in faces],
+            [face.angle for face in faces], data[:, 9:11], data[:, 11:13],
+            mirrored)
+        data[:, 9:11] = offsets
+        data[:, 11:13] = scales
+        for face, angle in zip(faces, angles.tolist()):
+            face.angle = angle
+    # mirroring transformations flip the faces
+    if mirrored:
+        newverts = newverts[:, [0, 2, 1]]
+    data[:, :9] = newverts.reshape(-1, 9)
+    for face, row in zip(faces, data):
+        face.data[:] = row
+
+
+def format_faces(verts, textures, angles, offsets, scales):
+    """
+    \brief Vectorized version of Face.__str__ for many faces at once
+    \param verts plane points, shape (n, 3, 3)
+    \param textures sequence of n texture names
+    \param angles texture rotation in degrees, shape (n,)
+    \param offsets texture offsets, shape (n, 2)
+    \param scales texture scales, shape (n, 2)
+    \return list of n face definitions
+    """
+    verts = np.asarray(verts, dtype=np.float64)
+    n = len(verts)
+    if n == 0:
+        return []
+    texnames, texids = np.unique(np.asarray(textures, dtype=str),
+                                 return_inverse=True)
+    sizes = np.array([texture_size(t) for t in texnames])[texids.ravel()]
+    rotscale, off = texture_matrices(angles, offsets, scales, sizes)
+    rows = np.concatenate([verts.reshape(n, 9),
+                           rotscale[:, 0, :], off[:, 0, None],
+                           rotscale[:, 1, :], off[:, 1, None]],
+                          axis=1).tolist()
+    base = ('( {} {} {} ) ( {} {} {} ) ( {} {} {} ) ( ( {} {} {} )'
+            ' ( {} {} {} ) ) {} 0 0 0\n')
+    return [base.format(*row, texnames[i])
+            for row, i in zip(rows, texids.ravel().tolist())]
+
+
+def write_brushes(f, counts, verts, textures, angles, offsets, scales):
+    """
+    \brief Write brushes given as face arrays without creating Face objects
+    \param f file like object
+    \param counts number of faces of every brush
+    \param verts plane points of all faces, shape (n, 3, 3)
+    \param textures sequence of n texture names
+    \param angles texture rotation in degrees, shape (n,)
+    \param offsets texture offsets, shape (n, 2)
+    \param scales texture scales, shape (n, 2)
+    """
+    faces = format_faces(verts, textures, angles, offsets, scales)
+    pos = 0
+    for count in np.asarray(counts).tolist():
+        f.write(helper.brushdef.format(data="".join(faces[pos:pos+count])))
+        pos += count
+
+
+def face_arrays(brushes):
+    """
+    \brief Collect the data of all faces of the given brushes into arrays
+    \return dictionary with the face counts of the brushes, plane points,
+    textures and texture parameters
+    """
+    counts = []
+    faces = []
+    for brush in brushes:
+        brushfaces = brush.faces
+        counts.append(len(brushfaces))
+        faces.extend(brushfaces)
+    packed = np.array([face.data for face in faces],
+                      dtype=np.float64).reshape(-1, 13)
+    return {"counts": np.array(counts, dtype=np.int64),
+            "verts": packed[:, :9].reshape(-1, 3, 3),
+            "textures": np.array([face.texture for face in faces], dtype=str),
+            "angles": np.array([face.angle for face in faces],
+                               dtype=np.float64),
+            "offsets": packed[:, 9:11],
+            "scales": packed[:, 11:13]}
+
+
+def brushes_from_arrays(counts, verts, textures, angles, offsets, scales):
+    """
+    \brief Inverse of face_arrays, create Brush objects from face arrays
+    """
+    brushes = []
+    pos = 0
+    for count in np.asarray(counts).tolist():
+        brushes.append(Brush([
+            Face(v[0], v[1], v[2], str(tex), a, o[0], o[1], sc[0], sc[1])
+            for v, tex, a, o, sc in zip(verts[pos:pos+count],
+                                        textures[pos:pos+count],
+                                        angles[pos:pos+count],
+                                        offsets[pos:pos+count],
+                                        scales[pos:pos+count])]))
+        pos += count
+    return brushes
+
+
+def iter_brushes(obj, patches=False):
+    """
+    \brief Iterate over all brushes contained in an object
+    \param obj brush, primitive, modifier or an iterable of those
+    \param patches also generate the patches, primitives written as patches
+    then generate the brushes of their hull and their patches like they are
+    written, otherwise patches are skipped
+    """
+    if patches and getattr(obj, "output", "brush") == "patch":
+        yield from iter_brushes(obj.hull())
+        yield from obj.patches()
+        return
+    if isinstance(obj, Brush):
+        yield obj
+        return
+    if isinstance(obj, Patch):
+        if patches:
+            yield obj
+        return
+    for child in obj:
+        yield from iter_brushes(child, patches)
+
+
+def writes_patches(obj):
+    """
+    \brief True if an object or a part of it is written as patches
+    \param obj brush, primitive, modifier or a list of those
+    """
+    if isinstance(obj, Patch) or getattr(obj, "output", "brush") == "patch":
+        return True
+    if isinstance(obj, Brush):
+        return False
+    # modifiers copy a single object
+    if hasattr(obj, "obj"):
+        return writes_patches(obj.obj)
+    if isinstance(obj, (list, tuple)):
+        return any(writes_patches(child) for child in obj)
+    return False
+
+
 class BaseAsset(object):
     def write(self, f):
         raise NotImplementedError("This is an abstract class")
 
-    def save(self, path):
+    def save(self, path, member=None, compresslevel=6):
         """
         \brief Save the asset under a given name
-        \param path filename (may be relative)
+        \param path filename (may be relative), files ending with '.gz' are
+        gzip compressed, '.pk3' and '.zip' files are zip archives
+        \param member name of the file inside of a zip archive,
+        e.g. 'maps/mymap.map'
+        \param compresslevel compression level from 0 to 9
         """
-        with open(path, "w") as f:
+        with helper.open_output(path, member, compresslevel) as f:
             self.write(f)
 
 
@@ -69,37 +451,119 @@ class BasePrimitive(object):
 
 
 class Face(object):
+    # vertices, offset and scale are packed into a single array of 13 floats
+    __slots__ = ("_data", "texture", "angle", "_matrix")
+
     def __init__(self, v0, v1, v2, texture="common/caulk", angle=0,
                  x_off=0, y_off=0, x_scale=1, y_scale=1):
         super().__init__()
-        self.verts = [np.array(v0, dtype=np.float),
-                      np.array(v1, dtype=np.float),
-                      np.array(v2, dtype=np.float)]
+        data = np.empty(13, dtype=np.float64)
+        data[0:3] = v0
+        data[3:6] = v1
+        data[6:9] = v2
+        data[9:13] = (x_off, y_off, x_scale, y_scale)
+        self._data = data
         self.texture = texture
         self.angle = angle
-        self.offset = np.array([x_off, y_off], dtype=np.float)
-        self.scale = np.array([x_scale, y_scale], dtype=np.float)
+        self._matrix = None
+
+    @property
+    def data(self):
+        """
+        \brief Packed face data [v0, v1, v2, offset, scale], shape (13,)
+        """
+        return self._data
+
+    @property
+    def verts(self):
+        """
+        \brief The 3 plane points as an array of shape (3, 3), changing the
+        array changes the face
+        """
+        return self._data[:9].reshape(3, 3)
+
+    @verts.setter
+    def verts(self, value):
+        self._data[:9] = np.asarray(value, dtype=np.float64).reshape(9)
+
+    @property
+    def offset(self):
+        return self._data[9:11]
+
+    @offset.setter
+    def offset(self, value):
+        self._data[9:11] = value
+
+    @property
+    def scale(self):
+        return self._data[11:13]
+
+    @scale.setter
+    def scale(self, value):
+        self._data[11:13] = value
+
+    @property
+    def texture_matrix(self):
+        """
+        \brief Texture matrix of the brushDef format, shape (2, 3), as read
+        from a .map file, it is written instead of the matrix computed from
+        angle, offset and scale as long as the face is not changed
+        \return the matrix or None
+        """
+        if self._matrix is None:
+            return None
+        matrix, data, texture, angle = self._matrix
+        if (texture != self.texture or angle != self.angle or
+                not np.array_equal(data, self._data)):
+            return None
+        return matrix
+
+    @texture_matrix.setter
+    def texture_matrix(self, value):
+        self._matrix = None
+        if value is not None:
+            self._matrix = (np.array(value, dtype=np.float64).reshape(2, 3),
+                            self._data.copy(), self.texture, self.angle)
 
     def copy(self):
-        return copy.deepcopy(self)
+        """
+        \brief return an independent copy of the face
+        """
+        newface = Face.__new__(Face)
+        newface._data = self._data.copy()
+        newface.texture = self.texture
+        newface.angle = self.angle
+        newface._matrix = self._matrix
+        return newface
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return self.copy()
 
     @property
     def normal(self):
-        return np.cross(self.verts[1]-self.verts[0], self.verts[2]-self.verts[0])
+        verts = self.verts
+        return np.cross(verts[1]-verts[0], verts[2]-verts[0])
 
-    def move(self, offset):
+    def move(self, offset, texture_lock=False):
         """
         \brief move the face by a given offset (scalar or list of length 3)
+        \param texture_lock keep the texture fixed on the face
         """
-        for vert in self.verts:
-            vert += np.array(offset, dtype=np.float)
+        verts = self.verts
+        old = verts.copy() if texture_lock else None
+        verts += np.asarray(offset, dtype=np.float64)
+        if texture_lock:
+            lock_textures([self], old[None])
 
     def is_point_in_front(self, point):
         """
         \brief check if a point is in front of the face
         """
         # get a vector from some point on the face to the given point
-        point = np.array(point, dtype=np.float)
+        point = np.array(point, dtype=np.float64)
         vec = point - self.verts[0]
         # check the scalar product of this vector and the normal vector
         scalprod = np.dot(vec, self.normal)
@@ -112,7 +576,8 @@ class Face(object):
         """
         \brief flip the direction the face normal is pointing
         """
-        self.verts[1], self.verts[2] = self.verts[2], self.verts[1]
+        # swapping views of the packed array would copy the same row twice
+        self._data[3:9] = self._data[[6, 7, 8, 3, 4, 5]]
 
     def flipped(self):
         """
@@ -122,46 +587,52 @@ class Face(object):
         newface.flip()
         return newface
 
-    def rotate_point(self, center, rotation_matrix):
+    def rotate_point(self, center, rotation_matrix, texture_lock=False):
         """
         \brief rotate the face around the given center point
+        \param texture_lock keep the texture fixed on the face
         """
-        self.verts[0] = (self.verts[0] - center)@rotation_matrix + center
-        self.verts[1] = (self.verts[1] - center)@rotation_matrix + center
-        self.verts[2] = (self.verts[2] - center)@rotation_matrix + center
+        old = self.verts.copy() if texture_lock else None
+        self.verts = (self.verts - center)@rotation_matrix + center
+        if texture_lock:
+            lock_textures([self], old[None])
 
-    def rotated_point(self, center, rotation_matrix):
+    def rotated_point(self, center, rotation_matrix, texture_lock=False):
         """
         \brief return a copy of the face rotated around the given center point
         """
         newface = self.copy()
-        newface.rotate_point(center, rotation_matrix)
+        newface.rotate_point(center, rotation_matrix, texture_lock)
         return newface
 
     def __str__(self):
         base = ('{P0} {P1} {P2} ( ( {rs[0][0]} {rs[0][1]} {off[0]} )'
                 ' ( {rs[1][0]} {rs[1][1]} {off[1]} ) ) {tex} 0 0 0\n')
-
-        try:
-            texsize = np.array(shaders.get_texture_size(self.texture),
-                               dtype=np.float)
-        except (KeyError, ValueError):
-            print("WARNING: size of shader {} not found, "
-                  "using a size of (64, 64)".format(self.texture))
-            texsize = np.array([64, 64], dtype=np.float)
+        verts = self.verts.tolist()
+        matrix = self.texture_matrix
+        if matrix is not None:
+            matrix = matrix.tolist()
+            return base.format(P0=helper.point_to_str(verts[0]),
+                               P1=helper.point_to_str(verts[1]),
+                               P2=helper.point_to_str(verts[2]),
+                               rs=matrix, off=[row[2] for row in matrix],
+                               tex=self.texture)
+
+        texsize = texture_size(self.texture)
 
         cos_angle = np.cos(np.deg2rad(self.angle))
         sin_angle = np.sin(np.deg2rad(self.angle))
         rot = np.array([[cos_angle, sin_angle], [-sin_angle, cos_angle]])
         rotscale = rot/(texsize*self.scale)
-        return base.format(P0=helper.point_to_str(self.verts[0]),
-                           P1=helper.point_to_str(self.verts[1]),
-                           P2=helper.point_to_str(self.verts[2]),
+        return base.format(P0=helper.point_to_str(verts[0]),
+                           P1=helper.point_to_str(verts[1]),
+                           P2=helper.point_to_str(verts[2]),
                            rs=rotscale, off=-self.offset/texsize,
                            tex=self.texture)
 
 
 class Brush(object):
+    __slots__ = ("_faces",)
     isGroupable = True
 
     def __init__(self, faces):
@@ -185,13 +656,31 @@ class Brush(object):
                 raise TypeError("List of 'Face' objects expected")
         self._faces = faces
 
-    def move(self, offset):
+    def move(self, offset, texture_lock=False):
+        """
+        \brief move the brush by a given offset
+        \param texture_lock keep the textures fixed on the faces, all faces
+        are updated at once
+        """
+        old = (np.array([face.verts for face in self.faces])
+               if texture_lock else None)
         for face in self.faces:
             face.move(offset)
+        if texture_lock:
+            lock_textures(self.faces, old)
 
-    def rotate_point(self, center, rotation_matrix):
+    def rotate_point(self, center, rotation_matrix, texture_lock=False):
+        """
+        \brief rotate the brush around the given center point
+        \param texture_lock keep the textures fixed on the faces, all faces
+        are updated at once
+        """
+        old = (np.array([face.verts for face in self.faces])
+               if texture_lock else None)
         for face in self.faces:
             face.rotate_point(center, rotation_matrix)
+        if texture_lock:
+            lock_textures(self.faces, old)
 
     def scale(self, factor):
         # TODO: implement this function
@@ -202,9 +691,10 @@ class Brush(object):
         \brief create another brush by cutting this brush
         with the supplied faces
         """
-        faces = copy.deepcopy(self.faces)
+        faces = [face.copy() for face in self.faces]
         if unique_faces:
-            newfaces = copy.deepcopy(newfaces)
+            newfaces = [face.copy() if type(face) == Face else face
+                        for face in newfaces]
         for newface in newfaces:
             if type(newface) == Face:
                 faces.append(newface)
@@ -216,8 +706,16 @@ class Brush(object):
         """
         \brief return an independent copy of the brush
         """
-        faces = copy.deepcopy(self.faces)
-        return Brush(faces)
+        return self.clone()
+
+    def clone(self):
+        """
+        \brief return an independent copy of the brush as a plain Brush,
+        the faces are already validated and copied directly
+        """
+        brush = Brush.__new__(Brush)
+        brush._faces = [face.copy() for face in self.faces]
+        return brush
 
     def is_point_outside(self, point):
         """
@@ -230,3 +728,85 @@ class Brush(object):
         for face in self.faces:
             data += str(face)
         return helper.brushdef.format(data=data)
+
+
+class Patch(object):
+    isGroupable = True
+
+    def __init__(self, points, texture="common/caulk", texcoords=None):
+        """
+        \brief Bezier patch mesh (patchDef2)
+        \param points control points, shape (rows, cols, 3) with an odd
+        number of at least 3 rows and columns, the patch faces the side
+        where cross(d/dcolumn, d/drow) points to
+        \param texture texture of the patch
+        \param texcoords texture coordinates of the control points, shape
+        (rows, cols, 2), by default the texture is applied with its natural
+        size along the control net
+        """
+        self.points = np.array(points, dtype=np.float64)
+        rows, cols = self.points.shape[:2]
+        if rows < 3 or cols < 3 or rows % 2 == 0 or cols % 2 == 0:
+            raise ValueError("Patches need an odd number of at least 3 rows "
+                             "and columns")
+        self.texture = texture
+        self.texcoords = texcoords
+
+    @property
+    def textures(self):
+        return {self.texture}
+
+    @property
+    def center(self):
+        """
+        \brief Center of the bounding box of the control points
+        """
+        points = self.points.reshape(-1, 3)
+        return (points.min(axis=0) + points.max(axis=0))/2
+
+    @property
+    def size(self):
+        points = self.points.reshape(-1, 3)
+        return points.max(axis=0) - points.min(axis=0)
+
+    def move(self, offset):
+        self.points += np.array(offset, dtype=np.float64)
+
+    def rotate_point(self, center, rotation_matrix):
+        self.points = (self.points - center)@rotation_matrix + center
+
+    def transform(self, matrix):
+        """
+        \brief Transform the control points
+        \param matrix transformation for row vectors ([x y z 1] @ M),
+        shape (4, 4), mirroring transformations keep the patch facing
+        outwards
+        """
+        matrix = np.asarray(matrix, dtype=np.float64)
+        self.points = self.points @ matrix[:3, :3] + matrix[3, :3]
+        if np.linalg.det(matrix[:3, :3]) < 0:
+            self.points = self.points[:, ::-1]
+            if self.texcoords is not None:
+                self.texcoords = np.asarray(self.texcoords)[:, ::-1]
+
+    def natural_texcoords(self):
+        """
+        \brief Texture coordinates following the control net with the
+        texture's natural size
+        """
+        texsize = texture_size(self.texture)
+        coords = np.zeros(self.points.shape[:2] + (2,))
+        coords[:, 1:, 0] = np.cumsum(np.linalg.norm(
+            np.diff(self.points, axis=1), axis=2), axis=1)
+        coords[1:, :, 1] = np.cumsum(np.linalg.norm(
+            np.diff(self.points, axis=0), axis=2), axis=0)
+        return coords/texsize
+
+    def __str__(self):
+        texcoords = self.texcoords
+        if texcoords is None:
+            texcoords = self.natural_texcoords()
+        data = np.concatenate([self.points, texcoords], axis=2).tolist()
+        return helper.patchdef.format(
+            texture=self.texture, rows=len(data), cols=len(data[0]),
+            data=''.join(helper.patch_row_to_str(row) for row in data))
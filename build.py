@@ -0,0 +1,297 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Build many assets in parallel from a manifest.
+
+The manifest is a JSON file:
+    {
+        "assets": [
+            {
+                "generator": "mymodule:make_stairs",
+                "params": {"steps": 16},
+                "output": "maps/stairs.map",
+                "group": "Stairs"
+            }
+        ]
+    }
+
+The generator is a function 'module:function' (modules are searched next to
+the manifest) which is called with 'params' as keyword arguments. It returns
+either a list of objects for assets.ObjectWriter or a BaseAsset. Relative
+output paths are relative to the manifest.
+
+Usage: python build.py manifest.json [-j JOBS] [--force]
+"""
+
+import sys
+import os
+import json
+import time
+import hashlib
+import argparse
+import importlib
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import assets
+import baseclasses
+import helper
+import session
+import shaders
+
+
+_LIBRARY_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _file_hash(path, digest):
+    with open(path, "rb") as f:
+        digest.update(f.read())
+
+
+def _library_hash():
+    """
+    Hash of the library sources, changing the library rebuilds everything
+    """
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(_LIBRARY_DIR)):
+        if name.endswith(".py"):
+            _file_hash(os.path.join(_LIBRARY_DIR, name), digest)
+    return digest.hexdigest()
+
+
+def _import_generator(spec):
+    modulename, funcname = spec.split(":")
+    module = importlib.import_module(modulename)
+    return module, getattr(module, funcname)
+
+
+def job_signature(job, basedir, libhash, settings=None):
+    """
+    \brief Hash of everything the output of a job depends on
+    \param settings dictionary with 'xondir' and 'geometry_only', see build
+    """
+    settings = settings or {}
+    digest = hashlib.sha256(libhash.encode())
+    digest.update(json.dumps([job["generator"], job.get("params", {}),
+                              job.get("group", "Group"),
+                              settings.get("xondir"),
+                              bool(settings.get("geometry_only"))],
+                             sort_keys=True).encode())
+    if basedir not in sys.path:
+        sys.path.insert(0, basedir)
+    module, func = _import_generator(job["generator"])
+    if getattr(module, "__file__", None):
+        _file_hash(module.__file__, digest)
+    return digest.hexdigest()
+
+
+def _init_worker(basedir, settings, texture_sizes):
+    sys.path.insert(0, basedir)
+    if settings.get("xondir"):
+        helper.set_xon_dir(settings["xondir"])
+    if settings.get("geometry_only"):
+        helper.set_geometry_only()
+    shaders.update_texture_size_cache(texture_sizes)
+
+
+def build_asset(job, output):
+    """
+    \brief Run a single job, executed in the worker processes
+    \return (result, texture sizes known to the worker)
+    """
+    start = time.perf_counter()
+    result = {"generator": job["generator"], "output": output}
+    try:
+        module, func = _import_generator(job["generator"])
+        asset = func(**job.get("params", {}))
+        if not isinstance(asset, baseclasses.BaseAsset):
+            asset = assets.ObjectWriter(asset, group=job.get("group", "Group"))
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        # write to a temporary file to never leave half written outputs,
+        # the extension selects the compression
+        root, ext = os.path.splitext(output)
+        asset.save(root + ".part" + ext)
+        os.replace(root + ".part" + ext, output)
+        result["status"] = "built"
+    except Exception:
+        result["status"] = "failed"
+        result["error"] = traceback.format_exc()
+    result["seconds"] = time.perf_counter() - start
+    return result, shaders.texture_size_cache()
+
+
+def _load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_json(path, data):
+    with open(path + ".part", "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(path + ".part", path)
+
+
+def texture_source(settings=None):
+    """
+    \brief Describe the game data the texture sizes are read from, sizes
+    cached for another source are not reused
+    \param settings dictionary with 'xondir' and 'geometry_only', see build
+    \return string with the texture directories and archives and their
+    modification times
+    """
+    settings = settings or {}
+    if settings.get("geometry_only"):
+        return "geometry only"
+    source = session.Session(xondir=settings.get("xondir"),
+                             geometry_only=False)
+    try:
+        if source.is_git_build():
+            paths = [source.find_maps_pk3dir()]
+        else:
+            paths = [source.find_maps_pk3(), source.find_mapping_support()]
+    except (ValueError, OSError):
+        return "unconfigured"
+    return json.dumps([(path, os.path.getmtime(path))
+                       if path and os.path.exists(path) else (path, None)
+                       for path in paths])
+
+
+def _load_texture_cache(path, source):
+    cache = _load_json(path, {})
+    sizes = cache.get(source, {})
+    # caches of older versions map the shaders directly to their sizes
+    return _found(sizes) if isinstance(sizes, dict) else {}
+
+
+def _save_texture_cache(path, source, texture_sizes):
+    cache = _load_json(path, {})
+    cache = {key: value for key, value in cache.items()
+             if isinstance(value, dict)}
+    cache[source] = _found(texture_sizes)
+    _save_json(path, cache)
+
+
+def _found(texture_sizes):
+    """
+    \brief Drop the shaders which could not be resolved, they may be found
+    with other settings
+    """
+    return {name: size for name, size in texture_sizes.items()
+            if size is not None}
+
+
+def build(manifest, jobs=None, force=False, settings=None,
+          state_path=None, summary_path=None, texture_cache=None):
+    """
+    \brief Build all assets of a manifest on a process pool
+    \param manifest path of the manifest
+    \param jobs number of worker processes, defaults to the number of cores
+    \param force rebuild assets even if their inputs are unchanged
+    \param settings dictionary with 'xondir' and 'geometry_only'
+    \param state_path file storing the signatures of the built assets
+    \param summary_path file for the JSON summary of the build
+    \param texture_cache file storing the resolved texture sizes,
+    shared by all workers and builds, the sizes are stored per texture
+    source (see texture_source) and shaders which were not found are
+    looked up again in the next build
+    \return list of the results of all jobs
+    """
+    basedir = os.path.dirname(os.path.abspath(manifest))
+    state_path = state_path or manifest + ".state"
+    summary_path = summary_path or manifest + ".summary"
+    texture_cache = texture_cache or manifest + ".textures"
+    with open(manifest) as f:
+        joblist = json.load(f)["assets"]
+    state = _load_json(state_path, {})
+    source = texture_source(settings)
+    texture_sizes = _load_texture_cache(texture_cache, source)
+    libhash = _library_hash()
+
+    results = []
+    pending = []
+    for job in joblist:
+        output = os.path.join(basedir, job["output"])
+        try:
+            signature = job_signature(job, basedir, libhash, settings)
+        except Exception:
+            results.append({"generator": job["generator"], "output": output,
+                            "status": "failed", "seconds": 0.0,
+                            "error": traceback.format_exc()})
+            continue
+        if (not force and state.get(output) == signature and
+                os.path.exists(output)):
+            results.append({"generator": job["generator"], "output": output,
+                            "status": "skipped", "seconds": 0.0})
+        else:
+            pending.append((job, output, signature))
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(jobs, initializer=_init_worker,
+                             initargs=(basedir, settings or {},
+                                       texture_sizes)) as pool:
+        futures = [(pool.submit(build_asset, job, output), signature)
+                   for job, output, signature in pending]
+        for future, signature in futures:
+            result, sizes = future.result()
+            texture_sizes.update(sizes)
+            if result["status"] == "built":
+                state[result["output"]] = signature
+            else:
+                state.pop(result["output"], None)
+            results.append(result)
+    elapsed = time.perf_counter() - start
+
+    _save_json(state_path, state)
+    _save_texture_cache(texture_cache, source, texture_sizes)
+    _save_json(summary_path, {"seconds": elapsed, "assets": results})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build all assets of a manifest in parallel")
+    parser.add_argument("manifest", help="JSON manifest of the assets")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of worker processes "
+                        "(default: number of cores)")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="rebuild assets whose inputs are unchanged")
+    parser.add_argument("--xondir", help="Xonotic base directory")
+    parser.add_argument("--geometry-only", action="store_true",
+                        help="don't look up texture sizes")
+    parser.add_argument("--summary", help="path of the JSON summary")
+    args = parser.parse_args(argv)
+
+    results = build(args.manifest, args.jobs, args.force,
+                    {"xondir": args.xondir,
+                     "geometry_only": args.geometry_only},
+                    summary_path=args.summary)
+    for result in results:
+        print("{:8} {:8.2f}s  {}".format(result["status"], result["seconds"],
+                                         result["output"]))
+        if result["status"] == "failed":
+            print(result["error"])
+    failed = sum(result["status"] == "failed" for result in results)
+    print("{} built, {} skipped, {} failed".format(
+        sum(result["status"] == "built" for result in results),
+        sum(result["status"] == "skipped" for result in results), failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Overlap detection between brushes.
+
+Candidate pairs are found with a sweep over the axis aligned bounding boxes,
+then tested with the separating axis theorem using the face normals of both
+brushes and the cross products of their edge directions. Brushes that only
+touch are not reported.
+"""
+
+import numpy as np
+import baseclasses
+import geometry
+from geometry import EPSILON
+
+
+def broadphase(mins, maxs, eps=EPSILON, chunksize=2**22):
+    """
+    \brief Find all pairs of overlapping bounding boxes
+    \param mins minimum corners of the boxes, shape (n, 3)
+    \param maxs maximum corners of the boxes, shape (n, 3)
+    \param eps boxes have to overlap by more than eps
+    \param chunksize maximum number of candidates generated at once
+    \return index pairs (i, j) with i < j, shape (p, 2)
+    """
+    mins = np.asarray(mins, dtype=np.float64)
+    maxs = np.asarray(maxs, dtype=np.float64)
+    ids = np.flatnonzero(np.all(mins <= maxs, axis=1))
+    if len(ids) < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+    # sweep along the axis with the largest spread
+    centers = (mins[ids] + maxs[ids])/2
+    axis = np.argmax(centers.max(axis=0) - centers.min(axis=0))
+    ids = ids[np.argsort(mins[ids, axis], kind="stable")]
+    smin = mins[ids, axis]
+    smax = maxs[ids, axis]
+    n = len(ids)
+    hi = np.searchsorted(smin, smax - eps, side="left")
+    counts = np.maximum(hi - np.arange(n) - 1, 0)
+    cumulative = np.cumsum(counts)
+    pairs = []
+    start = 0
+    while start < n:
+        base = cumulative[start-1] if start else 0
+        stop = max(np.searchsorted(cumulative, base + chunksize,
+                                   side="right"), start + 1)
+        chunk = counts[start:stop]
+        first = np.repeat(np.arange(start, stop), chunk)
+        offsets = np.arange(chunk.sum()) - np.repeat(np.cumsum(chunk) -
+                                                     chunk, chunk)
+        a = ids[first]
+        b = ids[first + 1 + offsets]
+        overlap = np.all((mins[a] < maxs[b] - eps) &
+                         (mins[b] < maxs[a] - eps), axis=1)
+        pairs.append(np.stack([np.minimum(a, b), np.maximum(a, b)],
+                              axis=1)[overlap])
+        start = stop
+    return np.concatenate(pairs)
+
+
+def _unique_directions(dirs, valid):
+    """
+    \brief Remove parallel directions per brush
+    \param dirs directions, shape (b, n, 3)
+    \param valid mask of the valid directions, shape (b, n)
+    \return unit directions compacted to the front, padded with zeros
+    """
+    length = np.linalg.norm(dirs, axis=-1)
+    valid = valid & (length > 1e-9)
+    dirs = dirs/np.where(valid, length, 1)[..., None]
+    # directions are equivalent up to their sign
+    sign = np.sign(dirs[..., 0])
+    sign = np.where(sign == 0, np.sign(dirs[..., 1]), sign)
+    sign = np.where(sign == 0, np.sign(dirs[..., 2]), sign)
+    dirs = dirs*sign[..., None]
+    keys = np.round(dirs*1e6).astype(np.int64)
+    keys = keys[..., 0]*1000003 + keys[..., 1]*1009 + keys[..., 2]
+    keys = np.where(valid, keys, np.iinfo(np.int64).max)
+    order = np.argsort(keys, axis=1, kind="stable")
+    keys = np.take_along_axis(keys, order, axis=1)
+    first = np.ones(keys.shape, dtype=bool)
+    first[:, 1:] = keys[:, 1:] != keys[:, :-1]
+    first &= np.take_along_axis(valid, order, axis=1)
+    dirs = np.take_along_axis(dirs, order[..., None], axis=1)
+    compact = np.argsort(~first, axis=1, kind="stable")
+    compact = compact[:, :max(first.sum(axis=1).max(), 1)]
+    keep = np.take_along_axis(first, compact, axis=1)
+    return np.take_along_axis(dirs, compact[..., None], axis=1)*keep[..., None]
+
+
+class Collider(object):
+    """
+    Separating axis data of many brushes
+    """
+
+    def __init__(self, brushes, eps=EPSILON):
+        """
+        \brief Prepare brushes for overlap tests
+        \param brushes brush, primitive, modifier or an iterable of those
+        \param eps brushes have to overlap by more than eps
+        """
+        self.eps = eps
+        self.polytopes = geometry.Polytopes.from_brushes(brushes, eps)
+        self.groups = []
+        for group in self.polytopes.groups:
+            normals = _unique_directions(group["normals"],
+                                         np.ones(group["dists"].shape, bool))
+            # every pair of planes meeting in a vertex may form an edge
+            n = group["normals"]
+            planes = group["planes"]
+            b = np.arange(len(planes))[:, None]
+            edges = np.concatenate([
+                np.cross(n[b, planes[..., i]], n[b, planes[..., j]])
+                for i, j in ((0, 1), (1, 2), (0, 2))], axis=1)
+            edges = _unique_directions(edges, np.tile(group["valid"], 3))
+            self.groups.append({"points": group["points"],
+                                "normals": normals, "edges": edges})
+
+    def __len__(self):
+        return len(self.polytopes)
+
+    def _separated(self, ga, gb, a, b, maxsize=2**24):
+        """
+        \brief Separating axis test for pairs of brushes of two groups
+        \param ga group of the first brushes
+        \param gb group of the second brushes
+        \param a indices of the first brushes within their group
+        \param b indices of the second brushes within their group
+        """
+        ga = self.groups[ga]
+        gb = self.groups[gb]
+        naxes = (ga["normals"].shape[1] + gb["normals"].shape[1] +
+                 ga["edges"].shape[1]*gb["edges"].shape[1])
+        nverts = ga["points"].shape[1] + gb["points"].shape[1]
+        step = max(1, maxsize//(naxes*nverts))
+        separated = np.empty(len(a), dtype=bool)
+        for c in range(0, len(a), step):
+            ia = a[c:c+step]
+            ib = b[c:c+step]
+            ea = ga["edges"][ia]
+            eb = gb["edges"][ib]
+            cross = np.cross(ea[:, :, None], eb[:, None, :]).reshape(
+                len(ia), -1, 3)
+            length = np.linalg.norm(cross, axis=-1)
+            cross = cross/np.where(length > 1e-9, length, 1)[..., None]
+            axes = np.concatenate([ga["normals"][ia], gb["normals"][ib],
+                                   cross], axis=1)
+            valid = np.linalg.norm(axes, axis=-1) > 0.5
+            proja = np.einsum('pvk,pak->pav', ga["points"][ia], axes)
+            projb = np.einsum('pvk,pak->pav', gb["points"][ib], axes)
+            sep = ((proja.max(axis=2) <= projb.min(axis=2) + self.eps) |
+                   (projb.max(axis=2) <= proja.min(axis=2) + self.eps))
+            separated[c:c+step] = np.any(sep & valid, axis=1)
+        return separated
+
+    def test_pairs(self, pairs):
+        """
+        \brief Separating axis test of candidate pairs
+        \param pairs brush index pairs, shape (p, 2)
+        \return mask of the overlapping pairs
+        """
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        poly = self.polytopes
+        overlapping = np.zeros(len(pairs), dtype=bool)
+        groups = poly.group_of[pairs]
+        for ga, gb in np.unique(groups, axis=0).tolist():
+            mask = (groups[:, 0] == ga) & (groups[:, 1] == gb)
+            sel = pairs[mask]
+            overlapping[mask] = ~self._separated(
+                ga, gb, poly.index_in_group[sel[:, 0]],
+                poly.index_in_group[sel[:, 1]])
+        return overlapping
+
+    def pairs(self):
+        """
+        \brief Return all pairs of overlapping brushes, shape (p, 2)
+        """
+        candidates = broadphase(self.polytopes.mins, self.polytopes.maxs,
+                                self.eps)
+        return candidates[self.test_pairs(candidates)]
+
+
+def overlapping_pairs(brushes, others=None, eps=EPSILON):
+    """
+    \brief Find overlapping brushes
+    \param brushes brush, primitive, modifier or an iterable of those
+    \param others if given, only pairs between 'brushes' and 'others' are
+    reported
+    \return index pairs, shape (p, 2), the indices refer to the brushes in
+    the order of baseclasses.iter_brushes; if 'others' is given the second
+    index refers to 'others'
+    """
+    brushes = list(baseclasses.iter_brushes(brushes))
+    if others is None:
+        return Collider(brushes, eps).pairs()
+    others = list(baseclasses.iter_brushes(others))
+    pairs = Collider(brushes + others, eps).pairs()
+    n = len(brushes)
+    pairs = pairs[(pairs[:, 0] < n) & (pairs[:, 1] >= n)]
+    pairs[:, 1] -= n
+    return pairs
+
+
+def intersects(brush1, brush2, eps=EPSILON):
+    """
+    \brief Check if two brushes overlap by more than eps
+    """
+    return len(overlapping_pairs([brush1, brush2], eps=eps)) > 0
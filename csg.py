@@ -0,0 +1,416 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Constructive operations on brushes.
+
+Merging: two brushes A and B touching with opposite planes can be replaced
+by a single brush if all vertices of B are inside of the other planes of A
+and vice versa. The intersection of the remaining planes is then exactly
+the union of A and B. Candidates are found by hashing every face by its
+plane and the bounding box of its vertices, touching brushes which can be
+merged have the same cross section on the shared plane, so their faces end
+up in the same bucket.
+
+Carving: a target brush overlapping a cutter is split by the planes of the
+cutter, the part outside of each plane becomes a fragment and the part
+inside of all planes is removed. Only planes actually cutting the target
+are used, the fragments are merged again where possible and slivers are
+dropped.
+"""
+
+import numpy as np
+import baseclasses
+import collision
+import geometry
+import validate
+from geometry import EPSILON
+
+
+def _keys(*parts):
+    """
+    \brief Quantize rows of floats into hashable tuples
+    \param parts arrays with one row per key, each followed by the factor
+    it is scaled with before rounding
+    The grid is shifted so values on common grid sizes don't end up on the
+    rounding boundaries.
+    """
+    values = np.concatenate([np.asarray(p, dtype=np.float64).reshape(
+        len(parts[0]), -1)*scale for p, scale in zip(parts[::2], parts[1::2])],
+        axis=1)
+    return [tuple(row) for row in
+            np.round(values + 0.37).astype(np.int64).tolist()]
+
+
+class BrushMerger(object):
+    """
+    Greedily merge brushes whose union is convex
+    """
+
+    def __init__(self, brushes, eps=EPSILON):
+        """
+        \brief Prepare brushes for merging
+        \param brushes brush, primitive, modifier or an iterable of those
+        \param eps tolerance in map units
+        """
+        self.eps = eps
+        self.arrays = baseclasses.face_arrays(baseclasses.iter_brushes(brushes))
+        counts = self.arrays["counts"]
+        self.normals, self.dists = geometry.face_planes(self.arrays["verts"])
+        self.planekeys = _keys(self.normals, 1e4, self.dists, 64)
+        self.oppositekeys = _keys(-self.normals, 1e4, -self.dists, 64)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+        self.faces = [np.arange(s, s + c) for s, c in zip(starts.tolist(),
+                                                          counts.tolist())]
+        texids = np.unique(self.arrays["textures"], return_inverse=True)[1]
+        self.texturekeys = _keys(texids, 1, self.arrays["angles"], 1e6,
+                                 self.arrays["offsets"], 1e4,
+                                 self.arrays["scales"], 1e6)
+        self.points = self._vertices(self.faces)
+        # the vertices of invalid brushes don't describe their volume,
+        # so they are never merged
+        invalid = set(validate.validate_arrays(
+            counts, self.arrays["verts"], eps).invalid_brushes().tolist())
+        self.slots = [self._slots(f, p) if i not in invalid else []
+                      for i, (f, p) in enumerate(zip(self.faces,
+                                                     self.points))]
+        self.passes = 0
+
+    def _vertices(self, faces):
+        """
+        \brief Compute the vertices of brushes given by their face indices
+        """
+        if not faces:
+            return []
+        ids = np.concatenate(faces)
+        poly = geometry.Polytopes([len(f) for f in faces],
+                                  self.arrays["verts"][ids], self.eps)
+        return [poly.vertices(i) for i in range(len(faces))]
+
+    def _slots(self, faces, points):
+        """
+        \brief Hash keys of the faces of a brush
+        \return list of (face index, key of the plane and the bounding box of
+        the vertices on the plane)
+        """
+        if not len(points):
+            return []
+        dist = points@self.normals[faces].T - self.dists[faces]
+        onplane = (np.abs(dist) <= self.eps).T[..., None]
+        boxes = np.concatenate([np.where(onplane, points, np.inf).min(axis=1),
+                                np.where(onplane, points, -np.inf).max(axis=1)],
+                               axis=1)
+        used = onplane.any(axis=(1, 2))
+        boxkeys = _keys(np.where(used[:, None], boxes, 0), 64)
+        return [(f, (self.planekeys[f], boxkey))
+                for f, boxkey, ok in zip(faces.tolist(), boxkeys,
+                                         used.tolist()) if ok]
+
+    def _inside(self, points, faces):
+        return np.all(points@self.normals[faces].T <=
+                      self.dists[faces] + self.eps)
+
+    def merged_faces(self, a, b, fa, fb):
+        """
+        \brief Try to merge two brushes touching with opposite faces
+        \param a, b indices of the brushes
+        \param fa, fb indices of the touching faces
+        \return face indices of the merged brush or None if the union is
+        not convex or coplanar faces have different textures
+        """
+        keep_a = self.faces[a][self.faces[a] != fa]
+        keep_b = self.faces[b][self.faces[b] != fb]
+        if not (self._inside(self.points[b], keep_a) and
+                self._inside(self.points[a], keep_b)):
+            return None
+        planes = {self.planekeys[f]: f for f in keep_a.tolist()}
+        faces = keep_a.tolist()
+        for f in keep_b.tolist():
+            g = planes.get(self.planekeys[f])
+            if g is None:
+                faces.append(f)
+            elif self.texturekeys[f] != self.texturekeys[g]:
+                return None
+        return np.array(faces, dtype=np.int64)
+
+    def _candidates(self):
+        """
+        \brief Find pairs of brushes touching with opposite faces with the
+        same cross section
+        \return list of (direction, a, b, face of a, face of b)
+        """
+        buckets = {}
+        for b, slots in enumerate(self.slots):
+            for f, key in slots:
+                buckets.setdefault(key, []).append((b, f))
+        candidates = []
+        for b, slots in enumerate(self.slots):
+            for f, key in slots:
+                for other, g in buckets.get((self.oppositekeys[f], key[1]), ()):
+                    if b < other:
+                        direction = min(self.planekeys[f][:3],
+                                        self.oppositekeys[f][:3])
+                        candidates.append((direction, b, other, f, g))
+        candidates.sort()
+        return candidates
+
+    def merge_pass(self):
+        """
+        \brief Merge every brush at most once, all merges of a pass are
+        along the same direction, which keeps grids regular
+        \return number of merges
+        """
+        used = set()
+        merged = {}
+        axis = None
+        for direction, a, b, fa, fb in self._candidates():
+            if a in used or b in used or axis not in (None, direction):
+                continue
+            faces = self.merged_faces(a, b, fa, fb)
+            if faces is None:
+                continue
+            axis = direction
+            used.update((a, b))
+            merged[a] = faces
+            merged[b] = None
+        if not merged:
+            return 0
+        newfaces = [f for f in merged.values() if f is not None]
+        newpoints = iter(self._vertices(newfaces))
+        faces = []
+        points = []
+        slots = []
+        for i, (f, p, s) in enumerate(zip(self.faces, self.points,
+                                          self.slots)):
+            if i not in merged:
+                faces.append(f)
+                points.append(p)
+                slots.append(s)
+            elif merged[i] is not None:
+                faces.append(merged[i])
+                points.append(next(newpoints))
+                slots.append(self._slots(faces[-1], points[-1]))
+        self.faces = faces
+        self.points = points
+        self.slots = slots
+        self.passes += 1
+        return len(newfaces)
+
+    def merge(self):
+        """
+        \brief Merge until no more brushes can be merged
+        \return list of the resulting brushes
+        """
+        while self.merge_pass():
+            pass
+        return self.brushes()
+
+    def brushes(self):
+        """
+        \brief Return the current brushes
+        """
+        if not self.faces:
+            return []
+        ids = np.concatenate(self.faces)
+        return baseclasses.brushes_from_arrays(
+            [len(f) for f in self.faces],
+            *(self.arrays[key][ids] for key in ("verts", "textures", "angles",
+                                                "offsets", "scales")))
+
+    def statistics(self):
+        """
+        \brief Number of brushes and faces before and after merging
+        """
+        return {"brushes": (len(self.arrays["counts"]), len(self.faces)),
+                "faces": (int(self.arrays["counts"].sum()),
+                          sum(len(f) for f in self.faces)),
+                "passes": self.passes}
+
+
+def merge_brushes(brushes, eps=EPSILON):
+    """
+    \brief Merge adjacent brushes whose union is convex and whose coplanar
+    faces have the same texture
+    \param brushes brush, primitive, modifier or an iterable of those
+    \param eps tolerance in map units
+    \return list of brushes and a dictionary with the number of 'brushes'
+    and 'faces' before and after merging
+    """
+    merger = BrushMerger(brushes, eps)
+    merged = merger.merge()
+    return merged, merger.statistics()
+
+
+def merge_objects(objs, eps=EPSILON):
+    """
+    \brief Merge the brushes of a list of objects, patches and primitives
+    written as patches are kept as they are
+    \return list of objects and the statistics of merge_brushes
+    """
+    kept = []
+    brushes = []
+    for obj in objs:
+        _split_patches(obj, kept, brushes)
+    merged, stats = merge_brushes(brushes, eps)
+    return merged + kept, stats
+
+
+def _split_patches(obj, kept, brushes):
+    """
+    \brief Sort an object into the objects to keep and the ones to merge,
+    lists are split up, other objects containing patches are kept as a whole
+    """
+    if isinstance(obj, (list, tuple)):
+        for child in obj:
+            _split_patches(child, kept, brushes)
+    elif baseclasses.writes_patches(obj):
+        kept.append(obj)
+    else:
+        brushes.append(obj)
+
+
+def _concat_arrays(*arrays):
+    return {key: np.concatenate([a[key] for a in arrays])
+            for key in ("verts", "textures", "angles", "offsets", "scales")}
+
+
+def _split(points, faces, cutter, flipped, normals, dists, eps):
+    """
+    \brief Split a brush by the planes of a cutter
+    \param points vertices of the brush
+    \param faces face indices of the brush
+    \param cutter face indices of the cutter
+    \param flipped face indices of the flipped cutter faces
+    \return list of face indices of the fragments outside of the cutter
+    """
+    dist = points@normals[cutter].T - dists[cutter]
+    if np.any(np.all(dist >= -eps, axis=0)):
+        # the brush is outside of a plane of the cutter
+        return [faces]
+    extent = dist.max(axis=0)
+    # cut off the largest parts first, this gives less slivers
+    order = np.flatnonzero(extent > eps)
+    order = order[np.argsort(-extent[order], kind="stable")]
+    fragments = []
+    for j in order.tolist():
+        fragments.append(np.append(faces, flipped[j]))
+        faces = np.append(faces, cutter[j])
+    return fragments
+
+
+def _thickness(counts, verts, eps):
+    """
+    \brief Smallest width of brushes along their face normals
+    """
+    poly = geometry.Polytopes(counts, verts, eps)
+    thickness = np.zeros(len(counts))
+    for group in poly.groups:
+        depth = (group["dists"][:, :, None] -
+                 np.einsum('bfk,bvk->bfv', group["normals"], group["points"]))
+        depth = np.where(group["valid"][:, None, :], depth, 0).max(axis=2)
+        degenerate = ~np.any(group["normals"] != 0, axis=2)
+        thickness[group["indices"]] = np.where(degenerate, np.inf,
+                                               depth).min(axis=1)
+    thickness[poly.empty] = 0
+    return thickness
+
+
+def carve(targets, cutters, eps=EPSILON, min_thickness=0.5, merge=True):
+    """
+    \brief Subtract convex brushes from other brushes
+    \param targets brush, primitive, modifier or an iterable of those
+    \param cutters brushes that are subtracted from the targets
+    \param eps tolerance in map units
+    \param min_thickness fragments thinner than this are dropped
+    \param merge merge the fragments again where their union is convex
+    \return list of brushes, targets not touched by any cutter come first
+    and are returned unchanged, the new faces get the textures of the cutters
+    """
+    targets = list(baseclasses.iter_brushes(targets))
+    cutters = list(baseclasses.iter_brushes(cutters))
+    pairs = collision.overlapping_pairs(targets, cutters, eps)
+    untouched = np.ones(len(targets), dtype=bool)
+    untouched[pairs[:, 0]] = False
+    carved = np.flatnonzero(~untouched)
+    if not len(carved):
+        return targets
+
+    # all faces ever needed: target faces, cutter faces and flipped cutter
+    # faces, the brushes are handled as lists of face indices
+    tarrays = baseclasses.face_arrays(targets[i] for i in carved.tolist())
+    carrays = baseclasses.face_arrays(cutters)
+    flipped = dict(carrays, verts=carrays["verts"][:, [0, 2, 1]])
+    arrays = _concat_arrays(tarrays, carrays, flipped)
+    normals, dists = geometry.face_planes(arrays["verts"])
+    nt = len(tarrays["verts"])
+    nc = len(carrays["verts"])
+    cstarts = nt + np.concatenate([[0], np.cumsum(carrays["counts"])])
+    cutterfaces = [np.arange(a, b) for a, b in zip(cstarts[:-1].tolist(),
+                                                   cstarts[1:].tolist())]
+
+    tstarts = np.concatenate([[0], np.cumsum(tarrays["counts"])])
+    index = {t: k for k, t in enumerate(carved.tolist())}
+    pending = [[] for t in carved]
+    for t, c in pairs.tolist():
+        pending[index[t]].append(c)
+    active = [(np.arange(tstarts[k], tstarts[k+1]), pending[k])
+              for k in range(len(carved))]
+
+    # every round splits all pieces by their next cutter, the vertices of
+    # all pieces are computed at once
+    done = []
+    while active:
+        ids = np.concatenate([faces for faces, rest in active])
+        poly = geometry.Polytopes([len(faces) for faces, rest in active],
+                                  arrays["verts"][ids], eps)
+        next_active = []
+        for k, (faces, rest) in enumerate(active):
+            if poly.empty[k]:
+                continue
+            cutter = cutterfaces[rest[0]]
+            for fragment in _split(poly.vertices(k), faces, cutter,
+                                   cutter + nc, normals, dists, eps):
+                if len(rest) > 1:
+                    next_active.append((fragment, rest[1:]))
+                else:
+                    done.append(fragment)
+        active = next_active
+    if not done:
+        return [targets[i] for i in np.flatnonzero(untouched).tolist()]
+
+    # drop empty fragments and faces which don't touch their fragment
+    counts = np.array([len(faces) for faces in done])
+    ids = np.concatenate(done)
+    report = validate.validate_arrays(counts, arrays["verts"][ids], eps)
+    keep = np.ones(len(ids), dtype=bool)
+    keep[report.faces["redundant_faces"]] = False
+    brushids = np.repeat(np.arange(len(done)), counts)
+    keep[np.isin(brushids, report.invalid_brushes())] = False
+    counts = np.bincount(brushids[keep], minlength=len(done))
+    ids = ids[keep]
+    fragments = baseclasses.brushes_from_arrays(
+        counts[counts > 0], *(arrays[key][ids] for key in (
+            "verts", "textures", "angles", "offsets", "scales")))
+
+    if merge:
+        fragments = merge_brushes(fragments, eps)[0]
+    if fragments and min_thickness > 0:
+        farrays = baseclasses.face_arrays(fragments)
+        thickness = _thickness(farrays["counts"], farrays["verts"], eps)
+        fragments = [brush for brush, t in zip(fragments, thickness.tolist())
+                     if t >= min_thickness]
+    return ([targets[i] for i in np.flatnonzero(untouched).tolist()] +
+            fragments)
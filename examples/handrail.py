@@ -0,0 +1,45 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import os
+
+# put parent directory into PYTHONPATH, remove this when this library has a proper setup.py
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import primitives
+import assets
+import math
+import numpy as np
+
+
+if __name__ == "__main__":
+    # a helix along the outer edge of the spiral stairs example,
+    # 12 steps of 15 degrees and 24 units each
+    radius = 240.0
+    stepheight = 24.0
+    theta = math.radians(15)
+
+    def helix(t):
+        angle = t*12*theta
+        return np.stack([radius*np.cos(angle), radius*np.sin(angle),
+                         t*12*stepheight + 40], axis=-1)
+    # sweep a square profile along the helix to get a handrail
+    rail = primitives.Sweep.from_curve([[-2, -2], [2, -2], [2, 2], [-2, 2]],
+                                       helix, 24, texture="trak6x/base-base1c")
+    writer = assets.ObjectWriter([rail], group="Handrail")
+    with open("handrail.map", "w") as f:
+        writer.write(f)
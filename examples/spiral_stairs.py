@@ -21,6 +21,7 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 import baseclasses
+import modifiers
 import assets
 import math
 import numpy as np
@@ -89,36 +90,19 @@ if __name__ == "__main__":
     f24 = baseclasses.Face(v14, v16, v18, "trak6x/base-base1c")
     f25 = f20.flipped()
     outer_ramp2 = baseclasses.Brush([f21, f22, f23, f24, f25])
-    # copy, rotate and move the step
-    steps = [step]
-    inner = [inner_ramp1, inner_ramp2]
-    outer = [outer_ramp1, outer_ramp2]
-    for i in range(11):
-        # TODO: rotation support for array modifier
-        temp = steps[-1].copy_brush()
-        temp.rotate_point([0, 0, 0], rot_matrix)
-        temp.move([0, 0, stepheight])
-        steps.append(temp)
-        # inner ramps
-        temp = inner[-2].copy_brush()
-        temp.rotate_point([0, 0, 0], rot_matrix)
-        temp.move([0, 0, stepheight])
-        inner.append(temp)
-        temp = inner[-2].copy_brush()
-        temp.rotate_point([0, 0, 0], rot_matrix)
-        temp.move([0, 0, stepheight])
-        inner.append(temp)
-        # outer ramps
-        temp = outer[-2].copy_brush()
-        temp.rotate_point([0, 0, 0], rot_matrix)
-        temp.move([0, 0, stepheight])
-        outer.append(temp)
-        temp = outer[-2].copy_brush()
-        temp.rotate_point([0, 0, 0], rot_matrix)
-        temp.move([0, 0, stepheight])
-        outer.append(temp)
+    # use the array modifier to copy, rotate and move the step and the ramps
+    rotation = ([0, 0, 1], theta)
+    steps = modifiers.Array(step, 12, [0, 0, stepheight], rotation=rotation)
+    inner = [modifiers.Array(inner_ramp1, 12, [0, 0, stepheight],
+                             rotation=rotation),
+             modifiers.Array(inner_ramp2, 12, [0, 0, stepheight],
+                             rotation=rotation)]
+    outer = [modifiers.Array(outer_ramp1, 12, [0, 0, stepheight],
+                             rotation=rotation),
+             modifiers.Array(outer_ramp2, 12, [0, 0, stepheight],
+                             rotation=rotation)]
     # use the ObjectWriter to save the objects into a .map file
     # also group them into the func_group "Stairs"
-    writer = assets.ObjectWriter(steps + inner + outer, group="Stairs")
+    writer = assets.ObjectWriter([steps] + inner + outer, group="Stairs")
     with open("spiral_stairs.map", "w") as f:
         writer.write(f)
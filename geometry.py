@@ -0,0 +1,464 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Vectorized plane and polytope computations on brushes.
+
+Planes are stored as outward pointing unit normals n and distances d,
+a point p is inside a brush if n.p <= d for all of its planes.
+Note that Face.normal points into the brush.
+"""
+
+from itertools import combinations
+import numpy as np
+import baseclasses
+
+
+# tolerance in map units
+EPSILON = 1e-3
+
+
+def face_planes(verts):
+    """
+    \brief Compute the planes of faces given by their plane points
+    \param verts array of shape (..., 3, 3)
+    \return outward unit normals (..., 3) and distances (...),
+    degenerate faces get a zero normal
+    """
+    verts = np.asarray(verts, dtype=np.float64)
+    inward = np.cross(verts[..., 1, :] - verts[..., 0, :],
+                      verts[..., 2, :] - verts[..., 0, :])
+    length = np.linalg.norm(inward, axis=-1)[..., None]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        normals = np.where(length > 0, -inward/length, 0)
+    dists = np.einsum('...k,...k->...', normals, verts[..., 0, :])
+    return normals, dists
+
+
+def brush_planes(brush):
+    """
+    \brief Return the outward unit normals and distances of a brush's planes
+    """
+    return face_planes([face.verts for face in brush.faces])
+
+
+def group_by_face_count(counts, normals, dists):
+    """
+    \brief Group brushes with the same number of planes into stacked arrays
+    \param counts number of planes of every brush
+    \param normals normals of all planes, shape (n, 3)
+    \param dists distances of all planes, shape (n,)
+    \return dictionary face count -> (brush indices, normals (b, f, 3),
+    distances (b, f))
+    """
+    counts = np.asarray(counts)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    groups = {}
+    for count in np.unique(counts).tolist():
+        indices = np.flatnonzero(counts == count)
+        faceids = starts[indices][:, None] + np.arange(count)
+        groups[count] = (indices, normals[faceids], dists[faceids])
+    return groups
+
+
+# brushes with more planes are clipped instead of intersecting all triples
+TRIPLE_LIMIT = 14
+# half size of the initial polygon of every plane when clipping, far beyond
+# the size of any map
+_EXTENT = 2.0**24
+
+
+def _compact(points, valid, planes):
+    """
+    \brief Move the valid vertices of every brush to the front and drop the
+    columns without any valid vertex
+    """
+    order = np.argsort(~valid, axis=1, kind="stable")
+    order = order[:, :max(valid.sum(axis=1).max(initial=0), 1)]
+    return (np.take_along_axis(points, order[..., None], axis=1),
+            np.take_along_axis(valid, order, axis=1),
+            np.take_along_axis(planes, order[..., None], axis=1))
+
+
+def _triple_vertices(normals, dists, eps, chunksize):
+    b, f = dists.shape
+    triples = np.array(list(combinations(range(f), 3)),
+                       dtype=np.int64).reshape(-1, 3)
+    step = max(1, chunksize//max(b, 1))
+    points = []
+    valid = []
+    planes = []
+    for c in range(0, len(triples), step):
+        chunk = triples[c:c+step]
+        n1, n2, n3 = (normals[:, chunk[:, k]] for k in range(3))
+        rhs = dists[:, chunk]
+        # Cramer's rule, much faster than np.linalg.solve for 3x3 systems
+        c23 = np.cross(n2, n3)
+        c31 = np.cross(n3, n1)
+        c12 = np.cross(n1, n2)
+        det = np.einsum('bck,bck->bc', n1, c23)
+        ok = np.abs(det) > 1e-9
+        p = (rhs[..., 0, None]*c23 + rhs[..., 1, None]*c31 +
+             rhs[..., 2, None]*c12)/np.where(ok, det, 1)[..., None]
+        inside = np.all(np.einsum('bck,bfk->bcf', p, normals) <=
+                        dists[:, None, :] + eps, axis=2)
+        ok &= inside
+        # compact the valid points of this chunk to the front
+        p, ok, chunkplanes = _compact(
+            p, ok, np.broadcast_to(chunk, (b,) + chunk.shape))
+        points.append(p)
+        valid.append(ok)
+        planes.append(chunkplanes)
+    points = np.concatenate(points, axis=1)
+    valid = np.concatenate(valid, axis=1)
+    planes = np.concatenate(planes, axis=1)
+    if len(triples) > step:
+        points, valid, planes = _compact(points, valid, planes)
+    return points, valid, planes
+
+
+def _unbounded_rays(normals, chunksize=2**22):
+    """
+    \brief The brush is unbounded if a ray along the intersection of two
+    planes is inside of all planes, the cost grows with f^3
+    \return mask of shape (b,)
+    """
+    b, f = normals.shape[:2]
+    i, j = np.triu_indices(f, k=1)
+    unbounded = np.zeros(b, dtype=bool)
+    step = max(1, chunksize//max(len(i)*f, 1))
+    for c in range(0, b, step):
+        n = normals[c:c+step]
+        rays = np.cross(n[:, i], n[:, j])
+        length = np.linalg.norm(rays, axis=2)
+        proj = np.einsum('bfk,bpk->bpf', n, rays)
+        tolerance = 1e-9*length[..., None]
+        found = (length > 1e-9) & (np.all(proj <= tolerance, axis=2) |
+                                   np.all(proj >= -tolerance, axis=2))
+        unbounded[c:c+step] = np.any(found, axis=1)
+    return unbounded
+
+
+def _clip_polygons(normals, dists, eps):
+    """
+    \brief Clip a large square on every plane with all other planes, the
+    cost grows with f^2 instead of f^4
+    Every polygon corner keeps the plane of the edge starting at it, -1 for
+    edges of the initial square.
+    \return corners (b, f, w, 3), edge planes (b, f, w) and the number of
+    corners of every polygon (b, f)
+    """
+    b, f = dists.shape
+    degenerate = ~np.any(normals != 0, axis=2)
+    axis = np.where(np.abs(normals[..., 2:]) < 0.9, [0, 0, 1], [1, 0, 0])
+    u = np.cross(axis, normals)
+    u /= np.maximum(np.linalg.norm(u, axis=-1), 1e-12)[..., None]
+    w = np.cross(normals, u)
+    corners = np.array([[1, 1], [-1, 1], [-1, -1], [1, -1]])*_EXTENT
+    poly = (normals*dists[..., None])[:, :, None] + (
+        corners[:, 0, None]*u[:, :, None] + corners[:, 1, None]*w[:, :, None])
+    # -1 marks edges of the initial square
+    labels = np.full((b, f, 4), -1, dtype=np.int64)
+    count = np.where(degenerate, 0, 4)
+    faceids = np.arange(f)
+    # clip with the planes of the most similar normals first, they cut the
+    # polygon down to its final size early and the others rarely cut it
+    order = np.argsort(-np.einsum('bik,bjk->bij', normals, normals),
+                       axis=2, kind="stable").astype(np.int32)
+    bids = np.arange(b)[:, None]
+    candidates = None
+    for k in range(f):
+        width = max(count.max(), 1)
+        if width < poly.shape[2]:
+            poly = poly[:, :, :width]
+            labels = labels[:, :, :width]
+        slots = np.arange(poly.shape[2])
+        present = slots < count[..., None]
+        if k == 8:
+            # polygons only get smaller, so a plane can only cut a polygon
+            # if it cuts its current bounding sphere
+            num = np.maximum(count, 1)[..., None]
+            centers = np.einsum('bfc,bfck->bfk', present, poly)/num
+            radius = np.max(np.linalg.norm(poly - centers[:, :, None], axis=3)
+                            * present, axis=2)
+            radius[np.any(present & (labels < 0), axis=2)] = np.inf
+            candidates = (np.einsum('bjk,bik->bij', normals, centers) +
+                          radius[..., None] > dists[:, None, :] + eps)
+            candidates = np.take_along_axis(candidates, order, axis=2)
+        active = (count > 0) & (order[:, :, k] != faceids)
+        if candidates is not None:
+            active &= candidates[:, :, k]
+        rows = np.nonzero(active)
+        if not len(rows[0]):
+            continue
+        planes = order[:, :, k][rows]
+        normal = normals[rows[0], planes]
+        points = poly[rows]
+        dist = np.einsum('rck,rk->rc', points, normal) - dists[rows[0],
+                                                                planes][:, None]
+        outside = (dist > eps) & present[rows]
+        # only the polygons cut by their plane are clipped
+        cut = np.any(outside, axis=1)
+        if not cut.any():
+            continue
+        rows = (rows[0][cut], rows[1][cut])
+        points = points[cut]
+        dist = dist[cut]
+        outside = outside[cut]
+        j = planes[cut]
+        edges = labels[rows]
+        num = count[rows]
+        inside = ~outside
+        present = slots < num[:, None]
+        nxt = np.where(slots + 1 < num[:, None], slots + 1, 0)
+        nxt_inside = np.take_along_axis(inside, nxt, axis=1)
+        keep = present & inside
+        crossing = present & (inside != nxt_inside)
+        emitted = keep.astype(np.int64) + crossing
+        pos = np.cumsum(emitted, axis=1) - emitted
+        num = emitted.sum(axis=1)
+        width = max(num.max(), poly.shape[2])
+        if width > poly.shape[2]:
+            grow = width - poly.shape[2]
+            poly = np.concatenate([poly, np.zeros((b, f, grow, 3))], axis=2)
+            labels = np.concatenate(
+                [labels, np.full((b, f, grow), -1, dtype=np.int64)], axis=2)
+        newpoints = np.zeros((len(num), width, 3))
+        newedges = np.full((len(num), width), -1, dtype=np.int64)
+        ri, ki = np.nonzero(keep)
+        newpoints[ri, pos[ri, ki]] = points[ri, ki]
+        newedges[ri, pos[ri, ki]] = edges[ri, ki]
+        ri, ki = np.nonzero(crossing)
+        kn = nxt[ri, ki]
+        t = dist[ri, ki]/(dist[ri, ki] - dist[ri, kn])
+        target = pos[ri, ki] + keep[ri, ki]
+        newpoints[ri, target] = (points[ri, ki] + t[:, None] *
+                                 (points[ri, kn] - points[ri, ki]))
+        # leaving the plane starts an edge on plane j, entering it continues
+        # the edge of the current corner
+        newedges[ri, target] = np.where(inside[ri, ki], j[ri],
+                                        edges[ri, ki])
+        poly[rows] = newpoints
+        labels[rows] = newedges
+        count[rows] = num
+    return poly, labels, count
+
+
+def _clipped_vertices(normals, dists, eps):
+    """
+    \brief Compute the vertices from the clipped polygons of all planes, a
+    corner is defined by its own plane and the planes of its two edges
+    \return as polytope_vertices and a mask of the unbounded brushes
+    """
+    b, f = dists.shape
+    poly, labels, count = _clip_polygons(normals, dists, eps)
+    faceids = np.arange(f)
+    width = poly.shape[2]
+    slots = np.arange(width)
+    prev = np.where(slots > 0, slots - 1, count[..., None] - 1)
+    prev = np.maximum(prev, 0)
+    planes = np.stack([np.broadcast_to(faceids[:, None], labels.shape),
+                       np.take_along_axis(labels, prev, axis=2), labels],
+                      axis=-1)
+    # every vertex is taken from the polygon of its lowest plane only
+    present = slots < count[..., None]
+    valid = (present & (planes[..., 1] > faceids[:, None]) &
+             (planes[..., 2] > faceids[:, None]))
+    # a face reaching the initial square extends to infinity
+    unbounded = np.any(present & (labels < 0), axis=(1, 2))
+    return _compact(poly.reshape(b, -1, 3), valid.reshape(b, -1),
+                    planes.reshape(b, -1, 3)) + (unbounded,)
+
+
+def polytope_vertices(normals, dists, eps=EPSILON, chunksize=2**20,
+                      with_unbounded=False):
+    """
+    \brief Compute the vertices of many convex polytopes with the same number
+    of planes
+    Brushes with up to TRIPLE_LIMIT planes intersect all triples of planes,
+    larger ones clip a polygon on every plane with the other planes.
+    \param normals outward unit normals, shape (b, f, 3)
+    \param dists plane distances, shape (b, f)
+    \param eps tolerance for points lying on a plane
+    \param chunksize maximum number of plane triples solved at once
+    \param with_unbounded also return a mask of the brushes which are
+    unbounded, shape (b,)
+    \return vertices (b, v, 3), a mask of the valid vertices (b, v) and the
+    indices of the three planes defining every vertex (b, v, 3), the valid
+    vertices come first
+    """
+    normals = np.asarray(normals, dtype=np.float64)
+    dists = np.asarray(dists, dtype=np.float64)
+    if dists.shape[1] > TRIPLE_LIMIT:
+        result = _clipped_vertices(normals, dists, eps)
+    else:
+        result = _triple_vertices(normals, dists, eps, chunksize)
+        if with_unbounded:
+            result += (_unbounded_rays(normals),)
+    return result if with_unbounded else result[:3]
+
+
+def brush_vertices(brush, eps=EPSILON):
+    """
+    \brief Return the unique vertices of a brush, shape (v, 3)
+    """
+    normals, dists = brush_planes(brush)
+    points, valid, planes = polytope_vertices(normals[None], dists[None], eps)
+    points = points[0][valid[0]]
+    if not len(points):
+        return points
+    keys = np.round(points/eps).astype(np.int64)
+    unique = np.unique(keys, axis=0, return_index=True)[1]
+    return points[np.sort(unique)]
+
+
+def face_polygons(counts, verts, eps=EPSILON):
+    """
+    \brief Compute the polygons of all faces of many brushes
+    \param counts number of faces of every brush
+    \param verts plane points of all faces, shape (n, 3, 3)
+    \param eps tolerance for points lying on a plane
+    \return list of n arrays of shape (k, 3), the corners of every face in
+    counter clockwise order seen from outside, faces which don't touch
+    their brush get an empty array
+    """
+    poly = Polytopes(counts, verts, eps)
+    starts = np.concatenate([[0], np.cumsum(poly.counts)[:-1]])
+    polygons = [np.zeros((0, 3))]*len(poly.dists)
+    for group in poly.groups:
+        normals = group["normals"]
+        points = group["points"]
+        onplane = group["valid"][:, None, :] & (np.abs(
+            np.einsum('bvk,bfk->bfv', points, normals) -
+            group["dists"][..., None]) <= eps)
+        num = np.maximum(onplane.sum(axis=2), 1)[..., None]
+        centers = np.einsum('bfv,bvk->bfk', onplane, points)/num
+        # basis of the plane with cross(u, w) = normal
+        helper_axis = np.where(np.abs(normals[..., 2:]) < 0.9, [0, 0, 1],
+                               [1, 0, 0])
+        u = np.cross(helper_axis, normals)
+        u /= np.maximum(np.linalg.norm(u, axis=-1), 1e-12)[..., None]
+        w = np.cross(normals, u)
+        rel = points[:, None] - centers[:, :, None]
+        angles = np.arctan2(np.einsum('bfvk,bfk->bfv', rel, w),
+                            np.einsum('bfvk,bfk->bfv', rel, u))
+        order = np.argsort(np.where(onplane, angles, np.inf), axis=2)
+        for b, f in zip(*np.nonzero(onplane.sum(axis=2) >= 3)):
+            corners = points[b, order[b, f, :onplane[b, f].sum()]]
+            # remove vertices found by several triples of planes
+            distinct = np.linalg.norm(corners - np.roll(corners, 1, axis=0),
+                                      axis=1) > eps
+            if distinct.sum() >= 3:
+                polygons[starts[group["indices"][b]] + f] = corners[distinct]
+    return polygons
+
+
+class Polytopes(object):
+    """
+    Planes and vertices of many brushes, brushes with the same number of
+    planes are processed together
+    """
+
+    def __init__(self, counts, verts, eps=EPSILON):
+        """
+        \brief Compute the polytopes of brushes given as face arrays
+        \param counts number of faces of every brush
+        \param verts plane points of all faces, shape (n, 3, 3)
+        \param eps tolerance for points lying on a plane
+        """
+        counts = np.asarray(counts, dtype=np.int64)
+        self.counts = counts
+        self.normals, self.dists = face_planes(verts)
+        self.group_of = np.zeros(len(counts), dtype=np.int64)
+        self.index_in_group = np.zeros(len(counts), dtype=np.int64)
+        self.mins = np.full((len(counts), 3), np.inf)
+        self.maxs = np.full((len(counts), 3), -np.inf)
+        self.groups = []
+        grouped = group_by_face_count(counts, self.normals, self.dists)
+        for g, (indices, normals, dists) in enumerate(grouped.values()):
+            points, valid, planes, unbounded = polytope_vertices(
+                normals, dists, eps, with_unbounded=True)
+            # replace invalid vertices by the first valid one, so they don't
+            # change minima and maxima
+            points = np.where(valid[..., None], points, points[:, :1])
+            nonempty = valid[:, 0]
+            self.mins[indices[nonempty]] = points[nonempty].min(axis=1)
+            self.maxs[indices[nonempty]] = points[nonempty].max(axis=1)
+            self.group_of[indices] = g
+            self.index_in_group[indices] = np.arange(len(indices))
+            self.groups.append({"indices": indices, "normals": normals,
+                                "dists": dists, "points": points,
+                                "valid": valid, "planes": planes,
+                                "unbounded": unbounded & nonempty})
+
+    @classmethod
+    def from_brushes(cls, brushes, eps=EPSILON):
+        """
+        \brief Compute the polytopes of all brushes of an object
+        \param brushes brush, primitive, modifier or an iterable of those
+        """
+        arrays = baseclasses.face_arrays(baseclasses.iter_brushes(brushes))
+        return cls(arrays["counts"], arrays["verts"], eps)
+
+    def __len__(self):
+        return len(self.counts)
+
+    @property
+    def empty(self):
+        """
+        \brief Mask of the brushes without any vertex
+        """
+        return ~np.all(self.mins <= self.maxs, axis=1)
+
+    def vertices(self, index):
+        """
+        \brief Vertices of a single brush (may contain duplicates)
+        """
+        group = self.groups[self.group_of[index]]
+        i = self.index_in_group[index]
+        return group["points"][i][group["valid"][i]]
+
+
+def object_bounds(obj, eps=EPSILON):
+    """
+    \brief Compute the bounding box of all brushes and patches of an object,
+    objects with a bounds() method (e.g. modifiers) provide it themselves
+    without generating their copies
+    \param obj brush, primitive, modifier or a list of those
+    \return (mins, maxs) or None if the object is empty
+    """
+    bounds = getattr(obj, "bounds", None)
+    if callable(bounds):
+        return bounds()
+    if isinstance(obj, (list, tuple)):
+        boxes = [box for box in (object_bounds(child, eps) for child in obj)
+                 if box is not None]
+        if not boxes:
+            return None
+        return (np.min([box[0] for box in boxes], axis=0),
+                np.max([box[1] for box in boxes], axis=0))
+    parts = list(baseclasses.iter_brushes(obj, patches=True))
+    patches = [p for p in parts if isinstance(p, baseclasses.Patch)]
+    brushes = [p for p in parts if not isinstance(p, baseclasses.Patch)]
+    arrays = baseclasses.face_arrays(brushes)
+    polytopes = Polytopes(arrays["counts"], arrays["verts"], eps)
+    valid = ~polytopes.empty
+    points = [polytopes.mins[valid], polytopes.maxs[valid]]
+    points += [patch.points.reshape(-1, 3) for patch in patches]
+    points = np.concatenate(points)
+    if not len(points):
+        return None
+    return points.min(axis=0), points.max(axis=0)
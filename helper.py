@@ -14,17 +14,18 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import sys
 import os
-import re
-import configparser
+import io
 from contextlib import contextmanager
 import functools
 import numpy as np
 from math import cos, sin
+import session
 
 
 brushdef = '// brush\n{{\nbrushDef\n{{\n{data}}}\n}}\n'
+patchdef = ('// patch\n{{\npatchDef2\n{{\n{texture}\n( {rows} {cols} 0 0 0 )\n'
+            '(\n{data})\n}}\n}}\n')
 
 
 @contextmanager
@@ -41,11 +42,141 @@ def group(f, name):
     f.write('\n}')
 
 
+@contextmanager
+def entity(f, keyvalues):
+    f.write('{\n')
+    for key, value in keyvalues.items():
+        f.write('"%s" "%s"\n' % (key, value))
+    yield
+    f.write('\n}')
+
+
+def _copy_bytes(src, dst, size, bufsize=2**20):
+    while size > 0:
+        data = src.read(min(size, bufsize))
+        if not data:
+            raise EOFError("Unexpected end of file")
+        dst.write(data)
+        size -= len(data)
+
+
+def _zip_member(path, member, compresslevel):
+    """
+    \brief Open a new entry of a zip archive for writing text
+    A new entry is appended to an existing archive, if writing fails the
+    archive is restored. An existing entry of the same name is replaced
+    by rewriting the archive, see _replace_zip_member.
+    """
+    import zipfile
+    existing = os.path.exists(path)
+    if existing:
+        with zipfile.ZipFile(path) as archive:
+            if member in archive.NameToInfo:
+                yield from _replace_zip_member(path, member, compresslevel)
+                return
+            start_dir = archive.start_dir
+        # the new entry is written over the central directory
+        with open(path, "rb") as f:
+            f.seek(start_dir)
+            directory = f.read()
+    try:
+        with zipfile.ZipFile(path, "a" if existing else "w",
+                             zipfile.ZIP_DEFLATED,
+                             compresslevel=compresslevel) as archive:
+            # the size is unknown in advance, so allow more than 2 GiB
+            with archive.open(member, "w", force_zip64=True) as binary, \
+                    io.TextIOWrapper(binary, encoding="utf-8") as f:
+                yield f
+    except BaseException:
+        if existing:
+            with open(path, "r+b") as f:
+                f.seek(start_dir)
+                f.write(directory)
+                f.truncate()
+        elif os.path.exists(path):
+            os.remove(path)
+        raise
+
+
+def _replace_zip_member(path, member, compresslevel):
+    """
+    \brief Write an entry into a new archive which replaces the old one
+    only if writing succeeds, the other entries are copied without
+    decompressing them
+    """
+    import zipfile
+    target = path + ".part"
+    try:
+        with zipfile.ZipFile(path) as src, open(path, "rb") as raw, \
+                zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED,
+                                compresslevel=compresslevel) as archive:
+            infos = sorted(src.infolist(), key=lambda info: info.header_offset)
+            # an entry reaches up to the next one, including its data
+            # descriptor
+            ends = [info.header_offset for info in infos[1:]] + [src.start_dir]
+            for info, end in zip(infos, ends):
+                if info.filename == member:
+                    continue
+                raw.seek(info.header_offset)
+                offset = archive.fp.tell()
+                _copy_bytes(raw, archive.fp, end - info.header_offset)
+                info.header_offset = offset
+                archive.filelist.append(info)
+                archive.NameToInfo[info.filename] = info
+                archive.start_dir = archive.fp.tell()
+            with archive.open(member, "w", force_zip64=True) as binary, \
+                    io.TextIOWrapper(binary, encoding="utf-8") as f:
+                yield f
+    except BaseException:
+        if os.path.exists(target):
+            os.remove(target)
+        raise
+    os.replace(target, path)
+
+
+@contextmanager
+def open_output(path, member=None, compresslevel=6):
+    """
+    \brief Open a text file for writing a .map file, the data is compressed
+    while it is written
+    \param path filename, files ending with '.gz' are gzip compressed,
+    '.pk3' and '.zip' files are zip archives
+    \param member name of the file inside of a zip archive, e.g.
+    'maps/mymap.map', the archive is created if it doesn't exist
+    \param compresslevel compression level from 0 to 9
+    """
+    if member is None and os.path.splitext(path)[1] in (".pk3", ".zip"):
+        raise ValueError("The name of the file inside of {} is "
+                         "needed".format(path))
+    if member is not None:
+        yield from _zip_member(path, member, compresslevel)
+    elif path.endswith(".gz"):
+        import gzip
+        with gzip.open(path, "wt", compresslevel=compresslevel,
+                       encoding="utf-8") as f:
+            yield f
+    else:
+        with open(path, "w") as f:
+            yield f
+
+
 def point_to_str(point):
     return '( {} {} {} )'.format(*point)
 
 
+def patch_row_to_str(row):
+    """
+    Format a row of patch control points given as [x y z s t]
+    """
+    return '( {} )\n'.format(' '.join('( {} {} {} {} {} )'.format(*point)
+                                      for point in row))
+
+
 def memoize(f):
+    """
+    \brief Cache the results of a function by the string representation of
+    its arguments, kept for scripts, the library caches in the session
+    """
     f.cache = {}
 
     @functools.wraps(f)
@@ -58,66 +189,57 @@ def memoize(f):
     return inner
 
 
-@memoize
+def set_xon_dir(path):
+    """
+    Set the base path of the Xonotic folder for this process
+    """
+    session.default().set_xon_dir(path)
+
+
+def set_geometry_only(value=True):
+    """
+    Skip the shader resolution and use a texture size of (64, 64) for all
+    textures, no game data is needed in this mode
+    """
+    session.default().geometry_only = value
+
+
+def geometry_only():
+    return session.current().geometry_only
+
+
 def xon_dir():
     """
-    Get the base path of the Xonotic folder
+    Get the base path of the Xonotic folder of the current session
+    The path is taken from the session (set_xon_dir for the default
+    session), the XONOTIC_DIR environment variable or config.conf, in this
+    order. If none is set, the user is asked for it when running
+    interactively.
     """
-    conffile = os.path.join(os.path.dirname(__file__), "config.conf")
-    cparser = configparser.ConfigParser()
-    cparser.read(conffile)
-    if not cparser.has_section("path"):
-        cparser.add_section("path")
-    if not cparser.has_option("path", "xondir"):
-        xondir = input("Please specify the Xonotic base directory:\n")
-        cparser.set("path", "xondir", xondir)
-        with open(conffile, "w") as cf:
-            cparser.write(cf)
-    return cparser.get("path", "xondir")
+    return session.current().xon_dir()
 
 
-@memoize
 def is_git_build():
-    if os.path.isdir(os.path.join(xon_dir(), "data", "xonotic-maps.pk3dir")):
-        return True
-    return False
+    return session.current().is_git_build()
 
 
-@memoize
 def find_maps_pk3():
     """
     Find the pk3 containing the map data
     """
-    # TODO: support other games
-    pat = re.compile(r"^xonotic-[\d\w]+-maps.pk3")
-    datadir = os.path.join(xon_dir(), "data")
-    for file in os.listdir(datadir):
-        if pat.search(file):
-            return os.path.join(datadir, file)
+    return session.current().find_maps_pk3()
 
 
 def find_maps_pk3dir():
-    return os.path.join(xon_dir(), "data", "xonotic-maps.pk3dir")
+    return session.current().find_maps_pk3dir()
 
 
-@memoize
 def find_mapping_support():
     """
     Find the pk3 with mapping support
     """
-    # TODO: support other games
-    pat = re.compile(r"^xonotic-\d+-maps-mapping.pk3")
-    userdir = os.path.expanduser("~")
-    if sys.platform == "win32" or sys.platform == "cygwin":
-        configpath = os.path.join(userdir, "Saved Games", "xonotic", "data")
-    elif sys.platform == "darwin":
-        configpath = os.path.join(userdir, "Library", "Application Support",
-                                  "xonotic", "data")
-    else:
-        configpath = os.path.join(userdir, ".xonotic", "data")
-    for file in os.listdir(configpath):
-        if pat.search(file):
-            return os.path.join(configpath, file)
+    return session.current().find_mapping_support()
+
 
 def RotationMatrixX(theta):
     """
@@ -148,3 +270,27 @@ def RotationMatrixZ(theta):
     return np.array([[ c, s, 0],
                      [-s, c, 0],
                      [ 0, 0, 1]])
+
+
+def RotationMatrix(axis, theta):
+    """
+    Rotation Matrix around an arbitrary axis
+    """
+    return rotation_matrices(axis, [theta])[0]
+
+
+def rotation_matrices(axis, thetas):
+    """
+    Rotation Matrices around an arbitrary axis for many angles at once,
+    returns an array of shape (len(thetas), 3, 3)
+    """
+    axis = np.array(axis, dtype=np.float64)
+    axis /= np.linalg.norm(axis)
+    thetas = np.asarray(thetas, dtype=np.float64)
+    c = np.cos(thetas)[:, None, None]
+    s = np.sin(thetas)[:, None, None]
+    x, y, z = axis
+    cross = np.array([[0, z, -y],
+                      [-z, 0, x],
+                      [y, -x, 0]])
+    return c*np.eye(3) + s*cross + (1-c)*np.outer(axis, axis)
@@ -0,0 +1,141 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Export of repeated objects as a model with misc_model entities.
+
+The base object of a modifier is polygonized from its brush planes and
+written once as a Wavefront OBJ file, the materials are the shader names.
+Every copy becomes a misc_model entity with origin, angles and
+modelscale_vec taken from the transformations of the modifier.
+q3map2 applies scale, rotation (roll around x, pitch around y, yaw around z)
+and translation in this order.
+"""
+
+from collections import OrderedDict
+import numpy as np
+import baseclasses
+import geometry
+
+
+def euler_angles(rotations):
+    """
+    \brief Convert rotation matrices to angles for misc_model
+    \param rotations rotation matrices for row vectors (p @ R), shape (n, 3, 3)
+    \return pitch, yaw and roll in degrees, shape (n, 3)
+    """
+    # column vector form R = Rz(yaw) Ry(pitch) Rx(roll)
+    rot = np.swapaxes(rotations, 1, 2)
+    pitch = np.arcsin(np.clip(-rot[:, 2, 0], -1, 1))
+    gimbal = np.abs(rot[:, 2, 0]) > 1 - 1e-9
+    roll = np.where(gimbal, 0, np.arctan2(rot[:, 2, 1], rot[:, 2, 2]))
+    yaw = np.where(gimbal, np.arctan2(-rot[:, 0, 1], rot[:, 1, 1]),
+                   np.arctan2(rot[:, 1, 0], rot[:, 0, 0]))
+    return np.rad2deg(np.stack([pitch, yaw, roll], axis=-1))
+
+
+def decompose(transforms, origin):
+    """
+    \brief Split transformations into scale, rotation and translation
+    \param transforms transformations for row vectors, shape (n, 4, 4), the
+    linear part has to be a scaling along the axes followed by a rotation
+    \param origin origin of the model in the coordinates of the base object
+    \return origins (n, 3), angles (n, 3) and scales (n, 3) for misc_model
+    """
+    transforms = np.asarray(transforms, dtype=np.float64)
+    linear = transforms[:, :3, :3]
+    scales = np.linalg.norm(linear, axis=2)
+    # a mirroring is expressed by a negative scale along x
+    scales[:, 0] *= np.where(np.linalg.det(linear) < 0, -1, 1)
+    rotations = linear/scales[:, :, None]
+    origins = np.asarray(origin) @ linear + transforms[:, 3, :3]
+    return origins, euler_angles(rotations), scales
+
+
+def model_entities(transforms, origin, model, keyvalues=None):
+    """
+    \brief Create the key/values of misc_model entities
+    \param transforms transformations of the copies, shape (n, 4, 4)
+    \param origin origin of the model in the coordinates of the base object
+    \param model path of the model relative to the game directory
+    \param keyvalues additional key/values, e.g. spawnflags
+    \return list of OrderedDicts
+    """
+    origins, angles, scales = decompose(transforms, origin)
+    entities = []
+    for o, a, s in zip(origins.tolist(), (np.round(angles, 6) + 0).tolist(),
+                       scales.tolist()):
+        entity = OrderedDict([("classname", "misc_model"), ("model", model),
+                              ("origin", "{} {} {}".format(*o))])
+        if any(a):
+            entity["angles"] = "{} {} {}".format(*a)
+        if not np.allclose(s, 1):
+            entity["modelscale_vec"] = "{} {} {}".format(*s)
+        entity.update(keyvalues or {})
+        entities.append(entity)
+    return entities
+
+
+def model_origin(obj):
+    """
+    \brief Center of the bounding box of all brushes of an object
+    """
+    polytopes = geometry.Polytopes.from_brushes(obj)
+    valid = ~polytopes.empty
+    if not valid.any():
+        return np.zeros(3)
+    return (polytopes.mins[valid].min(axis=0) +
+            polytopes.maxs[valid].max(axis=0))/2
+
+
+def write_obj(f, obj, origin=(0, 0, 0)):
+    """
+    \brief Write the brushes of an object as Wavefront OBJ
+    \param f file like object
+    \param obj brush, primitive, modifier or an iterable of those
+    \param origin this point becomes the origin of the model
+    """
+    arrays = baseclasses.face_arrays(baseclasses.iter_brushes(obj))
+    polygons = geometry.face_polygons(arrays["counts"], arrays["verts"])
+    normals = geometry.face_planes(arrays["verts"])[0]
+    texnames, texids = np.unique(arrays["textures"], return_inverse=True)
+    sizes = np.array([baseclasses.texture_size(t) for t in texnames])
+    rotscale, off = baseclasses.texture_matrices(
+        arrays["angles"], arrays["offsets"], arrays["scales"],
+        sizes[texids.ravel()].reshape(-1, 2))
+    saxis, taxis = baseclasses.texture_axes(normals)
+    origin = np.asarray(origin, dtype=np.float64)
+
+    f.write("# generated by Asset Generator\n")
+    index = 1
+    for texid, texture in enumerate(texnames.tolist()):
+        faces = [i for i in np.flatnonzero(texids.ravel() == texid).tolist()
+                 if len(polygons[i])]
+        if not faces:
+            continue
+        f.write("usemtl {}\n".format(texture))
+        for i in faces:
+            corners = polygons[i]
+            st = np.stack([corners @ saxis[i], corners @ taxis[i]], axis=-1)
+            uv = st @ rotscale[i].T + off[i]
+            for v in (corners - origin).tolist():
+                f.write("v {} {} {}\n".format(*v))
+            # image rows go down, OBJ texture coordinates go up
+            for u, v in uv.tolist():
+                f.write("vt {} {}\n".format(u, -v))
+            f.write("f {}\n".format(" ".join(
+                "{0}/{0}".format(index + k) for k in range(len(corners)))))
+            index += len(corners)
@@ -0,0 +1,320 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Streaming parser for Radiant .map files (brush primitives format).
+
+The file is memory-mapped and tokenized lazily, so only the brush that is
+currently parsed is held in memory. Brushes are returned as
+baseclasses.Brush objects and patches as baseclasses.Patch objects, use
+storage.save to turn the brushes into an array store.
+"""
+
+import re
+import mmap
+from contextlib import ExitStack
+from collections import OrderedDict
+import numpy as np
+import baseclasses
+import helper
+
+
+# comments always reach the end of their line, so that matching can't
+# backtrack into them
+_SKIP = rb"(?:\s+|//[^\n]*(?![^\n]))*"
+_TOKENS = re.compile(_SKIP + rb"""(?:
+    (?P<QUOTED>   "[^"]*"      ) |
+    (?P<PUNCT>    [{}()]       ) |
+    (?P<WORD>     (?!//)[^\s{}()"]+  ))
+    """, re.VERBOSE)
+_END = re.compile(_SKIP + rb"$")
+_NUM = rb"\s*(-?[\d.eE+-]+)"
+_VEC3 = rb"\s*\(" + 3*_NUM + rb"\s*\)"
+# a complete brushDef face, the flags at the end are optional
+_FACE = re.compile(3*_VEC3 + rb"\s*\(" + 2*_VEC3 + rb"\s*\)\s*([^\s{}()]+)"
+                   rb"(?:[ \t]+-?\d+){0,3}[ \t]*")
+
+
+class Scanner(object):
+    """
+    Tokenizer for .map files working on a bytes-like object
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def next(self):
+        """
+        \brief Return the next token as (kind, value), kind is None at the end
+        """
+        match = _TOKENS.match(self.data, self.pos)
+        if not match:
+            if not _END.match(self.data, self.pos):
+                raise ValueError("Invalid token at position {}".format(
+                    self.pos))
+            self.pos = len(self.data)
+            return None, None
+        self.pos = match.end()
+        kind = match.lastgroup
+        if kind == 'QUOTED':
+            return kind, match.group(kind)[1:-1].decode()
+        return kind, match.group(kind).decode()
+
+    def face(self):
+        """
+        \brief Parse a brushDef face, return None if there is none
+        """
+        match = _FACE.match(self.data, self.pos)
+        if not match:
+            return None
+        self.pos = match.end()
+        groups = match.groups()
+        return [float(v) for v in groups[:15]], groups[15].decode()
+
+
+class Entity(baseclasses.BaseAsset):
+    """
+    An entity of a .map file with its key/values, brushes and patches
+    """
+
+    def __init__(self, keyvalues=None, brushes=None, patches=None):
+        super().__init__()
+        self.keyvalues = OrderedDict(keyvalues or {})
+        self.brushes = brushes if brushes is not None else []
+        self.patches = patches if patches is not None else []
+
+    @property
+    def classname(self):
+        return self.keyvalues.get("classname")
+
+    def write(self, f):
+        with helper.entity(f, self.keyvalues):
+            for brush in self.brushes:
+                f.write(str(brush))
+            for patch in self.patches:
+                f.write(str(patch))
+
+
+class MapParser(object):
+    def __init__(self, path):
+        """
+        \brief Parse a .map file
+        \param path path of the .map file
+        """
+        self.path = path
+        # number of old style brushes and other unsupported primitives
+        self.skipped = 0
+        self._texsizes = {}
+
+    def _data(self, f):
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            return b""
+
+    def _next(self, scanner):
+        kind, token = scanner.next()
+        if kind is None:
+            raise ValueError("Unexpected end of file in {}".format(self.path))
+        return kind, token
+
+    def _expect(self, scanner, value):
+        kind, token = self._next(scanner)
+        if token != value:
+            raise ValueError("Expected '{}', got '{}' in {}".format(
+                value, token, self.path))
+
+    def _skip_block(self, scanner):
+        depth = 1
+        while depth:
+            kind, token = self._next(scanner)
+            if kind == 'PUNCT':
+                if token == "{":
+                    depth += 1
+                elif token == "}":
+                    depth -= 1
+
+    def _texture_size(self, texture):
+        if texture not in self._texsizes:
+            self._texsizes[texture] = baseclasses.texture_size(texture)
+        return self._texsizes[texture]
+
+    def _brushdef(self, scanner):
+        self._expect(scanner, "{")
+        values = []
+        textures = []
+        face = scanner.face()
+        while face:
+            values.append(face[0])
+            textures.append(face[1])
+            face = scanner.face()
+        self._expect(scanner, "}")
+        self._expect(scanner, "}")
+        values = np.array(values).reshape(-1, 15)
+        texsizes = np.array([self._texture_size(t) for t in textures])
+        angles, offsets, scales = baseclasses.texture_params(
+            values[:, [9, 10, 12, 13]].reshape(-1, 2, 2),
+            values[:, [11, 14]], texsizes)
+        verts = values[:, :9].reshape(-1, 3, 3)
+        faces = [baseclasses.Face(v[0], v[1], v[2], tex, a, o[0], o[1],
+                                  sc[0], sc[1])
+                 for v, tex, a, o, sc in zip(verts, textures, angles.tolist(),
+                                             offsets, scales)]
+        # the parameters can't express sheared textures, so the original
+        # matrix is written as long as a face is unchanged
+        for face, matrix in zip(faces, values[:, 9:15]):
+            face.texture_matrix = matrix
+        return baseclasses.Brush(faces)
+
+    def _numbers(self, scanner, count):
+        self._expect(scanner, "(")
+        values = [float(self._next(scanner)[1]) for i in range(count)]
+        self._expect(scanner, ")")
+        return values
+
+    def _patchdef(self, scanner):
+        self._expect(scanner, "{")
+        texture = self._next(scanner)[1]
+        rows, cols = self._numbers(scanner, 5)[:2]
+        rows, cols = int(rows), int(cols)
+        self._expect(scanner, "(")
+        values = []
+        for i in range(rows):
+            self._expect(scanner, "(")
+            for j in range(cols):
+                values.append(self._numbers(scanner, 5))
+            self._expect(scanner, ")")
+        self._expect(scanner, ")")
+        self._expect(scanner, "}")
+        self._expect(scanner, "}")
+        values = np.array(values).reshape(rows, cols, 5)
+        return baseclasses.Patch(values[..., :3], texture, values[..., 3:])
+
+    def events(self):
+        """
+        \brief Generate the contents of the map as a stream of events
+        ('entity', None), ('key', (key, value)), ('brush', Brush),
+        ('patch', Patch) and ('end', None)
+        """
+        with open(self.path, "rb") as f:
+            scanner = Scanner(self._data(f))
+            try:
+                kind, token = scanner.next()
+                while kind is not None:
+                    if token != "{":
+                        raise ValueError("Expected '{{', got '{}' in "
+                                         "{}".format(token, self.path))
+                    yield 'entity', None
+                    kind, token = self._next(scanner)
+                    while token != "}":
+                        if kind == 'QUOTED':
+                            yield 'key', (token, self._next(scanner)[1])
+                        elif token == "{":
+                            kind, token = self._next(scanner)
+                            if token == "brushDef":
+                                yield 'brush', self._brushdef(scanner)
+                            elif token == "patchDef2":
+                                yield 'patch', self._patchdef(scanner)
+                            else:
+                                # old style brushes
+                                self.skipped += 1
+                                self._skip_block(scanner)
+                        else:
+                            raise ValueError("Unexpected token '{}' in "
+                                             "{}".format(token, self.path))
+                        kind, token = self._next(scanner)
+                    yield 'end', None
+                    kind, token = scanner.next()
+            finally:
+                if isinstance(scanner.data, mmap.mmap):
+                    scanner.data.close()
+
+    def entities(self):
+        """
+        \brief Generate all entities of the map
+        """
+        entity = None
+        for event, value in self.events():
+            if event == 'entity':
+                entity = Entity()
+            elif event == 'key':
+                entity.keyvalues[value[0]] = value[1]
+            elif event == 'brush':
+                entity.brushes.append(value)
+            elif event == 'patch':
+                entity.patches.append(value)
+            else:
+                yield entity
+
+    def brushes(self):
+        """
+        \brief Generate (keyvalues, brush) for all brushes of the map,
+        keyvalues are the ones of the entity containing the brush
+        """
+        keyvalues = None
+        for event, value in self.events():
+            if event == 'entity':
+                keyvalues = OrderedDict()
+            elif event == 'key':
+                keyvalues[value[0]] = value[1]
+            elif event == 'brush':
+                yield keyvalues, value
+
+
+def parse(path):
+    """
+    \brief Return a list of all entities of a .map file
+    """
+    return list(MapParser(path).entities())
+
+
+def transform_map(src, dst, func):
+    """
+    \brief Stream a .map file through a function and write the result
+    \param src path of the source .map file
+    \param dst path of the destination .map file
+    \param func function(brush, keyvalues) returning the transformed brush,
+    a list of brushes or None to drop the brush, patches are passed through
+    the same function
+    """
+    parser = MapParser(src)
+    with open(dst, "w") as f, ExitStack() as stack:
+        started = False
+        for event, value in parser.events():
+            if event == 'entity':
+                keyvalues = OrderedDict()
+                started = False
+            elif event == 'key':
+                keyvalues[value[0]] = value[1]
+            else:
+                if not started:
+                    # key/values always come before the brushes
+                    stack.enter_context(helper.entity(f, keyvalues))
+                    started = True
+                if event in ('brush', 'patch'):
+                    result = func(value, keyvalues)
+                    if result is None:
+                        continue
+                    if isinstance(result, (baseclasses.Brush,
+                                           baseclasses.Patch)):
+                        result = [result]
+                    for brush in result:
+                        f.write(str(brush))
+                else:
+                    stack.close()
+    return parser
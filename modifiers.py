@@ -14,14 +14,74 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import io
 import numpy as np
 import copy
 import baseclasses
+import geometry
 import helper
+import session
+
+
+def instance_arrays(obj, transforms, texture_lock=False):
+    """
+    \brief Face arrays (see baseclasses.face_arrays) of transformed copies of
+    an object, computed with a single broadcast over the transformations
+    \param obj object to copy
+    \param transforms transformations for row vectors, shape (n, 4, 4)
+    \param texture_lock keep the textures fixed on the faces of the copies,
+    otherwise the textures of the copies are projected anew
+    """
+    base = baseclasses.face_arrays(baseclasses.iter_brushes(obj))
+    linear = transforms[:, :3, :3]
+    verts = (np.einsum('fvj,cjk->cfvk', base["verts"], linear) +
+             transforms[:, None, None, 3, :3])
+    count = len(transforms)
+    arrays = {key: np.tile(value, (count,) + (1,)*(value.ndim-1))
+              for key, value in base.items() if key != "verts"}
+    # mirroring transformations flip the faces
+    mirrored = np.linalg.det(linear) < 0
+    if texture_lock:
+        angles, offsets, scales = baseclasses.lock_texture_params(
+            np.tile(base["verts"], (count, 1, 1)),
+            verts.reshape(-1, 3, 3), arrays["textures"], arrays["angles"],
+            arrays["offsets"], arrays["scales"],
+            np.repeat(mirrored, len(base["verts"])))
+        arrays.update(angles=angles, offsets=offsets, scales=scales)
+    verts[mirrored] = verts[mirrored][:, :, [0, 2, 1]]
+    arrays["verts"] = verts.reshape(-1, 3, 3)
+    return arrays
+
+
+def transformed_parts(obj, matrix, texture_lock=False):
+    """
+    \brief Transformed copy of an object which contains patches
+    \param obj object to copy
+    \param matrix transformation for row vectors, shape (4, 4)
+    \param texture_lock keep the textures fixed on the faces of the copy
+    \return list of brushes and patches, primitives written as patches are
+    split into their hull and their patches
+    """
+    brushes = []
+    patches = []
+    for part in baseclasses.iter_brushes(obj, patches=True):
+        if isinstance(part, baseclasses.Patch):
+            patches.append(copy.deepcopy(part))
+        else:
+            brushes.append(part)
+    if brushes:
+        # copies of the faces, primitives generate theirs on every access
+        brushes = baseclasses.brushes_from_arrays(
+            **baseclasses.face_arrays(brushes))
+        baseclasses.transform_brushes(brushes, matrix, texture_lock)
+    for patch in patches:
+        patch.transform(matrix)
+    return brushes + patches
 
 
 class Array(object):
-    def __init__(self, obj, count, offset, relative=False):
+    def __init__(self, obj, count, offset, relative=False, rotation=None,
+                 pivot=(0, 0, 0), step_scale=1, texture_lock=False):
         """
         \brief Copy an object multiple times and place them with
         a certain offset
@@ -29,19 +89,49 @@ class Array(object):
         \param count Number of copies
         \param offset Offset between the copies
         \param relative use relaitve or absolute offset
+        \param rotation Rotation between the copies as (axis, angle),
+        the angle is given in radians
+        \param pivot Center of the rotation and scaling
+        \param step_scale Scale factor between the copies (scalar or list of
+        length 3)
+        \param texture_lock keep the textures fixed on the copies instead of
+        projecting them anew
+        The i-th copy is scaled by step_scale**i and rotated by i*angle around
+        the pivot, then moved by i*offset.
         """
         self.obj = obj
         self.count = count
         self.offset = offset
         self.relative = relative
+        self.rotation = rotation
+        self.pivot = pivot
+        self.step_scale = step_scale
+        self.texture_lock = texture_lock
 
     @property
     def isGroupable(self):
         return self.obj.isGroupable
 
+    def bounds(self):
+        """
+        \brief Bounding box (mins, maxs) of all copies, the bounding box of
+        the object is transformed with every copy
+        \return (mins, maxs) or None if the object is empty
+        """
+        box = geometry.object_bounds(self.obj)
+        if box is None:
+            return None
+        corners = np.array([[box[x][0], box[y][1], box[z][2]]
+                            for x in (0, 1) for y in (0, 1) for z in (0, 1)])
+        transforms = self.transforms()
+        points = (np.einsum('vj,cjk->cvk', corners, transforms[:, :3, :3]) +
+                  transforms[:, None, 3, :3]).reshape(-1, 3)
+        return points.min(axis=0), points.max(axis=0)
+
     @property
     def center(self):
-        return (self[0].center + self[self.count-1].center)/2
+        mins, maxs = self.bounds()
+        return (mins + maxs)/2
 
     @property
     def offset(self):
@@ -51,25 +141,101 @@ class Array(object):
     def offset(self, value):
         self._offset = np.array(value, dtype=np.float)
 
+    @property
+    def pivot(self):
+        return self._pivot
+
+    @pivot.setter
+    def pivot(self, value):
+        self._pivot = np.array(value, dtype=np.float)
+
+    @property
+    def step_scale(self):
+        return self._step_scale
+
+    @step_scale.setter
+    def step_scale(self, value):
+        self._step_scale = np.ones(3)*np.array(value, dtype=np.float)
+
+    @property
+    def is_translation(self):
+        """
+        \brief True if the copies are only moved, not rotated or scaled
+        """
+        return self.rotation is None and np.all(self.step_scale == 1)
+
     def move(self, offset):
         self.obj.move(offset)
 
     @property
     def size(self):
-        return self[self.count-1].center - self[0].center + self.obj.size
+        mins, maxs = self.bounds()
+        return maxs - mins
+
+    def transforms(self):
+        """
+        \brief Return the transformations of all copies as an array of shape
+        (count, 4, 4), points are transformed as row vectors: [x y z 1] @ M
+        """
+        steps = np.arange(self.count)
+        if self.relative:
+            offset = self.offset*self.obj.size
+        else:
+            offset = self.offset
+        linear = self.step_scale**steps[:, None, None]*np.eye(3)
+        if self.rotation is not None:
+            axis, angle = self.rotation
+            linear = linear @ helper.rotation_matrices(axis, steps*angle)
+        matrices = np.zeros((self.count, 4, 4))
+        matrices[:, :3, :3] = linear
+        matrices[:, 3, :3] = (self.pivot - self.pivot @ linear +
+                              steps[:, None]*offset)
+        matrices[:, 3, 3] = 1
+        return matrices
+
+    def instance_arrays(self, transforms=None):
+        """
+        \brief Face arrays (see baseclasses.face_arrays) of all copies,
+        computed with a single broadcast over the stacked transformations
+        \param transforms transformations to use instead of self.transforms()
+        """
+        if transforms is None:
+            transforms = self.transforms()
+        return instance_arrays(self.obj, transforms, self.texture_lock)
 
     def __len__(self):
         return self.count
 
     def __iter__(self):
-        i = 0
-        while i < self.count:
-            yield self[i]
-            i += 1
+        if self.is_translation and not self.texture_lock:
+            i = 0
+            while i < self.count:
+                yield self[i]
+                i += 1
+        elif baseclasses.writes_patches(self.obj):
+            for matrix in self.transforms():
+                yield from transformed_parts(self.obj, matrix,
+                                             self.texture_lock)
+        else:
+            yield from baseclasses.brushes_from_arrays(**self.instance_arrays())
 
     def __getitem__(self, key):
+        """
+        \brief Return the copy with the given index, rotated or scaled copies
+        are returned as brush or list of brushes and patches
+        """
         if type(key) != int:
             raise IndexError("Only integers are supported")
+        if ((not self.is_translation or self.texture_lock) and
+                baseclasses.writes_patches(self.obj)):
+            return transformed_parts(
+                self.obj, self.transforms()[key % self.count],
+                self.texture_lock)
+        if not self.is_translation or self.texture_lock:
+            arrays = self.instance_arrays(
+                self.transforms()[[key % self.count]])
+            brushes = baseclasses.brushes_from_arrays(**arrays)
+            return brushes[0] if len(brushes) == 1 else brushes
         obj = copy.deepcopy(self.obj)
         if self.relative:
             offset = self.offset*obj.size
@@ -78,15 +244,29 @@ class Array(object):
         obj.move((key % self.count)*offset)
         return obj
 
+    def write(self, f, chunksize=1024):
+        """
+        \brief Write all copies, transforming chunks of copies at once,
+        objects containing patches are written copy by copy
+        """
+        if baseclasses.writes_patches(self.obj):
+            for obj in self:
+                f.write(str(obj))
+            return
+        transforms = self.transforms()
+        for i in range(0, self.count, chunksize):
+            baseclasses.write_brushes(
+                f, **self.instance_arrays(transforms[i:i+chunksize]))
+
     def __str__(self):
-        data = ""
-        for obj in self:
-            data += str(obj)
-        return data
+        f = io.StringIO()
+        self.write(f)
+        return f.getvalue()
 
 
 class RandomScatter(object):
-    def __init__(self, obj, count, max_offset, scale_variation=0):
+    def __init__(self, obj, count, max_offset, scale_variation=0, rng=None,
+                 texture_lock=False):
         """
         \brief Copy an object multiple times and place them with
         a random offset and scale
@@ -95,11 +275,17 @@ class RandomScatter(object):
         \param max_offset Maximum offset of the scattered objects
         \param scale_variation Variation of the objects scale
         0 means no change in scale
+        \param rng numpy random number generator, by default the one of the
+        current session is used
+        \param texture_lock keep the textures fixed on the copies instead of
+        projecting them anew
         """
         self.obj = obj
         self.count = count
         self.max_offset = max_offset
         self.scale_variation = scale_variation
+        self.rng = rng
+        self.texture_lock = texture_lock
 
     @property
     def isGroupable(self):
@@ -124,6 +310,21 @@ class RandomScatter(object):
     def size(self):
         return self.max_offset + self.obj.size
 
+    def bounds(self):
+        """
+        \brief Bounding box (mins, maxs) of all possible copies, the largest
+        scale is applied to the bounding box of the object and it is moved by
+        the maximum offset
+        \return (mins, maxs) or None if the object is empty
+        """
+        box = geometry.object_bounds(self.obj)
+        if box is None:
+            return None
+        center = (box[0] + box[1])/2
+        half = ((box[1] - box[0])/2*(1 + np.abs(self.scale_variation)) +
+                np.abs(self.max_offset))
+        return center - half, center + half
+
     @property
     def scale_variation(self):
         return self._scale_variation
@@ -132,21 +333,69 @@ class RandomScatter(object):
     def scale_variation(self, value):
         self._scale_variation = np.array(value, dtype=np.float)
 
+    def random_parameters(self):
+        """
+        \brief Draw the random offsets (count, 3) and scales of all copies
+        """
+        rng = self.rng if self.rng is not None else session.current().rng
+        offsets = []
+        scales = []
+        for i in range(self.count):
+            offsets.append(2*(rng.random(3)-0.5)*self.max_offset)
+            scales.append(2*(rng.random()-0.5)*self.scale_variation + 1)
+        return np.array(offsets).reshape(-1, 3), scales
+
+    def transforms(self):
+        """
+        \brief Return newly randomized transformations of all copies as an
+        array of shape (count, 4, 4), points are transformed as row vectors:
+        [x y z 1] @ M, the copies are scaled around the object's center
+        """
+        offsets, scales = self.random_parameters()
+        scales = np.ones((self.count, 3))*np.reshape(scales, (self.count, -1))
+        center = self.obj.center
+        matrices = np.zeros((self.count, 4, 4))
+        matrices[:, :3, :3] = scales[:, :, None]*np.eye(3)
+        matrices[:, 3, :3] = center - center*scales + offsets
+        matrices[:, 3, 3] = 1
+        return matrices
+
     def randomize_objects(self):
         """
         Do the actual randomizing
         """
         objs = []
-        for i in range(self.count):
+        for offset, scale in zip(*self.random_parameters()):
             obj = copy.deepcopy(self.obj)
-            offsets = 2*(np.random.rand(3)-0.5)*self.max_offset
-            obj.move(offsets)
-            scales = 2*(np.random.rand()-0.5)*self.scale_variation + 1
-            obj.scale(scales)
+            obj.move(offset)
+            obj.scale(scale)
             objs.append(obj)
         return objs
 
+    def __len__(self):
+        return self.count
+
+    def _copied_parts(self):
+        return [part for matrix in self.transforms()
+                for part in transformed_parts(self.obj, matrix,
+                                              self.texture_lock)]
+
+    def __iter__(self):
+        if baseclasses.writes_patches(self.obj):
+            return iter(self._copied_parts())
+        if self.texture_lock:
+            return iter(baseclasses.brushes_from_arrays(
+                **instance_arrays(self.obj, self.transforms(), True)))
+        return iter(self.randomize_objects())
+
     def __str__(self):
+        if baseclasses.writes_patches(self.obj):
+            return "".join(str(part) for part in self._copied_parts())
+        if self.texture_lock:
+            f = io.StringIO()
+            baseclasses.write_brushes(
+                f, **instance_arrays(self.obj, self.transforms(), True))
+            return f.getvalue()
         data = ""
         for obj in self.randomize_objects():
             data += str(obj)
@@ -14,11 +14,29 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import io
 from collections import defaultdict
 import numpy as np
 import baseclasses
 
 
+def segments_for_tolerance(radius, tolerance, angle=2*np.pi, minimum=3):
+    """
+    \brief Number of segments needed to approximate an arc so that the
+    distance between the arc and its chords stays below a tolerance
+    \param radius radius of the arc
+    \param tolerance maximum chord error in map units
+    \param angle angle of the arc in radians
+    \param minimum minimum number of segments
+    """
+    if tolerance <= 0:
+        raise ValueError("Tolerance must be positive")
+    if tolerance >= radius:
+        return minimum
+    step = 2*np.arccos(1 - tolerance/radius)
+    return max(minimum, int(np.ceil(angle/step - 1e-9)))
+
+
 class Cuboid(baseclasses.BasePrimitive, baseclasses.Brush):
     def __init__(self, center, size, texture="common/caulk"):
         """
@@ -68,9 +86,51 @@ class Cuboid(baseclasses.BasePrimitive, baseclasses.Brush):
                                  self.texture["top"])]
 
 
-class TruncatedConeBrush(baseclasses.BasePrimitive, baseclasses.Brush):
+# control polygon of a circle made of 4 quadratic Bezier segments
+_CIRCLE = np.array([[1, 0], [1, 1], [0, 1], [-1, 1], [-1, 0],
+                    [-1, -1], [0, -1], [1, -1], [1, 0]], dtype=np.float64)
+
+
+class CurvedBrush(baseclasses.BasePrimitive, baseclasses.Brush):
+    """
+    Base class for curved primitives, which can either be written as a
+    single brush or as patch meshes with a caulked hull brush
+    """
+
+    @property
+    def output(self):
+        return self._output
+
+    @output.setter
+    def output(self, value):
+        if value not in ("brush", "patch"):
+            raise ValueError("Output must be 'brush' or 'patch'")
+        self._output = value
+
+    def hull(self):
+        raise NotImplementedError("This is an abstract class")
+
+    def patches(self):
+        raise NotImplementedError("This is an abstract class")
+
+    def write(self, f):
+        if self.output == "patch":
+            f.write(str(self.hull()))
+            for patch in self.patches():
+                f.write(str(patch))
+        else:
+            f.write(baseclasses.Brush.__str__(self))
+
+    def __str__(self):
+        f = io.StringIO()
+        self.write(f)
+        return f.getvalue()
+
+
+class TruncatedConeBrush(CurvedBrush):
     def __init__(self, center, radius, height, radius2=0, truncation_ratio=0,
-                 numSides=16, texture="common/caulk"):
+                 numSides=16, texture="common/caulk", tolerance=None,
+                 output="brush"):
         """
         \brief Generate a (truncated) cone with numSides sides
         \param center center of the cone
@@ -82,10 +142,16 @@ class TruncatedConeBrush(baseclasses.BasePrimitive, baseclasses.Brush):
         \param numSides number of sides of the cone
         \param texture texture of the cone as string (applied to all faces)
         or as a dictionary('top', 'bottom' and 'sides') for individual faces
+        \param tolerance if given, derive the number of sides from the radii
+        so that the sides deviate at most this much from the exact cone
+        \param output 'brush' to write a single brush, 'patch' to write
+        patch meshes and a caulked hull brush
         """
         size = np.array([2*radius, 2*radius2, height], dtype=np.float)
         super().__init__(center, size)
         self.truncation_ratio = truncation_ratio
+        self.tolerance = tolerance
+        self.output = output
         self.numSides = numSides
         if isinstance(texture, str):
             self.texture = defaultdict(lambda: texture)
@@ -104,6 +170,17 @@ class TruncatedConeBrush(baseclasses.BasePrimitive, baseclasses.Brush):
         self.radius2 = value[1]/2
         self.height = value[2]
 
+    @property
+    def numSides(self):
+        if self.tolerance is not None:
+            return segments_for_tolerance(max(self.size[:2])/2,
+                                          self.tolerance)
+        return self._numSides
+
+    @numSides.setter
+    def numSides(self, value):
+        self._numSides = value
+
     @property
     def truncation_ratio(self):
         return self._truncation_ratio
@@ -154,10 +231,47 @@ class TruncatedConeBrush(baseclasses.BasePrimitive, baseclasses.Brush):
         faces.append(baseclasses.Face(v0, v1, v2, self.texture["bottom"]))
         return faces
 
+    def hull(self):
+        """
+        \brief Caulked brush with 8 sides inside of the patches
+        """
+        return TruncatedConeBrush(self.center, self.radius, self.height,
+                                  self.radius2, self.truncation_ratio, 8)
+
+    def patches(self):
+        """
+        \brief Patch meshes of the sides and caps
+        """
+        rad2 = self.radius2 if self.radius2 else self.radius
+        ratio = self.truncation_ratio
+        circle = _CIRCLE*[self.radius, rad2]
+        # sides: rows from the bottom to the top
+        factor = np.array([1, (1 + ratio)/2, ratio])
+        z = np.array([-0.5, 0, 0.5])*self.height
+        sides = np.concatenate([factor[:, None, None]*circle,
+                                np.broadcast_to(z[:, None, None], (3, 9, 1))],
+                               axis=2)
+        patches = [baseclasses.Patch(sides + self.center,
+                                     self.texture["sides"])]
+        # caps: rows from the rim to the center
+        caps = [(-0.5, 1, "bottom")]
+        if ratio:
+            caps.append((0.5, ratio, "top"))
+        for zfactor, rfactor, name in caps:
+            points = np.zeros((3, 9, 3))
+            points[..., :2] = (rfactor*np.array([1, 0.5, 0])[:, None, None] *
+                               circle)
+            points[..., 2] = zfactor*self.height
+            if name == "bottom":
+                points = points[:, ::-1]
+            patches.append(baseclasses.Patch(points + self.center,
+                                             self.texture[name]))
+        return patches
+
 
 class CylinderBrush(TruncatedConeBrush):
     def __init__(self, center, radius, height, radius2=0, numSides=16,
-                 texture="common/caulk"):
+                 texture="common/caulk", tolerance=None, output="brush"):
         """
         \brief Generate a Cylinder with numSides sides
         \param center center of the cylinder
@@ -167,8 +281,13 @@ class CylinderBrush(TruncatedConeBrush):
         \param numSides number of sides of the cylinder
         \param texture texture of the cylinder as string (applied to all faces)
         or as a dictionary('top', 'bottom' and 'sides') for individual faces
+        \param tolerance if given, derive the number of sides from the radii
+        so that the sides deviate at most this much from the exact cylinder
+        \param output 'brush' to write a single brush, 'patch' to write
+        patch meshes and a caulked hull brush
         """
-        super().__init__(center, radius, height, radius2, 1, numSides, texture)
+        super().__init__(center, radius, height, radius2, 1, numSides, texture,
+                         tolerance, output)
 
     @property
     def truncation_ratio(self):
@@ -179,14 +298,70 @@ class CylinderBrush(TruncatedConeBrush):
         pass
 
 
-class EllipsoidBrush(baseclasses.BasePrimitive, baseclasses.Brush):
+class EllipsoidBrush(CurvedBrush):
     def __init__(self, center, size, numSegments=16, numRings=16,
-                 texture="common/caulk"):
+                 texture="common/caulk", tolerance=None, output="brush"):
+        """
+        \brief Generate an ellipsoid
+        \param center center of the ellipsoid
+        \param size size of the ellipsoid's bounding box
+        \param numSegments number of segments around the z axis
+        \param numRings number of rings from the bottom to the top
+        \param texture texture of the ellipsoid
+        \param tolerance if given, derive the number of segments and rings
+        from the size so that the faces deviate at most this much from the
+        exact ellipsoid
+        \param output 'brush' to write a single brush, 'patch' to write
+        a patch mesh and a caulked hull brush
+        """
         super().__init__(center, size)
+        self.tolerance = tolerance
+        self.output = output
         self.numSegments = numSegments
         self.numRings = numRings
         self.texture = texture
 
+    @property
+    def numSegments(self):
+        if self.tolerance is not None:
+            return segments_for_tolerance(max(self.size[:2])/2,
+                                          self.tolerance)
+        return self._numSegments
+
+    @numSegments.setter
+    def numSegments(self, value):
+        self._numSegments = value
+
+    @property
+    def numRings(self):
+        if self.tolerance is not None:
+            return segments_for_tolerance(max(self.size)/2, self.tolerance,
+                                          np.pi, 2)
+        return self._numRings
+
+    @numRings.setter
+    def numRings(self, value):
+        self._numRings = value
+
+    def hull(self):
+        """
+        \brief Caulked brush with 8 segments and 4 rings inside of the patch
+        """
+        return EllipsoidBrush(self.center, self.size, 8, 4)
+
+    def patches(self):
+        """
+        \brief Patch mesh of the ellipsoid, rows from the bottom to the top
+        """
+        # control polygon of half a circle from the bottom to the top
+        meridian = np.array([[0, -1], [1, -1], [1, 0], [1, 1], [0, 1]],
+                            dtype=np.float64)
+        points = np.empty((5, 9, 3))
+        points[..., :2] = meridian[:, None, :1]*_CIRCLE
+        points[..., 2] = meridian[:, None, 1]
+        return [baseclasses.Patch(points*self.size/2 + self.center,
+                                  self.texture)]
+
     @property
     def faces(self):
         faces = []
@@ -238,3 +413,344 @@ class EllipsoidBrush(baseclasses.BasePrimitive, baseclasses.Brush):
                 faces.append(baseclasses.Face(v0, v1, v2, self.texture))
 
         return faces
+
+
+class Terrain(baseclasses.BasePrimitive):
+    isGroupable = True
+
+    def __init__(self, heightmap, center, size, texture="common/caulk",
+                 min_thickness=8):
+        """
+        \brief Generate a terrain of triangular prisms from a heightmap
+        \param heightmap path of a grayscale image or 2D array with values
+        between 0 and 1, the first row is the one with the largest y
+        \param center center of the terrain's bounding box
+        \param size size of the terrain's bounding box
+        \param texture texture of the terrain as string (applied to the top
+        faces, the rest is caulked) or as a dictionary with 'top', 'sides' and
+        'bottom' for individual faces
+        \param min_thickness thickness of the terrain where the height is 0,
+        has to be greater than 0 so that no brush is flat
+        """
+        super().__init__(center, size)
+        if isinstance(heightmap, str):
+            from PIL import Image
+            with Image.open(heightmap) as img:
+                heightmap = np.asarray(img.convert("L"),
+                                       dtype=np.float64)/255
+        self.heightmap = np.asarray(heightmap, dtype=np.float64)
+        if self.heightmap.ndim != 2 or min(self.heightmap.shape) < 2:
+            raise ValueError("Heightmap needs at least 2x2 samples")
+        if min_thickness <= 0:
+            raise ValueError("The minimum thickness must be greater than 0")
+        self.min_thickness = min_thickness
+        if isinstance(texture, str):
+            self.texture = defaultdict(lambda: "common/caulk", top=texture)
+        else:
+            self.texture = defaultdict(lambda: "common/caulk", texture)
+
+    @property
+    def textures(self):
+        return {self.texture["top"], self.texture["sides"],
+                self.texture["bottom"]}
+
+    def __len__(self):
+        rows, cols = self.heightmap.shape
+        return 2*(rows-1)*(cols-1)
+
+    def face_arrays(self, rows=None):
+        """
+        \brief Face arrays (see baseclasses.face_arrays) of the prisms,
+        two per cell, in the given range of rows of cells
+        """
+        rows = slice(None) if rows is None else rows
+        nrows, ncols = self.heightmap.shape
+        bottom = self.center[2] - self.size[2]/2
+        x = np.linspace(-0.5, 0.5, ncols)*self.size[0] + self.center[0]
+        y = np.linspace(0.5, -0.5, nrows)*self.size[1] + self.center[1]
+        row_ids = np.arange(nrows - 1)[rows]
+        cell_rows = np.concatenate([row_ids, row_ids[-1:] + 1])
+        z = (bottom + self.min_thickness +
+             self.heightmap[cell_rows]*(self.size[2] - self.min_thickness))
+        grid = np.stack(np.broadcast_arrays(x[None, :], y[cell_rows, None],
+                                            z), axis=-1)
+        a = grid[:-1, :-1]
+        b = grid[:-1, 1:]
+        c = grid[1:, :-1]
+        d = grid[1:, 1:]
+        # top triangles with the corners in clockwise order seen from above,
+        # so that the normal of the top face points into the prism
+        top = np.concatenate([np.stack([a, b, d], axis=-2),
+                              np.stack([a, d, c], axis=-2)],
+                             axis=1).reshape(-1, 3, 3)
+        low = top.copy()
+        low[..., 2] = bottom
+        n = len(top)
+        verts = np.empty((n, 5, 3, 3))
+        verts[:, 0] = top
+        verts[:, 1] = low[:, ::-1]
+        for i in range(3):
+            j = (i+1) % 3
+            verts[:, 2+i] = np.stack([low[:, i], low[:, j], top[:, i]],
+                                     axis=1)
+        textures = np.array([self.texture["top"], self.texture["bottom"]] +
+                            3*[self.texture["sides"]])
+        return {"counts": np.full(n, 5, dtype=np.int64),
+                "verts": verts.reshape(-1, 3, 3),
+                "textures": np.tile(textures, n),
+                "angles": np.zeros(5*n),
+                "offsets": np.zeros((5*n, 2)),
+                "scales": np.ones((5*n, 2))}
+
+    def _row_chunks(self, chunksize):
+        rows = self.heightmap.shape[0] - 1
+        step = max(1, chunksize//(2*(self.heightmap.shape[1] - 1)))
+        for i in range(0, rows, step):
+            yield slice(i, min(i + step, rows))
+
+    def __iter__(self):
+        for rows in self._row_chunks(4096):
+            yield from baseclasses.brushes_from_arrays(
+                **self.face_arrays(rows))
+
+    def write(self, f, chunksize=65536):
+        """
+        \brief Write the terrain, computing chunks of rows at once
+        """
+        for rows in self._row_chunks(chunksize):
+            baseclasses.write_brushes(f, **self.face_arrays(rows))
+
+    def __str__(self):
+        f = io.StringIO()
+        self.write(f)
+        return f.getvalue()
+
+
+class Sweep(object):
+    isGroupable = True
+
+    def __init__(self, profile, path, twist=0, profile_scale=1, up=(0, 0, 1),
+                 texture="common/caulk"):
+        """
+        \brief Sweep a convex profile along a path, every segment of the path
+        becomes one convex brush
+        \param profile corners of a convex polygon, shape (m, 2), the x axis
+        of the profile points to the side of the path and y points up
+        \param path points of a polyline, shape (n, 3)
+        \param twist rotation of the profile around the path in radians,
+        scalar or one value per path point
+        \param profile_scale scale of the profile, scalar, one value per path
+        point or one (x, y) pair per path point
+        \param up direction which the y axis of the profile follows
+        \param texture texture of the sweep as string (applied to all faces)
+        or as a dictionary with 'sides', 'start' and 'end' for individual
+        faces, the faces between the segments are textured with 'joints'
+        (caulk for dictionaries)
+        """
+        self.profile = np.array(profile, dtype=np.float64)
+        self.path = np.array(path, dtype=np.float64)
+        if self.profile.ndim != 2 or len(self.profile) < 3:
+            raise ValueError("The profile needs at least 3 corners")
+        if self.path.ndim != 2 or len(self.path) < 2:
+            raise ValueError("The path needs at least 2 points")
+        self.twist = twist
+        self.profile_scale = profile_scale
+        self.up = np.array(up, dtype=np.float64)
+        if isinstance(texture, str):
+            self.texture = defaultdict(lambda: texture)
+        else:
+            self.texture = defaultdict(lambda: "common/caulk", texture)
+
+    @classmethod
+    def from_curve(cls, profile, curve, count, twist=0, profile_scale=1,
+                   up=(0, 0, 1), texture="common/caulk"):
+        """
+        \brief Sweep a profile along a sampled curve
+        \param curve function mapping an array of parameters t in [0, 1] to
+        points of shape (len(t), 3)
+        \param count number of segments
+        \param twist, profile_scale values as for Sweep or functions of t
+        """
+        t = np.linspace(0, 1, count + 1)
+        twist = twist(t) if callable(twist) else twist
+        if callable(profile_scale):
+            profile_scale = profile_scale(t)
+        return cls(profile, curve(t), twist, profile_scale, up, texture)
+
+    @property
+    def textures(self):
+        return {self.texture[name]
+                for name in ("sides", "start", "end", "joints")}
+
+    def __len__(self):
+        return len(self.path) - 1
+
+    @property
+    def center(self):
+        """
+        \brief Center of the bounding box of the sweep
+        """
+        rings = self.rings().reshape(-1, 3)
+        return (rings.min(axis=0) + rings.max(axis=0))/2
+
+    @property
+    def size(self):
+        rings = self.rings().reshape(-1, 3)
+        return rings.max(axis=0) - rings.min(axis=0)
+
+    def move(self, offset):
+        self.path += offset
+
+    def rotate_point(self, center, rotation_matrix):
+        self.path = (self.path - center) @ rotation_matrix + center
+        self.up = self.up @ rotation_matrix
+
+    def scale(self, factor):
+        """
+        \brief Scale the path and the profile around the center
+        \param factor scalar scale factor
+        """
+        center = self.center
+        self.path = (self.path - center)*factor + center
+        self.profile_scale = np.asarray(self.profile_scale)*factor
+
+    def rings(self):
+        """
+        \brief Corners of the profile at every path point, shape (n, m, 3)
+        At bends the profile lies in the plane halfway between the segments
+        and is stretched so that the segments keep their cross section.
+        """
+        n = len(self.path)
+        dirs = np.diff(self.path, axis=0)
+        lengths = np.linalg.norm(dirs, axis=1)
+        if np.any(lengths == 0):
+            raise ValueError("The path must not contain repeated points")
+        dirs /= lengths[:, None]
+        incoming = np.concatenate([dirs[:1], dirs])
+        outgoing = np.concatenate([dirs, dirs[-1:]])
+        tangents = incoming + outgoing
+        norms = np.linalg.norm(tangents, axis=1)
+        if np.any(norms < 1e-9):
+            raise ValueError("The path must not turn back on itself")
+        tangents /= norms[:, None]
+        # frames following the up direction, where the path is parallel to
+        # it the side direction is taken from the nearest other point
+        lateral = np.cross(self.up, tangents)
+        valid = np.linalg.norm(lateral, axis=1) > 1e-9
+        if not valid.any():
+            lateral[:] = np.cross([0, 1, 0], tangents[0])
+        elif not valid.all():
+            index = np.arange(n)
+            previous = np.maximum.accumulate(np.where(valid, index, -1))
+            following = np.minimum.accumulate(
+                np.where(valid, index, n)[::-1])[::-1]
+            nearest = np.where(
+                (previous < 0) | ((following < n) &
+                                  (following - index < index - previous)),
+                following, previous)
+            lateral = lateral[nearest]
+            lateral -= np.sum(lateral*tangents, axis=1)[:, None]*tangents
+        lateral /= np.linalg.norm(lateral, axis=1)[:, None]
+        upward = np.cross(tangents, lateral)
+
+        twist = np.broadcast_to(np.asarray(self.twist, dtype=np.float64), n)
+        scale = np.asarray(self.profile_scale, dtype=np.float64)
+        scale = np.broadcast_to(scale[..., None] if scale.ndim == 1 else
+                                scale, (n, 2))
+        local = self.profile*scale[:, None, :]
+        cos_twist = np.cos(twist)[:, None]
+        sin_twist = np.sin(twist)[:, None]
+        x = local[..., 0]*cos_twist - local[..., 1]*sin_twist
+        y = local[..., 0]*sin_twist + local[..., 1]*cos_twist
+        offsets = x[..., None]*lateral[:, None] + y[..., None]*upward[:, None]
+        # miter: stretch along the direction of the bend by 1/cos(angle/2)
+        bend = outgoing - incoming
+        bendnorm = np.linalg.norm(bend, axis=1)
+        bent = bendnorm > 1e-9
+        bend[bent] /= bendnorm[bent, None]
+        stretch = 1/np.sum(tangents*incoming, axis=1) - 1
+        along = np.einsum("nmk,nk->nm", offsets, bend)
+        offsets += (stretch[:, None]*along)[..., None]*bend[:, None]
+        return self.path[:, None] + offsets
+
+    def face_arrays(self, segments=None, eps=1e-6, rings=None):
+        """
+        \brief Face arrays (see baseclasses.face_arrays) of the brushes of a
+        range of segments
+        Side faces whose corners don't lie in a plane (e.g. because of the
+        twist) are split into two triangles along the convex diagonal.
+        \param rings result of rings(), computed if not given
+        """
+        segments = slice(None) if segments is None else segments
+        if rings is None:
+            rings = self.rings()
+        ids = np.arange(len(self))[segments]
+        a = rings[ids]
+        b = rings[ids + 1]
+        s, m = a.shape[:2]
+        a1 = np.roll(a, -1, axis=1)
+        b1 = np.roll(b, -1, axis=1)
+        centers = (a.mean(axis=1) + b.mean(axis=1))/2
+
+        normal = np.cross(a1 - a, b1 - a)
+        normal /= np.linalg.norm(normal, axis=-1)[..., None]
+        dist = np.sum((b - a)*normal, axis=-1)
+        inner = np.sum((centers[:, None] - a)*normal, axis=-1)
+        planar = np.abs(dist) <= eps*np.abs(inner)
+        # b lies on the inner side of (a, a1, b1): split along a-b1
+        diagonal = dist*inner > 0
+        first = np.where(diagonal[..., None, None],
+                         np.stack([a, a1, b1], axis=2),
+                         np.stack([a, a1, b], axis=2))
+        second = np.where(diagonal[..., None, None],
+                          np.stack([a, b1, b], axis=2),
+                          np.stack([a1, b1, b], axis=2))
+
+        third = [0, m//3, (2*m)//3]
+        verts = np.concatenate([a[:, None, third], b[:, None, third],
+                                first, second], axis=1)
+        used = np.concatenate([np.ones((s, 2), dtype=bool),
+                               np.ones((s, m), dtype=bool), ~planar], axis=1)
+        textures = np.empty((s, 2 + 2*m), dtype=object)
+        textures[:] = self.texture["sides"]
+        textures[:, :2] = self.texture["joints"]
+        textures[ids == 0, 0] = self.texture["start"]
+        textures[ids == len(self) - 1, 1] = self.texture["end"]
+
+        # orient all faces so that their normals point into the brush
+        normals = np.cross(verts[:, :, 1] - verts[:, :, 0],
+                           verts[:, :, 2] - verts[:, :, 0])
+        outward = np.sum(normals*(centers[:, None] - verts[:, :, 0]),
+                         axis=-1) < 0
+        verts[outward] = verts[outward][:, [0, 2, 1]]
+        n = int(used.sum())
+        return {"counts": used.sum(axis=1).astype(np.int64),
+                "verts": verts[used],
+                "textures": textures[used].astype(str),
+                "angles": np.zeros(n),
+                "offsets": np.zeros((n, 2)),
+                "scales": np.ones((n, 2))}
+
+    def _chunks(self, chunksize):
+        for i in range(0, len(self), chunksize):
+            yield slice(i, min(i + chunksize, len(self)))
+
+    def __iter__(self):
+        rings = self.rings()
+        for segments in self._chunks(4096):
+            yield from baseclasses.brushes_from_arrays(
+                **self.face_arrays(segments, rings=rings))
+
+    def write(self, f, chunksize=16384):
+        """
+        \brief Write the sweep, computing chunks of segments at once
+        """
+        rings = self.rings()
+        for segments in self._chunks(chunksize):
+            baseclasses.write_brushes(
+                f, **self.face_arrays(segments, rings=rings))
+
+    def __str__(self):
+        f = io.StringIO()
+        self.write(f)
+        return f.getvalue()
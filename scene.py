@@ -0,0 +1,302 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Hierarchical scene graph with lazily generated content.
+
+A scene is a tree of named nodes, every node becomes a func_group (or
+another brush entity) named by its path, e.g. "castle/walls/north". The
+objects of a node can be given as functions which generate them, they are
+only called when the object is written or its bounds are needed. Passing
+the bounds along with a function lets exports of a region skip it without
+generating it:
+
+    scene = Scene("mymap")
+    walls = scene.node("walls")
+    walls.add(lambda: make_wall(0), bounds=([0, 0, 0], [1024, 16, 256]))
+    scene.view(region=([0, 0, 0], [512, 512, 512])).save("corner.map")
+"""
+
+from collections import OrderedDict
+import numpy as np
+import assets
+import baseclasses
+import geometry
+import helper
+import shaders
+
+
+def object_bounds(obj):
+    """
+    \brief Compute the bounding box of all brushes and patches of an object,
+    see geometry.object_bounds
+    \return (mins, maxs) or None if the object is empty
+    """
+    return geometry.object_bounds(obj)
+
+
+def _union(boxes):
+    boxes = [box for box in boxes if box is not None]
+    if not boxes:
+        return None
+    return (np.min([box[0] for box in boxes], axis=0),
+            np.max([box[1] for box in boxes], axis=0))
+
+
+def _intersects(box, region):
+    if box is None:
+        return False
+    if region is None:
+        return True
+    return bool(np.all(box[0] <= region[1]) and np.all(box[1] >= region[0]))
+
+
+class Leaf(object):
+    """
+    An object of a node, generated on first use if given as a function
+    """
+
+    def __init__(self, obj, bounds=None, cache=True):
+        """
+        \brief Create a leaf
+        \param obj brush, primitive, modifier or a function returning one
+        \param bounds (mins, maxs) of the object, computed when needed
+        if not given
+        \param cache keep the generated object, otherwise the function is
+        called again on every use
+        """
+        self._factory = obj if callable(obj) else None
+        self._obj = None if callable(obj) else obj
+        self._bounds = None
+        if bounds is not None:
+            self._bounds = (np.array(bounds[0], dtype=np.float64),
+                            np.array(bounds[1], dtype=np.float64))
+        self.cache = cache
+
+    @property
+    def generated(self):
+        """
+        \brief True if the object exists without calling the function
+        """
+        return self._obj is not None
+
+    @property
+    def obj(self):
+        if self._obj is not None:
+            return self._obj
+        obj = self._factory()
+        if self.cache:
+            self._obj = obj
+        return obj
+
+    @property
+    def bounds(self):
+        if self._bounds is None:
+            self._bounds = object_bounds(self.obj)
+        return self._bounds
+
+    def release(self):
+        """
+        \brief Forget the generated object, the bounds are kept
+        """
+        if self._factory is not None:
+            self._obj = None
+
+
+class Node(object):
+    def __init__(self, name, classname="func_group", keyvalues=None):
+        """
+        \brief Create a node of the scene graph
+        \param name name of the node, must not contain '/'
+        \param classname classname of the brush entity the node is written
+        as, func_group by default
+        \param keyvalues additional key/values of the entity
+        """
+        if "/" in name:
+            raise ValueError("Node names must not contain '/'")
+        self.name = name
+        self.classname = classname
+        self.keyvalues = OrderedDict(keyvalues or {})
+        self.parent = None
+        self.children = OrderedDict()
+        self.leaves = []
+        self._bounds = None
+        self._valid = False
+
+    @property
+    def path(self):
+        if self.parent is None or self.parent.parent is None:
+            return self.name
+        return self.parent.path + "/" + self.name
+
+    def _invalidate(self):
+        node = self
+        while node is not None:
+            node._valid = False
+            node = node.parent
+
+    def node(self, name, classname="func_group", keyvalues=None):
+        """
+        \brief Return the child node with the given name, it is created
+        if it doesn't exist
+        """
+        if name not in self.children:
+            child = Node(name, classname, keyvalues)
+            child.parent = self
+            self.children[name] = child
+            self._invalidate()
+        return self.children[name]
+
+    def add(self, obj, bounds=None, cache=True):
+        """
+        \brief Add an object to this node, see Leaf
+        \return the Leaf
+        """
+        leaf = Leaf(obj, bounds, cache)
+        self.leaves.append(leaf)
+        self._invalidate()
+        return leaf
+
+    def find(self, path):
+        """
+        \brief Find a node by its path relative to this node
+        """
+        node = self
+        for name in path.split("/"):
+            if name:
+                node = node.children[name]
+        return node
+
+    @property
+    def bounds(self):
+        """
+        \brief Bounding box of the node and all its children, cached until
+        objects or nodes are added, None if the node is empty
+        """
+        if not self._valid:
+            self._bounds = _union([leaf.bounds for leaf in self.leaves] +
+                                  [child.bounds for child
+                                   in self.children.values()])
+            self._valid = True
+        return self._bounds
+
+    def walk(self, region=None):
+        """
+        \brief Generate (node, leaves) for this node and its descendants,
+        subtrees outside of the region are skipped
+        \param region (mins, maxs) or None for everything
+        """
+        if region is not None and not _intersects(self.bounds, region):
+            return
+        yield self, [leaf for leaf in self.leaves
+                     if _intersects(leaf.bounds, region)]
+        for child in self.children.values():
+            yield from child.walk(region)
+
+    def release(self):
+        """
+        \brief Forget all generated objects of this node and its children
+        """
+        for leaf in self.leaves:
+            leaf.release()
+        for child in self.children.values():
+            child.release()
+
+
+class SceneView(baseclasses.BaseAsset):
+    """
+    The part of a scene that is exported
+    """
+
+    def __init__(self, scene, region=None, nodes=None, prefetch=True):
+        """
+        \brief Select a part of a scene
+        \param scene Scene
+        \param region only export objects whose bounds intersect the box
+        (mins, maxs)
+        \param nodes only export these nodes (given by path) and their
+        children
+        \param prefetch resolve all texture sizes before writing
+        """
+        super().__init__()
+        self.scene = scene
+        self.region = None
+        if region is not None:
+            self.region = (np.array(region[0], dtype=np.float64),
+                           np.array(region[1], dtype=np.float64))
+        self.nodes = nodes
+        self.prefetch = prefetch
+
+    def groups(self):
+        """
+        \brief Generate (node, objects) of all selected nodes, only the
+        objects of the selection are generated
+        """
+        roots = ([self.scene] if self.nodes is None else
+                 [self.scene.find(path) for path in self.nodes])
+        for root in roots:
+            for node, leaves in root.walk(self.region):
+                if leaves:
+                    yield node, [leaf.obj for leaf in leaves]
+
+    def write(self, f):
+        groups = list(self.groups())
+        if self.prefetch and not helper.geometry_only():
+            textures = baseclasses.collect_textures(
+                [objs for node, objs in groups])
+            baseclasses.report_missing_textures(
+                shaders.prefetch_texture_sizes(textures))
+        nongroupables = []
+        for node, objs in groups:
+            groupables = [obj for obj in objs if obj.isGroupable]
+            nongroupables += [obj for obj in objs if not obj.isGroupable]
+            if not groupables:
+                continue
+            if node.classname == "func_group":
+                context = helper.group(f, node.path or "Group")
+            else:
+                keyvalues = OrderedDict([("classname", node.classname)])
+                keyvalues.update(node.keyvalues)
+                context = helper.entity(f, keyvalues)
+            with context:
+                for obj in groupables:
+                    assets.write_object(f, obj)
+        if nongroupables:
+            with helper.worldspawn(f):
+                for obj in nongroupables:
+                    assets.write_object(f, obj)
+
+
+class Scene(Node, baseclasses.BaseAsset):
+    """
+    Root of a scene graph, writing the scene exports everything
+    """
+
+    def __init__(self, name="Group"):
+        super().__init__(name)
+
+    @property
+    def path(self):
+        return self.name
+
+    def view(self, region=None, nodes=None, prefetch=True):
+        """
+        \brief Select a part of the scene for exporting, see SceneView
+        """
+        return SceneView(self, region, nodes, prefetch)
+
+    def write(self, f):
+        self.view().write(f)
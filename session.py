@@ -0,0 +1,242 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Sessions own the game data paths, archive handles, shader and texture
+caches and the random number generator.
+
+The functions in helper and shaders use the current session of the calling
+thread, which is the process wide default session unless another one was
+activated with a with statement:
+
+    with session.Session(xondir="/opt/xonotic", seed=1):
+        assets.ObjectWriter(objs).save("mymap.map")
+
+A session can be shared between threads. The caches are plain dictionaries,
+a lookup never takes a lock and a value computed twice by two threads at the
+same time is simply stored twice. Only opening an archive and entering or
+leaving the session take a lock, the archives are closed when the last
+thread leaves the session.
+"""
+
+import sys
+import os
+import re
+import threading
+import configparser
+import numpy as np
+
+
+_CONFFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "config.conf")
+
+
+class Session(object):
+    def __init__(self, xondir=None, geometry_only=None, seed=None, rng=None):
+        """
+        \brief Create a session
+        \param xondir Xonotic base directory, if None it is taken from the
+        XONOTIC_DIR environment variable or config.conf
+        \param geometry_only use a texture size of (64, 64) for all textures
+        without reading any game data, if None it is taken from the
+        ASSETGEN_GEOMETRY_ONLY environment variable
+        \param seed seed of the random number generator
+        \param rng random number generator to use instead of a new one
+        """
+        super().__init__()
+        self.rng = rng if rng is not None else np.random.default_rng(seed)
+        self._xondir = xondir
+        self._geometry_only = geometry_only
+        self._lock = threading.Lock()
+        self._archives = {}
+        # number of with blocks of all threads which use the session
+        self._active = 0
+        self.clear_caches()
+
+    def clear_caches(self):
+        """
+        \brief Forget all resolved paths, shaders and texture sizes
+        """
+        self._paths = {}
+        # shader name -> texture size, None for shaders that were not found
+        self.texture_sizes = {}
+        # texture path -> image size
+        self.image_sizes = {}
+        # shader file name -> list of shaders.Shader
+        self.shader_files = {}
+        # shaders which were already reported as missing
+        self.reported_textures = set()
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+        with self._lock:
+            self._active += 1
+        return self
+
+    def __exit__(self, *args):
+        _local.stack.pop()
+        # the archives stay open while any thread still uses the session
+        with self._lock:
+            self._active -= 1
+            if self._active == 0:
+                self._close_archives()
+
+    def _close_archives(self):
+        for archive in self._archives.values():
+            archive.close()
+        self._archives.clear()
+
+    def close(self):
+        """
+        \brief Close all archives opened by this session
+        """
+        with self._lock:
+            self._close_archives()
+
+    @property
+    def geometry_only(self):
+        if self._geometry_only is not None:
+            return self._geometry_only
+        return os.environ.get("ASSETGEN_GEOMETRY_ONLY", "0") not in ("", "0")
+
+    @geometry_only.setter
+    def geometry_only(self, value):
+        self._geometry_only = value
+
+    def set_xon_dir(self, path):
+        """
+        \brief Set the Xonotic base directory, clears all caches
+        """
+        self._xondir = path
+        self.close()
+        self.clear_caches()
+
+    def _cached_path(self, name, func):
+        if name not in self._paths:
+            self._paths[name] = func()
+        return self._paths[name]
+
+    def xon_dir(self):
+        """
+        \brief Get the base path of the Xonotic folder
+        The path is taken from the session, the XONOTIC_DIR environment
+        variable or config.conf, in this order. If none is set, the user is
+        asked for it when running interactively.
+        """
+        if self._xondir is not None:
+            return self._xondir
+        return self._cached_path("xondir", _configured_xon_dir)
+
+    def is_git_build(self):
+        return self._cached_path("git", lambda: os.path.isdir(
+            os.path.join(self.xon_dir(), "data", "xonotic-maps.pk3dir")))
+
+    def find_maps_pk3(self):
+        """
+        \brief Find the pk3 containing the map data
+        """
+        def find():
+            # TODO: support other games
+            pat = re.compile(r"^xonotic-[\d\w]+-maps.pk3")
+            datadir = os.path.join(self.xon_dir(), "data")
+            for file in os.listdir(datadir):
+                if pat.search(file):
+                    return os.path.join(datadir, file)
+        return self._cached_path("maps", find)
+
+    def find_maps_pk3dir(self):
+        return os.path.join(self.xon_dir(), "data", "xonotic-maps.pk3dir")
+
+    def find_mapping_support(self):
+        """
+        \brief Find the pk3 with mapping support
+        """
+        def find():
+            # TODO: support other games
+            pat = re.compile(r"^xonotic-\d+-maps-mapping.pk3")
+            userdir = os.path.expanduser("~")
+            if sys.platform == "win32" or sys.platform == "cygwin":
+                configpath = os.path.join(userdir, "Saved Games", "xonotic",
+                                          "data")
+            elif sys.platform == "darwin":
+                configpath = os.path.join(userdir, "Library",
+                                          "Application Support", "xonotic",
+                                          "data")
+            else:
+                configpath = os.path.join(userdir, ".xonotic", "data")
+            for file in os.listdir(configpath):
+                if pat.search(file):
+                    return os.path.join(configpath, file)
+        return self._cached_path("mapping", find)
+
+    def archive(self, path):
+        """
+        \brief Return an open zipfile.ZipFile, archives are opened once per
+        session and can be read from several threads
+        """
+        archive = self._archives.get(path)
+        if archive is None:
+            import zipfile
+            with self._lock:
+                archive = self._archives.get(path)
+                if archive is None:
+                    archive = self._archives[path] = zipfile.ZipFile(path)
+        return archive
+
+
+def _configured_xon_dir():
+    if os.environ.get("XONOTIC_DIR"):
+        return os.environ["XONOTIC_DIR"]
+    cparser = configparser.ConfigParser()
+    cparser.read(_CONFFILE)
+    if not cparser.has_section("path"):
+        cparser.add_section("path")
+    if not cparser.has_option("path", "xondir"):
+        if not (sys.stdin and sys.stdin.isatty()):
+            raise ValueError("Xonotic base directory not configured, use "
+                             "helper.set_xon_dir, the XONOTIC_DIR environment "
+                             "variable or config.conf")
+        xondir = input("Please specify the Xonotic base directory:\n")
+        cparser.set("path", "xondir", xondir)
+        with open(_CONFFILE, "w") as cf:
+            cparser.write(cf)
+    return cparser.get("path", "xondir")
+
+
+_local = threading.local()
+# the default session keeps using the global numpy random state, so
+# np.random.seed still works for scripts that don't use sessions
+_default = Session(rng=np.random.mtrand._rand)
+
+
+def default():
+    """
+    \brief Return the process wide default session
+    """
+    return _default
+
+
+def current():
+    """
+    \brief Return the session of the calling thread
+    """
+    stack = getattr(_local, "stack", None)
+    if stack:
+        return stack[-1]
+    return _default
@@ -14,46 +14,164 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import re
-import zipfile
 import io
-from PIL import Image
+from collections import defaultdict
 import helper
+import session
+
+# PIL and the thread pool are only imported when texture sizes are
+# actually needed to keep the startup of geometry-only scripts fast
 
 
 def get_texture_size(shadername):
-    shader = find_shader(shadername)
-    texpath = shader.texture_path
-    # TODO: support custom textures
-    if helper.is_git_build():
-        return get_texture_size_git_build(texpath)
-    return get_texture_size_mapping_support(texpath)
+    """
+    \brief Look up the size of the texture of a shader, the sizes are cached
+    in the current session
+    """
+    texture_sizes = session.current().texture_sizes
+    size = texture_sizes.get(shadername, False)
+    if size is None:
+        raise KeyError("Shader {} not found".format(shadername))
+    if size is not False:
+        return size
+    try:
+        shader = find_shader(shadername)
+        texpath = shader.texture_path
+        # TODO: support custom textures
+        if helper.is_git_build():
+            size = get_texture_size_git_build(texpath)
+        else:
+            size = get_texture_size_mapping_support(texpath)
+    except (KeyError, ValueError, OSError):
+        texture_sizes[shadername] = None
+        raise
+    texture_sizes[shadername] = size
+    return size
 
 
-@helper.memoize
-def get_texture_size_git_build(path):
+def texture_size_cache():
+    """
+    \brief Return a copy of all texture sizes resolved so far in the current
+    session, None marks shaders that could not be found
+    """
+    return dict(session.current().texture_sizes)
+
+
+def update_texture_size_cache(sizes):
+    """
+    \brief Add already known texture sizes, e.g. from another process
+    """
+    session.current().texture_sizes.update(
+        (name, tuple(size) if size is not None else None)
+        for name, size in sizes.items())
+
+
+def _texture_file(path, names=None):
     # if no suffix is specified, use tga
     if not "." in path.split("/")[-1]:
         path = path + ".tga"
-    path = os.path.join(helper.find_maps_pk3dir(), path)
-    with open(path, "r") as src:
-        img = Image.open(src)
-    return img.size
+    # mapping support has jpg images, but tga images are defined
+    # in the official shaders in Xonotic
+    if names is not None and path not in names:
+        path = path.replace(".tga", ".jpg")
+    return path
+
+
+def prefetch_texture_sizes(shadernames, threads=None):
+    """
+    \brief Resolve the sizes of many shaders in one sweep
+    Every shader file is parsed once and the texture archive is opened once,
+    the images are read on a thread pool.
+    \param shadernames iterable of shader names
+    \param threads number of threads for reading the images,
+    None for the default of ThreadPoolExecutor, 0 to read them sequentially
+    \return sorted list of the shaders that could not be resolved
+    """
+    texture_sizes = session.current().texture_sizes
+    shadernames = set(shadernames)
+    unresolved = shadernames - set(texture_sizes)
+    try:
+        git_build = helper.is_git_build() if unresolved else False
+    except ValueError:
+        # no game data configured, like get_texture_size all of them are
+        # missing
+        texture_sizes.update((name, None) for name in unresolved)
+        unresolved = set()
+    texpaths = {}
+    byfile = defaultdict(list)
+    for name in unresolved:
+        byfile[name.split("/")[0] + ".shader"].append(name)
+    for filename, names in byfile.items():
+        try:
+            shaders = {s.name: s for s in parse_shader_file(filename)}
+        except (KeyError, ValueError, OSError):
+            shaders = {}
+        for name in names:
+            try:
+                texpaths[name] = shaders[name].texture_path
+            except (KeyError, ValueError):
+                texture_sizes[name] = None
+
+    if texpaths:
+        if git_build:
+            basedir = helper.find_maps_pk3dir()
+
+            def read(path):
+                with open(os.path.join(basedir, _texture_file(path)),
+                          "rb") as src:
+                    return _image_size(src)
+            _read_sizes(texture_sizes, texpaths, read, threads)
+        else:
+            zf = session.current().archive(helper.find_mapping_support())
+            names = set(zf.namelist())
+
+            def read(path):
+                data = zf.read(_texture_file(path, names))
+                return _image_size(io.BytesIO(data))
+            _read_sizes(texture_sizes, texpaths, read, threads)
+    return sorted(name for name in shadernames
+                  if texture_sizes.get(name) is None)
+
+
+def _read_sizes(texture_sizes, texpaths, read, threads):
+    def resolve(item):
+        name, path = item
+        try:
+            return name, read(path)
+        except (KeyError, ValueError, OSError):
+            return name, None
+    if threads == 0:
+        results = map(resolve, texpaths.items())
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(threads) as pool:
+            results = list(pool.map(resolve, texpaths.items()))
+    texture_sizes.update(results)
+
+
+def _image_size(src):
+    from PIL import Image
+    return Image.open(src).size
+
+
+def get_texture_size_git_build(path):
+    sizes = session.current().image_sizes
+    if path not in sizes:
+        filename = os.path.join(helper.find_maps_pk3dir(), _texture_file(path))
+        with open(filename, "rb") as src:
+            sizes[path] = _image_size(src)
+    return sizes[path]
 
 
-@helper.memoize
 def get_texture_size_mapping_support(path):
-    with zipfile.ZipFile(helper.find_mapping_support(), "r") as zf:
-        # if no suffix is specified, use tga
-        if not "." in path.split("/")[-1]:
-            path = path + ".tga"
-        # mapping support has jpg images, but tga images are defined
-        # in the official shaders in Xonotic
-        if path not in zf.namelist():
-            path = path.replace(".tga", ".jpg")
-        src = io.BytesIO(zf.read(path))
-    img = Image.open(src)
-    return img.size
+    sizes = session.current().image_sizes
+    if path not in sizes:
+        zf = session.current().archive(helper.find_mapping_support())
+        data = zf.read(_texture_file(path, zf.namelist()))
+        sizes[path] = _image_size(io.BytesIO(data))
+    return sizes[path]
 
 
 def find_shader(name):
@@ -62,6 +180,7 @@ def find_shader(name):
     for shader in shaders:
         if shader.name == name:
             return shader
+    raise KeyError("Shader {} not found".format(name))
 
 
 class Shader(object):
@@ -120,11 +239,18 @@ class Stage(object):
             match = scanner.match()
 
 
-@helper.memoize
 def parse_shader_file(filename):
     """
     Mini shader parser, only does minimal amount of parsing.
+    The parsed files are cached in the current session.
     """
+    shader_files = session.current().shader_files
+    if filename not in shader_files:
+        shader_files[filename] = _parse_shader_file(filename)
+    return shader_files[filename]
+
+
+def _parse_shader_file(filename):
     tokens = re.compile(r'''
         (?P<WS>       \s            ) |
         (?P<COMMENT>  //[^\n]*\n    ) |
@@ -142,8 +268,8 @@ def parse_shader_file(filename):
         with open(path, "r") as sf:
             data = sf.read()
     else:
-        with zipfile.ZipFile(helper.find_maps_pk3(), "r") as zf:
-            data = zf.read("scripts/" + filename).decode()
+        zf = session.current().archive(helper.find_maps_pk3())
+        data = zf.read("scripts/" + filename).decode()
     scanner = tokens.scanner(data)
     shaders = []
     match = scanner.match()
@@ -0,0 +1,277 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compact binary storage for generated scenes.
+
+A scene is stored as a handful of flat arrays:
+    verts        (faces, 3, 3) plane points of every face
+    angle        (faces,)      texture rotation
+    offset       (faces, 2)    texture offset
+    scale        (faces, 2)    texture scale
+    texture_id   (faces,)      index into 'textures'
+    textures     (textures,)   texture names
+    brush_start  (brushes+1,)  index of the first face of every brush
+    brush_group  (brushes,)    index into 'groups', -1 for worldspawn
+    groups       (groups,)     func_group names
+    patch_points (points, 5)   control points [x y z s t] of all patches
+    patch_start  (patches+1,)  index of the first point of every patch
+    patch_shape  (patches, 2)  rows and columns of every patch
+    patch_texture_id (patches,) index into 'textures'
+    patch_group  (patches,)    index into 'groups', -1 for worldspawn
+
+Paths ending in '.npz' are written as a single uncompressed numpy archive,
+all other paths as a directory of '.npy' files which can be memory-mapped.
+
+Writing a stored scene takes about as long as writing the objects it was
+made of, storing only saves time for scenes whose generation is expensive,
+e.g. with csg.carve or validation.
+"""
+
+import os
+import numpy as np
+import baseclasses
+import helper
+
+
+FORMAT_VERSION = 2
+_KEYS = ("verts", "angle", "offset", "scale", "texture_id", "textures",
+         "brush_start", "brush_group", "groups")
+# added in version 2, scenes of version 1 have no patches
+_PATCH_KEYS = ("patch_points", "patch_start", "patch_shape",
+               "patch_texture_id", "patch_group")
+
+
+def scene_arrays(objs, group="Group"):
+    """
+    \brief Flatten objects into the arrays of the binary scene format
+    \param objs list of objects, as passed to assets.ObjectWriter
+    \param group name of the func_group for groupable objects
+    """
+    verts = []
+    angle = []
+    offset = []
+    scale = []
+    texture_id = []
+    textures = {}
+    brush_start = [0]
+    brush_group = []
+    patch_points = []
+    patch_start = [0]
+    patch_shape = []
+    patch_texture_id = []
+    patch_group = []
+    for obj in objs:
+        group_id = 0 if obj.isGroupable else -1
+        for brush in baseclasses.iter_brushes(obj, patches=True):
+            if isinstance(brush, baseclasses.Patch):
+                texcoords = brush.texcoords
+                if texcoords is None:
+                    texcoords = brush.natural_texcoords()
+                points = np.concatenate([brush.points, texcoords], axis=2)
+                patch_points.append(points.reshape(-1, 5))
+                patch_start.append(patch_start[-1] + points.shape[0] *
+                                   points.shape[1])
+                patch_shape.append(points.shape[:2])
+                patch_texture_id.append(textures.setdefault(brush.texture,
+                                                            len(textures)))
+                patch_group.append(group_id)
+                continue
+            for face in brush.faces:
+                verts.append(face.verts)
+                angle.append(face.angle)
+                offset.append(face.offset)
+                scale.append(face.scale)
+                texture_id.append(textures.setdefault(face.texture,
+                                                      len(textures)))
+            brush_start.append(len(verts))
+            brush_group.append(group_id)
+    return {"verts": np.array(verts, dtype=np.float64).reshape(-1, 3, 3),
+            "angle": np.array(angle, dtype=np.float64),
+            "offset": np.array(offset, dtype=np.float64).reshape(-1, 2),
+            "scale": np.array(scale, dtype=np.float64).reshape(-1, 2),
+            "texture_id": np.array(texture_id, dtype=np.int32),
+            "textures": np.array(list(textures), dtype=str),
+            "brush_start": np.array(brush_start, dtype=np.int64),
+            "brush_group": np.array(brush_group, dtype=np.int32),
+            "groups": np.array([group], dtype=str),
+            "patch_points": np.concatenate(
+                patch_points + [np.empty((0, 5))]).astype(np.float64),
+            "patch_start": np.array(patch_start, dtype=np.int64),
+            "patch_shape": np.array(patch_shape, dtype=np.int32).reshape(-1, 2),
+            "patch_texture_id": np.array(patch_texture_id, dtype=np.int32),
+            "patch_group": np.array(patch_group, dtype=np.int32)}
+
+
+def save(path, objs, group="Group"):
+    """
+    \brief Save objects in the binary scene format
+    \param path '.npz' file or directory for memory-mappable storage
+    \param objs list of objects, as passed to assets.ObjectWriter
+    \param group name of the func_group for groupable objects
+    """
+    save_arrays(path, scene_arrays(objs, group))
+
+
+def save_arrays(path, arrays):
+    """
+    \brief Save the arrays of an already flattened scene
+    """
+    arrays = dict(arrays, version=np.array(FORMAT_VERSION))
+    if path.endswith(".npz"):
+        np.savez(path, **arrays)
+        return
+    os.makedirs(path, exist_ok=True)
+    for key, value in arrays.items():
+        np.save(os.path.join(path, key + ".npy"), value)
+
+
+def _read_arrays(read):
+    version = int(read("version"))
+    if version not in (1, FORMAT_VERSION):
+        raise ValueError("Unsupported scene format version {}".format(
+            version))
+    if version == 1:
+        arrays = {"patch_points": np.empty((0, 5)),
+                  "patch_start": np.zeros(1, dtype=np.int64),
+                  "patch_shape": np.empty((0, 2), dtype=np.int32),
+                  "patch_texture_id": np.empty(0, dtype=np.int32),
+                  "patch_group": np.empty(0, dtype=np.int32)}
+        keys = _KEYS
+    else:
+        arrays = {}
+        keys = _KEYS + _PATCH_KEYS
+    arrays.update((key, read(key)) for key in keys)
+    return arrays
+
+
+def load(path, mmap=False):
+    """
+    \brief Load a scene saved by 'save'
+    \param path '.npz' file or directory
+    \param mmap memory-map the arrays instead of reading them
+    (only for directories)
+    """
+    if os.path.isdir(path):
+        mode = "r" if mmap else None
+        arrays = _read_arrays(lambda key: np.load(
+            os.path.join(path, key + ".npy"), mmap_mode=mode))
+    else:
+        with np.load(path) as data:
+            arrays = _read_arrays(data.__getitem__)
+    return StoredScene(arrays)
+
+
+class StoredScene(baseclasses.BaseAsset):
+    """
+    Scene loaded from the binary format, can be written as .map directly
+    """
+
+    def __init__(self, arrays):
+        super().__init__()
+        self.arrays = arrays
+
+    def __len__(self):
+        """
+        \brief Number of brushes
+        """
+        return len(self.arrays["brush_group"])
+
+    @property
+    def num_patches(self):
+        return len(self.arrays["patch_group"])
+
+    @property
+    def groups(self):
+        return [str(name) for name in self.arrays["groups"]]
+
+    def face_slice(self, index):
+        start = self.arrays["brush_start"]
+        return slice(int(start[index]), int(start[index+1]))
+
+    def brush(self, index):
+        """
+        \brief Create the Brush object with the given index
+        """
+        a = self.arrays
+        faces = []
+        s = self.face_slice(index)
+        for i in range(s.start, s.stop):
+            v = a["verts"][i]
+            faces.append(baseclasses.Face(
+                v[0], v[1], v[2], str(a["textures"][a["texture_id"][i]]),
+                a["angle"][i], a["offset"][i][0], a["offset"][i][1],
+                a["scale"][i][0], a["scale"][i][1]))
+        return baseclasses.Brush(faces)
+
+    def patch(self, index):
+        """
+        \brief Create the Patch object with the given index
+        """
+        a = self.arrays
+        start = a["patch_start"]
+        points = np.array(a["patch_points"][int(start[index]):
+                                            int(start[index+1])])
+        points = points.reshape(tuple(a["patch_shape"][index]) + (5,))
+        return baseclasses.Patch(
+            points[..., :3], str(a["textures"][a["patch_texture_id"][index]]),
+            points[..., 3:])
+
+    def __iter__(self):
+        """
+        \brief Generate all brushes and then all patches
+        """
+        for i in range(len(self)):
+            yield self.brush(i)
+        for i in range(self.num_patches):
+            yield self.patch(i)
+
+    def _write_brushes(self, f, indices, chunksize=4096):
+        a = self.arrays
+        start = np.asarray(a["brush_start"])
+        for c in range(0, len(indices), chunksize):
+            chunk = indices[c:c+chunksize]
+            counts = start[chunk+1] - start[chunk]
+            faceids = np.repeat(start[chunk] - np.cumsum(counts) + counts,
+                                counts) + np.arange(counts.sum())
+            baseclasses.write_brushes(
+                f, counts, a["verts"][faceids],
+                a["textures"][a["texture_id"][faceids]], a["angle"][faceids],
+                a["offset"][faceids], a["scale"][faceids])
+
+    def write(self, f):
+        """
+        \brief Write the scene in .map format without creating Face objects
+        """
+        group_ids = np.asarray(self.arrays["brush_group"])
+        patch_groups = np.asarray(self.arrays["patch_group"])
+        for group_id, name in enumerate(self.groups):
+            indices = np.flatnonzero(group_ids == group_id)
+            patches = np.flatnonzero(patch_groups == group_id)
+            if len(indices) or len(patches):
+                with helper.group(f, name):
+                    self._write_brushes(f, indices)
+                    self._write_patches(f, patches)
+        indices = np.flatnonzero(group_ids == -1)
+        patches = np.flatnonzero(patch_groups == -1)
+        if len(indices) or len(patches):
+            with helper.worldspawn(f):
+                self._write_brushes(f, indices)
+                self._write_patches(f, patches)
+
+    def _write_patches(self, f, indices):
+        for i in indices.tolist():
+            f.write(str(self.patch(i)))
@@ -0,0 +1,142 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import copy
+import numpy as np
+import pytest
+import baseclasses
+import modifiers
+import primitives
+
+
+def _face():
+    return baseclasses.Face([0, 0, 0], [0, 16, 0], [16, 0, 0], "test/a", 15,
+                            1, 2, 0.5, 0.25)
+
+
+def test_face_packed_data():
+    face = _face()
+    assert face.data.tolist() == [0, 0, 0, 0, 16, 0, 16, 0, 0, 1, 2, 0.5,
+                                  0.25]
+    face.verts[1] = [8, 8, 8]
+    face.offset = [3, 4]
+    face.scale[1] = 2
+    assert face.data[3:6].tolist() == [8, 8, 8]
+    assert face.data[9:].tolist() == [3, 4, 0.5, 2]
+    # the packed layout is kept without a per instance dictionary
+    with pytest.raises(AttributeError):
+        face.color = "red"
+
+
+def test_face_copy_is_independent():
+    face = _face()
+    for other in (face.copy(), copy.copy(face), copy.deepcopy(face)):
+        assert str(other) == str(face)
+        other.verts += 1
+        other.offset[0] = 10
+        other.texture = "test/b"
+        assert face.data.tolist()[:3] == [0, 0, 0]
+        assert face.offset.tolist() == [1, 2]
+        assert face.texture == "test/a"
+
+
+def test_face_flip():
+    face = _face()
+    normal = face.normal
+    flipped = face.flipped()
+    assert np.allclose(flipped.normal, -normal)
+    assert flipped.verts.tolist() == [[0, 0, 0], [16, 0, 0], [0, 16, 0]]
+    flipped.flip()
+    assert flipped.data.tolist() == face.data.tolist()
+
+
+def test_brush_copies_are_independent():
+    cylinder = primitives.CylinderBrush(np.array([0., 0, 0]), 32, 64)
+    brush = baseclasses.brushes_from_arrays(
+        **baseclasses.face_arrays([cylinder]))[0]
+    data = str(brush)
+    copies = [brush.copy_brush(), brush.clone(), copy.deepcopy(brush),
+              brush.cutted(baseclasses.Face([0, 0, 0], [0, 16, 0],
+                                            [16, 0, 0]))]
+    for other in copies:
+        # the cut adds a face at the end
+        assert str(other).startswith(data[:-len("}\n}\n")])
+        other.move([8, 0, 0])
+        other.faces[0].texture = "test/b"
+    assert str(brush) == data
+
+
+def _uv(face, points):
+    """
+    \brief Texture coordinates of points on a face
+    """
+    normal = -face.normal/np.linalg.norm(face.normal)
+    saxis, taxis = baseclasses.texture_axes(normal[None])
+    rotscale, off = baseclasses.texture_matrices(
+        [face.angle], face.offset[None], face.scale[None],
+        baseclasses.texture_size(face.texture)[None])
+    st = np.stack([points@saxis[0], points@taxis[0]], axis=-1)
+    return st@rotscale[0].T + off[0]
+
+
+def _textured_brush():
+    brush = baseclasses.brushes_from_arrays(**baseclasses.face_arrays(
+        [primitives.Cuboid(np.array([40., 8, 16]),
+                           np.array([32., 48, 64]))]))[0]
+    for i, face in enumerate(brush.faces):
+        face.angle = 30*i
+        face.offset = [7*i, 3]
+        face.scale = [0.5, 0.5]
+    return brush
+
+
+def _rotation(axis, angle):
+    axis = np.asarray(axis, dtype=np.float64)/np.linalg.norm(axis)
+    cross = np.cross(np.eye(3), axis)
+    # row vector convention: p @ R
+    return (np.cos(angle)*np.eye(3) + np.sin(angle)*cross +
+            (1 - np.cos(angle))*np.outer(axis, axis))
+
+
+@pytest.mark.parametrize("axis", [[0, 0, 1], [1, 0, 0], [1, 2, 3]])
+def test_texture_lock_rotation(axis):
+    brush = _textured_brush()
+    rotation = _rotation(axis, 0.7)
+    center = np.array([5., -3, 2])
+    rotated = brush.copy_brush()
+    rotated.rotate_point(center, rotation, texture_lock=True)
+    rotated.move([13, -21, 5], texture_lock=True)
+    for old, new in zip(brush.faces, rotated.faces):
+        points = old.verts
+        moved = (points - center)@rotation + center + [13, -21, 5]
+        assert np.allclose(_uv(new, moved), _uv(old, points))
+    # without the lock the texture is projected anew
+    unlocked = brush.copy_brush()
+    unlocked.rotate_point(center, rotation)
+    assert not all(np.allclose(_uv(new, new.verts), _uv(old, old.verts))
+                   for old, new in zip(brush.faces, unlocked.faces))
+
+
+def test_texture_lock_array():
+    brush = _textured_brush()
+    array = modifiers.Array(brush, 3, [100, 0, 0],
+                            rotation=([0, 0, 1], np.pi/3), texture_lock=True)
+    copies = list(baseclasses.iter_brushes(array))
+    for copy_brush, matrix in zip(copies, array.transforms()):
+        for old, new in zip(brush.faces, copy_brush.faces):
+            points = old.verts@matrix[:3, :3] + matrix[3, :3]
+            assert np.allclose(_uv(new, points), _uv(old, old.verts))
@@ -0,0 +1,99 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import json
+import build
+
+
+_GENERATOR = '''
+import numpy as np
+import primitives
+
+
+def cubes(count):
+    return [primitives.Cuboid(np.array([32.*i, 0, 0]), np.array([16., 16, 16]))
+            for i in range(count)]
+
+
+def broken():
+    raise RuntimeError("broken generator")
+'''
+
+
+def _manifest(tmp_path, jobs):
+    (tmp_path / "build_test_generator.py").write_text(_GENERATOR)
+    path = tmp_path / "manifest.json"
+    path.write_text(json.dumps({"assets": jobs}))
+    return str(path)
+
+
+def _statuses(results):
+    return [result["status"] for result in results]
+
+
+def test_build_skips_unchanged_outputs(tmp_path):
+    job = {"generator": "build_test_generator:cubes", "params": {"count": 2},
+           "output": "maps/cubes.map"}
+    manifest = _manifest(tmp_path, [job])
+    settings = {"geometry_only": True}
+    assert _statuses(build.build(manifest, 1, settings=settings)) == ["built"]
+    assert (tmp_path / "maps" / "cubes.map").read_text().count(
+        "brushDef") == 2
+    assert _statuses(build.build(manifest, 1, settings=settings)) == [
+        "skipped"]
+    assert _statuses(build.build(manifest, 1, force=True,
+                                 settings=settings)) == ["built"]
+    # other settings and other parameters change the output
+    assert _statuses(build.build(manifest, 1, settings={
+        "geometry_only": True, "xondir": str(tmp_path)})) == ["built"]
+    job["params"]["count"] = 3
+    manifest = _manifest(tmp_path, [job])
+    assert _statuses(build.build(manifest, 1, settings=settings)) == ["built"]
+    assert (tmp_path / "maps" / "cubes.map").read_text().count(
+        "brushDef") == 3
+
+
+def test_build_reports_failed_jobs(tmp_path):
+    manifest = _manifest(tmp_path, [
+        {"generator": "build_test_generator:broken", "output": "a.map"},
+        {"generator": "build_test_generator:cubes", "params": {"count": 1},
+         "output": "b.map"}])
+    settings = {"geometry_only": True}
+    results = build.build(manifest, 1, settings=settings)
+    assert _statuses(results) == ["failed", "built"]
+    assert "broken generator" in results[0]["error"]
+    assert not (tmp_path / "a.map").exists()
+    # failed jobs are retried
+    results = build.build(manifest, 1, settings=settings)
+    assert {os.path.basename(result["output"]): result["status"]
+            for result in results} == {"a.map": "failed", "b.map": "skipped"}
+
+
+def test_texture_cache_per_source(tmp_path):
+    path = str(tmp_path / "textures.json")
+    build._save_texture_cache(path, "a", {"test/a": [32, 16], "test/b": None})
+    build._save_texture_cache(path, "b", {"test/a": [64, 64]})
+    # misses are looked up again, sizes of other sources are not used
+    assert build._load_texture_cache(path, "a") == {"test/a": [32, 16]}
+    assert build._load_texture_cache(path, "b") == {"test/a": [64, 64]}
+    assert build._load_texture_cache(path, "c") == {}
+    assert build.texture_source({"geometry_only": True}) == "geometry only"
+    for name in ("a", "b"):
+        (tmp_path / name / "data" / "xonotic-maps.pk3dir").mkdir(parents=True)
+    assert (build.texture_source({"xondir": str(tmp_path / "a")}) !=
+            build.texture_source({"xondir": str(tmp_path / "b")}))
@@ -0,0 +1,54 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import numpy as np
+import baseclasses
+import collision
+import geometry
+import helper
+import primitives
+
+
+def _cube(center, size=16.):
+    return primitives.Cuboid(np.array(center, dtype=np.float64),
+                             np.array([size, size, size]))
+
+
+def test_intersects():
+    assert collision.intersects(_cube([0, 0, 0]), _cube([8, 8, 8]))
+    # touching and separated cubes don't overlap
+    assert not collision.intersects(_cube([0, 0, 0]), _cube([16, 0, 0]))
+    assert not collision.intersects(_cube([0, 0, 0]), _cube([40, 0, 0]))
+
+
+def test_separating_edge_axis():
+    # the bounding boxes overlap, only the rotated faces separate the brushes
+    brush = baseclasses.brushes_from_arrays(
+        **baseclasses.face_arrays([_cube([0, 0, 0])]))[0]
+    brush.rotate_point(np.zeros(3), helper.RotationMatrixZ(np.pi/4))
+    assert not collision.intersects(brush, _cube([14, 14, 0]))
+    assert collision.intersects(brush, _cube([10, 10, 0]))
+
+
+def test_overlapping_pairs_many_planes():
+    cylinder = primitives.CylinderBrush(np.array([0., 0, 0]), 32, 64,
+                                        numSides=32)
+    mins, maxs = geometry.object_bounds(cylinder)
+    z = (mins[2] + maxs[2])/2
+    cubes = [_cube([30, 0, z]), _cube([34, 34, z]), _cube([100, 0, z])]
+    assert collision.overlapping_pairs([cylinder] + cubes).tolist() == [[0, 1]]
+    assert collision.overlapping_pairs(cubes, cylinder).tolist() == [[0, 0]]
@@ -0,0 +1,127 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import io
+import numpy as np
+import assets
+import baseclasses
+import collision
+import csg
+import geometry
+import primitives
+import validate
+
+
+def _box(mins, maxs, texture="common/caulk"):
+    mins = np.array(mins, dtype=np.float64)
+    maxs = np.array(maxs, dtype=np.float64)
+    return primitives.Cuboid((mins + maxs)/2, maxs - mins, texture)
+
+
+def _volume(brushes, mins, maxs, step=2.):
+    """
+    \brief Volume of the union of brushes, sampled at the centers of a grid
+    """
+    axes = [np.arange(lo + step/2, hi, step) for lo, hi in zip(mins, maxs)]
+    points = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1)
+    points = points.reshape(-1, 3)
+    inside = np.zeros(len(points), dtype=bool)
+    for brush in baseclasses.iter_brushes(brushes):
+        normals, dists = geometry.brush_planes(brush)
+        inside |= np.all(points@normals.T <= dists + 1e-6, axis=1)
+    return inside.sum()*step**3
+
+
+def test_merge_adjacent_cubes():
+    merged, stats = csg.merge_brushes([_box([0, 0, 0], [16, 16, 16]),
+                                       _box([16, 0, 0], [32, 16, 16])])
+    assert len(merged) == 1
+    assert len(merged[0].faces) == 6
+    assert stats["brushes"] == (2, 1)
+    mins, maxs = geometry.object_bounds(merged)
+    assert np.allclose(mins, [0, 0, 0]) and np.allclose(maxs, [32, 16, 16])
+
+
+def test_merge_keeps_shape():
+    # an L shape can only be merged into two brushes
+    brushes = [_box([0, 0, 0], [16, 16, 16]), _box([16, 0, 0], [32, 16, 16]),
+               _box([0, 16, 0], [16, 32, 16])]
+    merged, stats = csg.merge_brushes(brushes)
+    assert len(merged) == 2
+    box = ([0, 0, 0], [32, 32, 16])
+    assert _volume(merged, *box) == _volume(brushes, *box) == 3*16**3
+
+
+def test_merge_needs_equal_textures():
+    merged, stats = csg.merge_brushes([
+        _box([0, 0, 0], [16, 16, 16], "test/a"),
+        _box([16, 0, 0], [32, 16, 16], "test/b")])
+    assert len(merged) == 2
+
+
+def test_merge_keeps_patches():
+    cylinder = primitives.CylinderBrush(np.array([100., 0, 0]), 16, 32,
+                                        output="patch")
+    writer = assets.ObjectWriter([_box([0, 0, 0], [16, 16, 16]),
+                                  _box([16, 0, 0], [32, 16, 16]), cylinder],
+                                 merge=True)
+    f = io.StringIO()
+    writer.write(f)
+    data = f.getvalue()
+    assert writer.merge_statistics["brushes"] == (2, 1)
+    assert data.count("patchDef2") == str(cylinder).count("patchDef2")
+
+
+def _carved_volume(walls, doors, box):
+    fragments = csg.carve(walls, doors)
+    assert validate.validate(fragments).ok
+    assert not len(collision.overlapping_pairs(fragments, doors))
+    return fragments, _volume(fragments, *box)
+
+
+def test_carve_door():
+    wall = _box([0, 0, 0], [256, 16, 128])
+    door = _box([96, -8, 0], [160, 24, 96], "test/door")
+    box = ([0, 0, 0], [256, 16, 128])
+    fragments, volume = _carved_volume([wall], [door], box)
+    assert volume == 256*16*128 - 64*16*96
+    # the faces of the opening get the texture of the cutter
+    assert "test/door" in {face.texture for brush in fragments
+                           for face in brush.faces}
+
+
+def test_carve_overlapping_doors():
+    wall = _box([0, 0, 0], [256, 16, 128])
+    other = _box([300, 0, 0], [400, 16, 128])
+    doors = [_box([64, -8, 0], [128, 24, 96]),
+             _box([96, -8, 32], [192, 24, 112])]
+    box = ([0, 0, 0], [256, 16, 128])
+    # the union of the doors is removed once
+    opening = _volume(doors, [0, 0, 0], [256, 16, 128])
+    assert opening == 16*(64*96 + 96*80 - 32*64)
+    fragments, volume = _carved_volume([wall, other], doors, box)
+    assert volume == 256*16*128 - opening
+    # untouched targets come first and are unchanged
+    assert fragments[0] is other
+
+
+def test_carve_drops_slivers():
+    wall = _box([0, 0, 0], [64, 16, 64])
+    cutter = _box([-8, 0.25, -8], [72, 24, 72])
+    assert csg.carve([wall], [cutter], min_thickness=0.5) == []
+    fragments = csg.carve([wall], [cutter], min_thickness=0.1)
+    assert _volume(fragments, [0, 0, 0], [64, 0.5, 64], 0.25) == 64*64*0.25
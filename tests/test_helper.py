@@ -0,0 +1,54 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import zipfile
+import pytest
+import helper
+
+
+def _archive(path):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("textures/a.txt", "a"*10000)
+        archive.writestr("maps/old.map", "old")
+
+
+def test_failed_append_restores_the_archive(tmp_path):
+    path = str(tmp_path / "data.pk3")
+    _archive(path)
+    with open(path, "rb") as f:
+        original = f.read()
+    with pytest.raises(RuntimeError):
+        with helper.open_output(path, "maps/new.map") as f:
+            f.write("partial"*1000)
+            raise RuntimeError
+    with open(path, "rb") as f:
+        assert f.read() == original
+
+
+def test_append_and_replace_members(tmp_path):
+    path = str(tmp_path / "data.pk3")
+    _archive(path)
+    with helper.open_output(path, "maps/new.map") as f:
+        f.write("new")
+    with helper.open_output(path, "maps/old.map") as f:
+        f.write("replaced")
+    with zipfile.ZipFile(path) as archive:
+        assert archive.testzip() is None
+        assert sorted(archive.namelist()) == ["maps/new.map", "maps/old.map",
+                                              "textures/a.txt"]
+        assert archive.read("maps/old.map") == b"replaced"
+        assert archive.read("textures/a.txt") == b"a"*10000
+    assert not (tmp_path / "data.pk3.part").exists()
@@ -0,0 +1,69 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import re
+import zipfile
+import numpy as np
+import assets
+import helper
+import instancing
+import modifiers
+import primitives
+
+
+def _cube():
+    return primitives.Cuboid(np.array([0., 0, 0]), np.array([32., 32, 32]))
+
+
+def test_euler_angles_round_trip():
+    pitch, yaw, roll = np.deg2rad([20, 30, 40])
+    # column vector form Rz(yaw) Ry(pitch) Rx(roll)
+    rx = helper.rotation_matrices([1, 0, 0], [roll])[0]
+    ry = helper.rotation_matrices([0, 1, 0], [pitch])[0]
+    rz = helper.rotation_matrices([0, 0, 1], [yaw])[0]
+    # row vectors are rotated by roll, pitch and yaw in this order
+    rotation = rx @ ry @ rz
+    assert np.allclose(instancing.euler_angles(rotation[None]),
+                       [[20, 30, 40]])
+
+
+def test_write_obj_of_a_cube():
+    f = io.StringIO()
+    instancing.write_obj(f, _cube())
+    lines = f.getvalue().splitlines()
+    assert sum(line.startswith("f ") for line in lines) == 6
+    points = np.array([line.split()[1:] for line in lines
+                       if line.startswith("v ")], dtype=np.float64)
+    assert np.allclose(np.abs(points), 16)
+
+
+def test_instances_are_saved_into_the_archive(tmp_path):
+    path = str(tmp_path / "data.pk3")
+    writer = assets.ObjectWriter([modifiers.Array(_cube(), 3, [64, 0, 0])],
+                                 instancing=True)
+    writer.save(path, "maps/a.map")
+    writer.save(path, "maps/b.map")
+    with zipfile.ZipFile(path) as archive:
+        names = archive.namelist()
+        data = archive.read("maps/a.map").decode()
+    models = set(re.findall(r'"model" "([^"]+)"', data))
+    assert len(models) == 1
+    # equal models are only stored once
+    assert sorted(names) == sorted(["maps/a.map", "maps/b.map"] +
+                                   list(models))
+    assert data.count("misc_model") == 3
+    assert not (tmp_path / "models").exists()
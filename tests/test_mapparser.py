@@ -0,0 +1,66 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import assets
+import mapparser
+import primitives
+
+
+def test_comment_at_end_of_file(tmp_path):
+    path = tmp_path / "cube.map"
+    cube = primitives.Cuboid(np.array([0., 0, 0]), np.array([32., 32, 32]))
+    writer = assets.ObjectWriter([cube], prefetch=False)
+    writer.save(str(path))
+    # no newline after the last comment
+    with open(path, "a") as f:
+        f.write("\n// end of map")
+    entities = mapparser.parse(str(path))
+    assert sum(len(entity.brushes) for entity in entities) == 1
+
+
+def test_comments_are_not_tokens():
+    scanner = mapparser.Scanner(b'{ "a" "b" } // x\n// y')
+    tokens = []
+    kind, token = scanner.next()
+    while kind is not None:
+        tokens.append(token)
+        kind, token = scanner.next()
+    assert tokens == ["{", "a", "b", "}"]
+
+
+def test_identity_transform_keeps_sheared_textures(tmp_path):
+    cube = primitives.Cuboid(np.array([0., 0, 0]), np.array([32., 32, 32]))
+    data = str(cube)
+    # replace the texture matrix of the first face by a sheared one
+    start = data.index("( ( ")
+    end = data.index(") )", start) + 3
+    sheared = "( ( 0.015625 0.01 0 ) ( 0 0.015625 0 ) )"
+    src = tmp_path / "src.map"
+    dst = tmp_path / "dst.map"
+    with open(src, "w") as f:
+        f.write('{\n"classname" "worldspawn"\n' + data[:start] + sheared +
+                data[end:] + "}\n")
+    mapparser.transform_map(str(src), str(dst), lambda brush, kv: brush)
+    with open(dst) as f:
+        assert "( ( 0.015625 0.01 0.0 ) ( 0.0 0.015625 0.0 ) )" in f.read()
+    brush = mapparser.parse(str(dst))[0].brushes[0]
+    assert np.allclose(brush.faces[0].texture_matrix,
+                       [[0.015625, 0.01, 0], [0, 0.015625, 0]])
+    # changed faces get the matrix of their texture parameters
+    brush.move([16, 0, 0])
+    assert brush.faces[0].texture_matrix is None
+    assert "0.01 " not in str(brush)
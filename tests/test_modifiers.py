@@ -0,0 +1,52 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import baseclasses
+import modifiers
+import primitives
+
+
+def _patch():
+    points = np.zeros((3, 3, 3))
+    points[..., 0] = np.arange(3)[:, None]*16
+    points[..., 1] = np.arange(3)[None]*16
+    return baseclasses.Patch(points)
+
+
+def test_array_of_patch():
+    for kwargs in ({}, {"rotation": ([0, 0, 1], np.pi/2)}):
+        data = str(modifiers.Array(_patch(), 3, [100, 0, 0], **kwargs))
+        assert data.count("patchDef2") == 3
+        assert "brushDef" not in data
+
+
+def test_array_of_patch_output():
+    cylinder = primitives.CylinderBrush(np.array([0., 0, 0]), 32, 64,
+                                        output="patch")
+    per_copy = str(cylinder).count("patchDef2")
+    for kwargs in ({}, {"rotation": ([0, 0, 1], np.pi/2)}):
+        data = str(modifiers.Array(cylinder, 3, [100, 0, 0], **kwargs))
+        assert data.count("patchDef2") == 3*per_copy
+        # only the caulked hulls are brushes
+        assert data.count("brushDef") == 3
+
+
+def test_rotated_patch_copy():
+    array = modifiers.Array(_patch(), 2, [0, 0, 0],
+                            rotation=([0, 0, 1], np.pi/2))
+    patch, = array[1]
+    assert np.allclose(patch.points[2, 0], [0, 32, 0])
@@ -0,0 +1,141 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import io
+import numpy as np
+import pytest
+from PIL import Image
+import baseclasses
+import collision
+import geometry
+import modifiers
+import primitives
+import validate
+
+
+def _heightmap():
+    y, x = np.mgrid[0:5, 0:7]
+    return (np.sin(x) + np.cos(y) + 2)/4
+
+
+def test_terrain_brushes():
+    terrain = primitives.Terrain(_heightmap(), np.array([0., 0, 0]),
+                                 np.array([600., 400, 100]),
+                                 texture="test/grass")
+    assert len(terrain) == 2*4*6
+    assert len(list(terrain)) == len(terrain)
+    assert validate.validate(terrain).ok
+    mins, maxs = geometry.object_bounds(terrain)
+    assert np.allclose(mins, [-300, -200, -50])
+    assert np.allclose(maxs[:2], [300, 200])
+    assert maxs[2] <= 50
+    assert "test/grass" in str(terrain)
+    # writing in chunks of rows gives the same brushes
+    f = io.StringIO()
+    terrain.write(f, chunksize=3)
+    assert f.getvalue() == str(terrain)
+
+
+def test_terrain_from_image(tmp_path):
+    path = str(tmp_path / "heightmap.png")
+    Image.fromarray((_heightmap()*255).astype(np.uint8)).save(path)
+    terrain = primitives.Terrain(path, np.array([0., 0, 0]),
+                                 np.array([600., 400, 100]))
+    assert terrain.heightmap.shape == (5, 7)
+    assert len(list(baseclasses.iter_brushes(terrain))) == 48
+
+
+def test_terrain_without_thickness():
+    with pytest.raises(ValueError):
+        primitives.Terrain(_heightmap(), np.array([0., 0, 0]),
+                           np.array([600., 400, 100]), min_thickness=0)
+    with pytest.raises(ValueError):
+        primitives.Terrain(np.zeros((1, 5)), np.array([0., 0, 0]),
+                           np.array([600., 400, 100]))
+
+
+@pytest.mark.parametrize("radius, tolerance", [(16, 1), (512, 1), (512, 8),
+                                               (100, 0.1)])
+def test_segments_for_tolerance(radius, tolerance):
+    n = primitives.segments_for_tolerance(radius, tolerance)
+    # distance between the middle of a chord and the arc
+    assert radius*(1 - np.cos(np.pi/n)) <= tolerance
+    assert radius*(1 - np.cos(np.pi/(n - 1))) > tolerance
+
+
+def test_tolerance_follows_size():
+    small = primitives.CylinderBrush(np.array([0., 0, 0]), 16, 64,
+                                     tolerance=1)
+    large = primitives.CylinderBrush(np.array([0., 0, 0]), 512, 64,
+                                     tolerance=1)
+    assert small.numSides < large.numSides
+    assert baseclasses.statistics([small])["faces"] == small.numSides + 2
+    sides = small.numSides
+    small.size = small.size*4
+    assert small.numSides > sides
+    fine = primitives.EllipsoidBrush(np.array([0., 0, 0]),
+                                     np.array([256., 256, 256]), tolerance=0.5)
+    coarse = primitives.EllipsoidBrush(np.array([0., 0, 0]),
+                                       np.array([256., 256, 256]), tolerance=4)
+    assert fine.numSegments > coarse.numSegments
+    assert fine.numRings > coarse.numRings
+    with pytest.raises(ValueError):
+        primitives.segments_for_tolerance(16, 0)
+
+
+_SQUARE = [[-4, -4], [4, -4], [4, 4], [-4, 4]]
+
+
+def test_sweep_straight():
+    sweep = primitives.Sweep(_SQUARE, [[0, 0, 0], [64, 0, 0], [128, 0, 0]])
+    brushes = list(sweep)
+    assert len(brushes) == len(sweep) == 2
+    assert [len(brush.faces) for brush in brushes] == [6, 6]
+    mins, maxs = geometry.object_bounds(sweep)
+    assert np.allclose(mins, [0, -4, -4]) and np.allclose(maxs, [128, 4, 4])
+
+
+def test_sweep_along_curve():
+    def helix(t):
+        return np.stack([128*np.cos(2*np.pi*t), 128*np.sin(2*np.pi*t),
+                         256*t], axis=-1)
+    sweep = primitives.Sweep.from_curve(_SQUARE, helix, 32,
+                                        twist=lambda t: t*np.pi/2)
+    assert len(list(baseclasses.iter_brushes(sweep))) == 32
+    assert validate.validate(sweep).ok
+    # neighbouring segments only touch at the joints
+    assert not len(collision.overlapping_pairs(sweep))
+    assert str(sweep).count("brushDef") == 32
+
+
+def test_sweep_invalid_path():
+    with pytest.raises(ValueError):
+        primitives.Sweep(_SQUARE, [[0, 0, 0]])
+    with pytest.raises(ValueError):
+        list(primitives.Sweep(_SQUARE, [[0, 0, 0], [0, 0, 0], [8, 0, 0]]))
+
+
+def test_scatter_sweep():
+    sweep = primitives.Sweep(_SQUARE, [[0, 0, 0], [64, 0, 0], [64, 64, 0]])
+    scatter = modifiers.RandomScatter(sweep, 5, [256, 256, 0], 0.5,
+                                      rng=np.random.default_rng(1))
+    data = str(scatter)
+    assert data.count("brushDef") == 5*2
+    # scaling changes the profile as well as the path
+    size = sweep.size
+    sweep.scale(2)
+    assert np.allclose(sweep.size, 2*size)
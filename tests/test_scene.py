@@ -0,0 +1,113 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import io
+import numpy as np
+import baseclasses
+import modifiers
+import primitives
+import scene
+
+
+def test_modifier_bounds_without_copies(monkeypatch):
+    cuboid = primitives.Cuboid(np.array([50., 0, 0]), np.array([20., 20, 20]))
+    array = modifiers.Array(cuboid, 4, [0, 0, 0],
+                            rotation=([0, 0, 1], np.pi/2))
+    scatter = modifiers.RandomScatter(cuboid, 3, [10, 0, 0], 0.5)
+    iter_brushes = baseclasses.iter_brushes
+
+    def expand(obj, *args, **kwargs):
+        assert not isinstance(obj, (modifiers.Array, modifiers.RandomScatter))
+        return iter_brushes(obj, *args, **kwargs)
+    monkeypatch.setattr(baseclasses, "iter_brushes", expand)
+
+    root = scene.Scene()
+    root.add(array)
+    root.node("scatter").add(scatter)
+    mins, maxs = root.bounds
+    assert np.allclose(mins, [-60, -60, -15])
+    assert np.allclose(maxs, [75, 60, 15])
+
+
+def test_modifier_bounds_contain_copies():
+    brush = baseclasses.brushes_from_arrays(**baseclasses.face_arrays(
+        [primitives.Cuboid(np.array([50., 0, 0]), np.array([20., 20, 20]))]))[0]
+    array = modifiers.Array(brush, 3, [0, 0, 40],
+                            rotation=([0, 0, 1], np.pi/4))
+    mins, maxs = scene.object_bounds(array)
+    expanded = scene.object_bounds(list(baseclasses.iter_brushes(array)))
+    assert np.all(mins <= expanded[0] + 1e-6)
+    assert np.all(maxs >= expanded[1] - 1e-6)
+    assert np.allclose(maxs[2], 90)
+
+
+def _cube(center):
+    return primitives.Cuboid(np.array(center, dtype=np.float64),
+                             np.array([16., 16, 16]))
+
+
+def _export(view):
+    f = io.StringIO()
+    view.write(f)
+    return f.getvalue()
+
+
+def test_region_export_skips_factories():
+    calls = []
+
+    def factory(name, center):
+        def generate():
+            calls.append(name)
+            return _cube(center)
+        return generate
+
+    root = scene.Scene("City")
+    root.node("north").add(factory("north", [0, 1000, 0]),
+                           bounds=([-8, 992, -8], [8, 1008, 8]))
+    south = root.node("south", "func_detail")
+    south.add(factory("south", [0, -1000, 0]),
+              bounds=([-8, -1008, -8], [8, -992, 8]))
+    data = _export(root.view(region=([-100, 500, -100], [100, 1500, 100])))
+    assert calls == ["north"]
+    assert data.count("brushDef") == 1
+    assert '"targetname" "north"' in data
+    # a selection by node only generates that node
+    data = _export(root.view(nodes=["south"]))
+    assert calls == ["north", "south"]
+    assert '"classname" "func_detail"' in data
+    assert np.allclose(root.bounds[0], [-8, -1008, -8])
+
+
+def test_leaf_bounds_without_given_bounds():
+    calls = []
+
+    def generate():
+        calls.append(1)
+        return _cube([32, 0, 0])
+
+    root = scene.Scene()
+    leaf = root.node("a").node("b").add(generate, cache=False)
+    assert root.find("a/b").path == "a/b"
+    assert np.allclose(root.bounds[0], [24, -8, -8])
+    # the bounds are kept when the object is released
+    assert not leaf.generated
+    assert calls == [1]
+    assert np.allclose(leaf.bounds[1], [40, 8, 8])
+    assert calls == [1]
+    # adding objects updates the cached bounds
+    root.add(_cube([-32, 0, 0]))
+    assert np.allclose(root.bounds[0], [-40, -8, -8])
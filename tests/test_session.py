@@ -0,0 +1,95 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import subprocess
+import sys
+import threading
+import zipfile
+import numpy as np
+import pytest
+import baseclasses
+import helper
+import session
+import shaders
+
+
+def test_archives_stay_open_while_another_thread_uses_the_session(tmp_path):
+    path = str(tmp_path / "data.pk3")
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("a.txt", "a")
+    shared = session.Session(geometry_only=True)
+    entered = threading.Event()
+    left = threading.Event()
+    results = []
+
+    def worker():
+        with shared:
+            # handles are kept while reading, e.g. by prefetching
+            archive = session.current().archive(path)
+            entered.set()
+            left.wait()
+            results.append(archive.read("a.txt"))
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    entered.wait()
+    with shared:
+        pass
+    left.set()
+    thread.join()
+    assert results == [b"a"]
+    # closed after the last with block
+    assert not shared._archives
+
+
+def test_nested_activations():
+    shared = session.Session(geometry_only=True)
+    with shared:
+        with shared:
+            assert session.current() is shared
+        assert session.current() is shared
+    assert session.current() is not shared
+
+
+def test_unconfigured_xon_dir(tmp_path, monkeypatch):
+    monkeypatch.delenv("XONOTIC_DIR", raising=False)
+    monkeypatch.setattr(session, "_CONFFILE", str(tmp_path / "config.conf"))
+    with session.Session(geometry_only=False):
+        # no prompt without a terminal
+        with pytest.raises(ValueError):
+            helper.xon_dir()
+        assert shaders.prefetch_texture_sizes(["test/a"]) == ["test/a"]
+        assert np.all(baseclasses.texture_size("test/a") == [64, 64])
+
+
+def test_geometry_only_from_environment(monkeypatch):
+    monkeypatch.setenv("ASSETGEN_GEOMETRY_ONLY", "1")
+    assert session.Session().geometry_only
+    assert not session.Session(geometry_only=False).geometry_only
+    monkeypatch.setenv("ASSETGEN_GEOMETRY_ONLY", "0")
+    assert not session.Session().geometry_only
+
+
+def test_geometry_only_does_not_load_pil():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = ("import sys, assets, primitives, numpy as np\n"
+            "str(primitives.Cuboid(np.zeros(3), np.ones(3)))\n"
+            "print('PIL' in sys.modules, 'zipfile' in sys.modules)\n")
+    env = dict(os.environ, ASSETGEN_GEOMETRY_ONLY="1")
+    output = subprocess.run([sys.executable, "-c", code], cwd=root, env=env,
+                            check=True, stdout=subprocess.PIPE).stdout
+    assert output.split() == [b"False", b"False"]
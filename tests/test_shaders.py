@@ -0,0 +1,64 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import numpy as np
+from PIL import Image
+import baseclasses
+import modifiers
+import primitives
+import session
+import shaders
+
+
+def _git_build(tmp_path, sizes):
+    """
+    \brief Create the data of a git build with a shader per texture size
+    """
+    pk3dir = tmp_path / "data" / "xonotic-maps.pk3dir"
+    (pk3dir / "scripts").mkdir(parents=True)
+    (pk3dir / "textures" / "test").mkdir(parents=True)
+    definitions = []
+    for name, size in sizes.items():
+        Image.new("RGB", size).save(str(pk3dir / "textures" / "test" /
+                                        (name + ".tga")))
+        definitions.append("textures/test/{0}\n{{\n"
+                           "    qer_editorimage textures/test/{0}\n"
+                           "}}\n".format(name))
+    (pk3dir / "scripts" / "test.shader").write_text("".join(definitions))
+    return pk3dir
+
+
+def test_prefetch_texture_sizes(tmp_path):
+    pk3dir = _git_build(tmp_path, {"a": (32, 16), "b": (128, 64)})
+    with session.Session(xondir=str(tmp_path), geometry_only=False):
+        missing = shaders.prefetch_texture_sizes(
+            ["test/a", "test/b", "test/missing", "other/missing"], threads=2)
+        assert missing == ["other/missing", "test/missing"]
+        # the sizes are taken from the cache without reading the images
+        (pk3dir / "textures" / "test" / "a.tga").unlink()
+        assert shaders.get_texture_size("test/a") == (32, 16)
+        assert shaders.get_texture_size("test/b") == (128, 64)
+        assert shaders.texture_size_cache()["test/missing"] is None
+        assert np.all(baseclasses.texture_size("test/missing") == [64, 64])
+
+
+def test_collect_textures_of_modifier_base():
+    cuboid = primitives.Cuboid(np.array([0., 0, 0]), np.array([8., 8, 8]),
+                               {"top": "test/a", "bottom": "test/b"})
+    array = modifiers.Array(cuboid, 100, [16, 0, 0])
+    assert baseclasses.collect_textures([array]) == {"test/a", "test/b",
+                                                   "common/caulk"}
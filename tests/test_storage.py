@@ -0,0 +1,82 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import numpy as np
+import assets
+import baseclasses
+import primitives
+import storage
+
+
+def _written(asset):
+    f = io.StringIO()
+    asset.write(f)
+    return f.getvalue()
+
+
+def _patch():
+    points = np.zeros((3, 3, 3))
+    points[..., 0] = np.arange(3)[:, None]*16
+    points[..., 1] = np.arange(3)[None]*16
+    return baseclasses.Patch(points, "base/floor")
+
+
+def test_patches_are_stored(tmp_path):
+    cylinder = primitives.CylinderBrush(np.array([0., 0, 0]), 32, 64,
+                                        output="patch")
+    objs = [cylinder, _patch()]
+    path = str(tmp_path / "scene.npz")
+    storage.save(path, objs)
+    scene = storage.load(path)
+    assert len(scene) == 1
+    assert scene.num_patches == len(cylinder.patches()) + 1
+    assert (_written(scene) ==
+            _written(assets.ObjectWriter(objs, prefetch=False)))
+
+
+def _objects():
+    return [primitives.Cuboid(np.array([0., 0, 0]), np.array([32., 16, 8]),
+                              "base/wall"),
+            primitives.CylinderBrush(np.array([64., 0, 0]), 16, 32,
+                                     numSides=8)]
+
+
+def _faces(brushes):
+    return [(face.data.tolist(), face.texture, face.angle)
+            for brush in brushes for face in brush.faces]
+
+
+def test_round_trip(tmp_path):
+    objs = _objects()
+    for name, mmap in (("scene.npz", False), ("scene", False),
+                       ("scene", True)):
+        path = str(tmp_path / name)
+        storage.save(path, objs)
+        scene = storage.load(path, mmap=mmap)
+        assert scene.groups == ["Group"]
+        assert len(scene) == 2
+        assert (_faces(scene) ==
+                _faces(baseclasses.iter_brushes(objs)))
+
+
+def test_stored_scene_writes_the_same_map(tmp_path):
+    objs = _objects()
+    path = str(tmp_path / "scene")
+    storage.save(path, objs, group="Walls")
+    expected = _written(assets.ObjectWriter(objs, group="Walls",
+                                            prefetch=False))
+    assert _written(storage.load(path, mmap=True)) == expected
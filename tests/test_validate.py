@@ -0,0 +1,85 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import numpy as np
+import pytest
+import geometry
+import primitives
+import validate
+
+
+def _face_verts(normal, dist):
+    """
+    \brief Plane points of a face with the given outward normal
+    """
+    axis = [0, 0, 1] if abs(normal[2]) < 0.9 else [1, 0, 0]
+    u = np.cross(axis, normal)
+    u /= np.linalg.norm(u)
+    origin = normal*dist
+    return np.array([origin, origin + u, origin + np.cross(u, normal)])
+
+
+def test_ellipsoid_is_valid():
+    ellipsoid = primitives.EllipsoidBrush(np.array([0., 0, 0]),
+                                          np.array([128., 128, 128]))
+    report = validate.validate(ellipsoid)
+    assert report.ok, str(report)
+    assert report.num_faces >= 256
+
+
+# wall clock timings depend on the machine, they are only checked on request
+@pytest.mark.skipif(not os.environ.get("ASSETGEN_BENCHMARK"),
+                    reason="set ASSETGEN_BENCHMARK=1 to run benchmarks")
+def test_benchmark_validate_ellipsoids():
+    ellipsoids = [primitives.EllipsoidBrush(np.array([i*300., 0, 0]),
+                                            np.array([256., 256, 256]))
+                  for i in range(20)]
+    start = time.perf_counter()
+    report = validate.validate(ellipsoids)
+    elapsed = time.perf_counter() - start
+    assert report.ok, str(report)
+    assert elapsed < 5.0
+
+
+def test_clipped_vertices_match_triples():
+    # a cube cut by many planes which miss it, with one redundant plane
+    rng = np.random.default_rng(0)
+    normals = np.concatenate([np.eye(3), -np.eye(3),
+                              rng.normal(size=(14, 3))])
+    normals /= np.linalg.norm(normals, axis=1)[:, None]
+    dists = np.concatenate([np.full(6, 64.), np.full(14, 200.)])
+    dists[-1] = np.abs(normals[-1]).sum()*64
+    assert len(dists) > geometry.TRIPLE_LIMIT
+    points, valid, _, unbounded = geometry.polytope_vertices(
+        normals[None], dists[None], with_unbounded=True)
+    corners = np.unique(np.round(points[0][valid[0]], 6), axis=0)
+    assert not unbounded[0]
+    assert len(corners) == 8
+    assert np.allclose(np.abs(corners), 64)
+
+
+def test_unbounded_brush_with_many_planes():
+    angles = np.linspace(0, 2*np.pi, 16, endpoint=False)
+    # a prism open at the bottom
+    normals = np.stack([np.cos(angles), np.sin(angles),
+                        np.zeros_like(angles)], axis=1)
+    normals = np.concatenate([normals, [[0, 0, 1]]])
+    report = validate.validate_arrays(
+        [17], np.stack([_face_verts(n, 64.) for n in normals]))
+    assert not report.ok
+    assert len(report.brushes["unbounded"]) == 1
@@ -0,0 +1,199 @@
+# Asset Generator
+# Copyright (C) <2019>  <Sebastian Schmidt>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Validation of brush geometry before it is written into a .map file.
+
+All brushes with the same number of faces are checked together:
+    degenerate_faces  plane points are collinear (zero normal)
+    duplicate_planes  two faces of a brush lie on the same plane
+    too_few_planes    less than 4 distinct planes
+    empty             the planes don't enclose any point, e.g. after
+                      cutting away everything or flipping a face
+    unbounded         the brush is open to some direction, e.g. after
+                      flipping a face
+    redundant_faces   a face doesn't touch the brush (warning only,
+                      q3map2 drops these faces)
+"""
+
+import numpy as np
+import baseclasses
+import geometry
+from geometry import EPSILON
+
+
+ERRORS = ("degenerate_faces", "duplicate_planes", "too_few_planes", "empty",
+          "unbounded")
+WARNINGS = ("redundant_faces",)
+
+
+class ValidationReport(object):
+    """
+    Result of a validation, brushes are numbered in the order of
+    baseclasses.iter_brushes, faces are numbered over all brushes
+    """
+
+    def __init__(self, counts, brushes, faces):
+        """
+        \brief Create a report
+        \param counts number of faces of every brush
+        \param brushes dictionary issue -> sorted brush indices
+        \param faces dictionary issue -> sorted face indices, for the issues
+        concerning single faces
+        """
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.brushes = brushes
+        self.faces = faces
+
+    @property
+    def num_brushes(self):
+        return len(self.counts)
+
+    @property
+    def num_faces(self):
+        return int(self.counts.sum())
+
+    @property
+    def ok(self):
+        """
+        \brief True if there are no errors, warnings are ignored
+        """
+        return not any(len(self.brushes[issue]) for issue in ERRORS)
+
+    def invalid_brushes(self):
+        """
+        \brief Sorted indices of all brushes with errors
+        """
+        return np.unique(np.concatenate([self.brushes[issue]
+                                         for issue in ERRORS]))
+
+    def brush_of_face(self, faces):
+        """
+        \brief Convert face indices into brush indices
+        """
+        return np.searchsorted(np.cumsum(self.counts), faces, side="right")
+
+    def as_dict(self):
+        """
+        \brief Report as a dictionary of lists, e.g. for json
+        """
+        return {"brushes": self.num_brushes, "faces": self.num_faces,
+                "ok": self.ok,
+                "issues": {issue: {"brushes": brushes.tolist(),
+                                   "faces": self.faces[issue].tolist()
+                                   if issue in self.faces else None}
+                           for issue, brushes in self.brushes.items()}}
+
+    def __str__(self):
+        lines = ["{} brushes, {} faces: {}".format(
+            self.num_brushes, self.num_faces,
+            "ok" if self.ok else "{} invalid brushes".format(
+                len(self.invalid_brushes())))]
+        for issue in ERRORS + WARNINGS:
+            brushes = self.brushes[issue]
+            if len(brushes):
+                lines.append("    {}{}: brushes {}{}".format(
+                    "" if issue in ERRORS else "WARNING ", issue,
+                    " ".join(str(b) for b in brushes[:10].tolist()),
+                    " ..." if len(brushes) > 10 else ""))
+        return "\n".join(lines)
+
+
+def _check_group(normals, dists, points, valid, unbounded, eps):
+    """
+    \brief Check brushes with the same number of faces
+    \param normals outward unit normals, shape (b, f, 3)
+    \param dists plane distances, shape (b, f)
+    \param points vertices from geometry.polytope_vertices, shape (b, v, 3)
+    \param valid mask of the valid vertices, shape (b, v)
+    \param unbounded mask of the unbounded brushes, shape (b,)
+    \return dictionary issue -> mask of shape (b,) or (b, f)
+    """
+    b, f = dists.shape
+    degenerate = ~np.any(normals != 0, axis=2)
+    # faces lying on the same plane as an earlier face
+    same = (np.all(np.abs(normals[:, :, None] - normals[:, None]) < 1e-6,
+                   axis=3) &
+            (np.abs(dists[:, :, None] - dists[:, None]) <= eps))
+    same &= np.tri(f, k=-1, dtype=bool)
+    same &= ~degenerate[:, :, None]
+    duplicate = np.any(same, axis=2)
+    distinct = np.sum(~degenerate & ~duplicate, axis=1)
+
+    empty = ~valid[:, 0]
+    # a face is redundant if the vertices on its plane don't span an area
+    onplane = valid[:, None, :] & (np.abs(
+        np.einsum('bvk,bfk->bfv', points, normals) - dists[..., None]) <= eps)
+    num = np.maximum(onplane.sum(axis=2), 1)[..., None]
+    mean = np.einsum('bfv,bvk->bfk', onplane, points)/num
+    centered = (points[:, None] - mean[:, :, None])*onplane[..., None]
+    cov = np.einsum('bfvi,bfvj->bfij', centered, centered)
+    area = np.linalg.eigvalsh(cov)[..., 1] > eps**2
+    redundant = ~area & ~degenerate & ~duplicate
+    redundant &= ~(empty | unbounded)[:, None]
+    return {"degenerate_faces": degenerate, "duplicate_planes": duplicate,
+            "too_few_planes": distinct < 4, "empty": empty,
+            "unbounded": unbounded & ~empty, "redundant_faces": redundant}
+
+
+def validate_arrays(counts, verts, eps=EPSILON, chunksize=2**20):
+    """
+    \brief Validate brushes given as face arrays
+    \param counts number of faces of every brush
+    \param verts plane points of all faces, shape (n, 3, 3)
+    \param chunksize maximum number of face/vertex pairs checked at once
+    \return ValidationReport
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    poly = geometry.Polytopes(counts, verts, eps)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+    brushes = {issue: [] for issue in ERRORS + WARNINGS}
+    faces = {issue: [] for issue in ("degenerate_faces", "duplicate_planes",
+                                     "redundant_faces")}
+    for group in poly.groups:
+        b, v = group["valid"].shape
+        f = group["dists"].shape[1]
+        # keep the (b, f, v, 3) arrays of the checks small
+        step = max(1, chunksize//max(f*v, 1))
+        for c in range(0, b, step):
+            part = slice(c, c + step)
+            indices = group["indices"][part]
+            checks = _check_group(group["normals"][part],
+                                  group["dists"][part], group["points"][part],
+                                  group["valid"][part],
+                                  group["unbounded"][part], eps)
+            for issue, mask in checks.items():
+                if mask.ndim == 2:
+                    faces[issue].append((starts[indices][:, None] +
+                                         np.arange(mask.shape[1]))[mask])
+                    mask = np.any(mask, axis=1)
+                brushes[issue].append(indices[mask])
+    brushes = {issue: np.sort(np.concatenate(ids + [[]]).astype(np.int64))
+               for issue, ids in brushes.items()}
+    faces = {issue: np.sort(np.concatenate(ids + [[]]).astype(np.int64))
+             for issue, ids in faces.items()}
+    return ValidationReport(counts, brushes, faces)
+
+
+def validate(obj, eps=EPSILON):
+    """
+    \brief Check all brushes of an object
+    \param obj brush, primitive, modifier or an iterable of those
+    \param eps tolerance in map units
+    \return ValidationReport
+    """
+    arrays = baseclasses.face_arrays(baseclasses.iter_brushes(obj))
+    return validate_arrays(arrays["counts"], arrays["verts"], eps)